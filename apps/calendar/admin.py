@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from models import Calendar, Event, Attendee, Account
+from models import Calendar, Event, Attendee, Account, SyncJob, DailyRollup, Topic, CoAttendance
 
 
 class AttendeesInline(admin.TabularInline):
@@ -44,3 +44,38 @@ class AttendeeAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Attendee, AttendeeAdmin)
+
+
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = ['user', 'status', 'attempts', 'events_synced', 'created_at', 'finished_at']
+    list_filter = ['status', 'user']
+
+
+admin.site.register(SyncJob, SyncJobAdmin)
+
+
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['calendar', 'day', 'time_spent_seconds', 'busy_seconds', 'meetings']
+    list_filter = ['calendar']
+
+
+admin.site.register(DailyRollup, DailyRollupAdmin)
+
+
+class CoAttendanceAdmin(admin.ModelAdmin):
+    list_display = ['calendar', 'month', 'account', 'meetings']
+    list_filter = ['calendar']
+
+
+admin.site.register(CoAttendance, CoAttendanceAdmin)
+
+
+class TopicAdmin(admin.ModelAdmin):
+    """
+    Run 'reclassify_topics' after changing Topics to retag stored Events
+    """
+    list_display = ['name', 'terms', 'updated_at']
+    search_fields = ['name', 'terms']
+
+
+admin.site.register(Topic, TopicAdmin)
@@ -1,16 +1,123 @@
 from __future__ import absolute_import
 
-from datetime import datetime
+import calendar
+import json
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from itertools import islice
 
+import numpy as np
 import pandas as pd
 import pytz
 from dateutil.relativedelta import relativedelta
-from django.db.models import Count
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Case, Count, DurationField, ExpressionWrapper, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from apps.calendar.models import Calendar, Attendee
+from apps.calendar.cache import get_analytics_cache, get_analytics_cache_key
+from apps.calendar.intervals import busy_time_by_bucket, busy_time_by_interval, to_epoch_seconds
+from apps.calendar.models import Account, Calendar, Attendee, CoAttendance, DailyRollup, Topic
+from apps.calendar.snapshots import load_snapshot
+from apps.calendar.team import compute_team_analytics
+from apps.calendar.topics import TopicMatcher, load_matcher
+from apps.calendar.utils import chunks
+
+
+MONTH_NAMES = np.array([datetime(2000, month, 1).strftime('%B') if month else ''
+                        for month in range(13)])
+WEEK_NUMBERS = np.array(['%02d' % week for week in range(54)])
+
+# granularities of AnalyticsRangeAPIView and the step between their buckets
+BUCKET_STEPS = OrderedDict([
+    ('day', relativedelta(days=1)),
+    ('week', relativedelta(weeks=1)),
+    ('month', relativedelta(months=1)),
+    ('quarter', relativedelta(months=3)),
+])
+GRANULARITIES = tuple(BUCKET_STEPS)
+# union, double booked and conflicting time of meetings, see busy_time_by_bucket
+INTERVAL_METRICS = ('busy_time', 'overlap_time', 'conflict_time')
+SERIES_METRICS = ('time_spent', 'meetings', 'avg_time') + INTERVAL_METRICS
+
+
+def build_events_frame(rows):
+    """
+    Compact frame of events, times are int64 seconds since epoch
+    and repeated titles are stored once as categories
+    :param rows: [(title, start_time, end_time)] with aware datetimes
+    :return:
+    title       start       end         time_spent
+    category    epoch secs  epoch secs  in seconds
+    """
+    titles, starts, ends = zip(*rows) if rows else ((), (), ())
+    start, end = to_epoch_seconds(starts), to_epoch_seconds(ends)
+    return pd.DataFrame({'title': pd.Categorical(titles),
+                         'start': start,
+                         'end': end,
+                         'time_spent': end - start},
+                        columns=['title', 'start', 'end', 'time_spent'])
+
+
+def build_snapshot_frame(snapshot):
+    """
+    Frame of build_events_frame from 'start', 'end' and 'title' columns of a snapshot
+    :param snapshot: <EventSnapshot obj>
+    """
+    start, end = np.asarray(snapshot.columns['start']), np.asarray(snapshot.columns['end'])
+    return pd.DataFrame({'title': pd.Categorical.from_codes(np.asarray(snapshot.columns['title']), snapshot.titles),
+                         'start': start,
+                         'end': end,
+                         'time_spent': end - start},
+                        columns=['title', 'start', 'end', 'time_spent'])
+
+
+def get_bucket_start(day, granularity):
+    """
+    First day of bucket of a day, weeks start on Monday
+    :param day: <date obj>
+    :param granularity: one of GRANULARITIES
+    :return: <date obj>
+    """
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+
+
+def get_bucket_starts(first_day, last_day, granularity):
+    """
+    First days of all buckets from the one of 'first_day' to the one of 'last_day'
+    """
+    step = BUCKET_STEPS[granularity]
+    start = get_bucket_start(first_day, granularity)
+    while start <= last_day:
+        yield start
+        start += step
+
+
+def sum_by_topic(time_spent_by_title, matcher):
+    """
+    Sums time spent per title into Topics
+    :param time_spent_by_title: [('Interview (Lead)', 4500)]
+    :param matcher: <TopicMatcher obj>
+    :return: {'recruit': 4500, 'standup': 0, ...}
+    """
+    time_spent = dict.fromkeys(matcher.topics, 0)
+    for title, seconds in time_spent_by_title:
+        for topic in matcher.match(title):
+            time_spent[topic] += int(seconds)
+    return time_spent
 
 
 class AnalyticsAPIView(APIView):
@@ -21,35 +128,117 @@ class AnalyticsAPIView(APIView):
     def get(self, request):
         user = request.user
 
-        ca = CalendarAnalytics(user)
+        # ranges start at midnight so results stay valid, and cached, for the day
+        tz = pytz.timezone('Asia/Kolkata')
+        today = tz.localize(datetime.combine(datetime.now(tz=tz).date(), time()))
+        ca = get_calendar_analytics(user, from_time=today - relativedelta(months=24))
 
-        data = {}
-        dt_3_months = datetime.now(tz=pytz.timezone('Asia/Kolkata')) - relativedelta(months=3)
-        dt_12_months = datetime.now(tz=pytz.timezone('Asia/Kolkata')) - relativedelta(months=12)
+        dt_3_months = today - relativedelta(months=3)
+        dt_12_months = today - relativedelta(months=12)
 
-        stats_12_months = ca.total_time_spent_by_month(from_time=dt_12_months)
-        data["month"] = {
-            "busy": max(stats_12_months, key=stats_12_months.get),
-            "relax": min(stats_12_months, key=stats_12_months.get),
-            "last_3_months": ca.total_time_spent_by_month(from_time=dt_3_months),
-        }
+        def compute():
+            return ca.report(from_time=dt_12_months, recent_from=dt_3_months)
 
-        stats_52_weeks = ca.total_time_spent_by_week(from_time=dt_12_months)
-        data["week"] = {
-            "busy": max(stats_52_weeks, key=stats_52_weeks.get),
-            "relax": min(stats_52_weeks, key=stats_52_weeks.get),
-            "avg_time": ca.avg_time_spent_by_week(from_time=dt_12_months),
-            "meetings_cnt": ca.avg_meetings_by_week(from_time=dt_12_months),
-        }
+        cache = get_analytics_cache()
+        if cache is None:
+            return Response(compute())
+        data, hit = cache.get_or_compute(get_analytics_cache_key(ca, today), compute)
+        return Response(data, headers={'X-Analytics-Cache': 'hit' if hit else 'miss'})
 
-        data['top_attendee'] = ca.max_meetings_with()[:3]
 
-        data["time_spent"] = {
-            'recruit': ca.time_spent_on(['Recruitment', 'Interview', 'Resume']),
-            'standup': ca.time_spent_on(['standup', 'Stand up', 'catch up']),
-            'zoom': ca.time_spent_on(['Zoom call']),
-            'operation': ca.time_spent_on(['Operation']),
-        }
+class AnalyticsRangeAPIView(APIView):
+    """
+    Metrics of User's meetings in any range of days, per day, week, month or quarter:
+    GET /analytics/range/?from=2019-01-01&to=2019-07-01&granularity=week&metrics=time_spent,meetings
+
+    'from' is inclusive and 'to' exclusive, both are days of Calendar's timezone.
+    Only events starting in the range are loaded, at most MAX_BUCKETS buckets
+    """
+    permission_classes = (IsAuthenticated,)
+    MAX_BUCKETS = 1000
+
+    def get(self, request):
+        params = request.query_params
+        from_day, to_day = parse_day(params, 'from'), parse_day(params, 'to')
+        if from_day >= to_day:
+            raise ValidationError({'to': "Must be after 'from'"})
+        granularity = params.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            raise ValidationError({'granularity': "One of %s" % ', '.join(GRANULARITIES)})
+        last_day = to_day - timedelta(days=1)
+        try:
+            # end of the last bucket is an edge of the series
+            get_bucket_start(last_day, granularity) + BUCKET_STEPS[granularity]
+        except (OverflowError, ValueError):
+            raise ValidationError({'to': "Last %s must end before %s" % (granularity, date.max.isoformat())})
+        buckets = islice(get_bucket_starts(from_day, last_day, granularity), self.MAX_BUCKETS + 1)
+        if sum(1 for _ in buckets) > self.MAX_BUCKETS:
+            raise ValidationError({'to': "At most %s %s buckets from 'from'" % (self.MAX_BUCKETS, granularity)})
+        metrics = [metric for metric in params.get('metrics', ','.join(SERIES_METRICS)).split(',') if metric]
+        unknown = [metric for metric in metrics if metric not in SERIES_METRICS]
+        if unknown or not metrics:
+            raise ValidationError({'metrics': "Comma separated list of %s" % ', '.join(SERIES_METRICS)})
+
+        ca = get_calendar_analytics(request.user, from_time=datetime.combine(from_day, time()),
+                                    to_time=datetime.combine(to_day, time()))
+
+        def compute():
+            return {
+                'from': from_day.isoformat(),
+                'to': to_day.isoformat(),
+                'granularity': granularity,
+                'timezone': ca.calander.timezone,
+                'buckets': ca.series(granularity, metrics),
+            }
+
+        cache = get_analytics_cache()
+        if cache is None:
+            return Response(compute())
+        key = get_analytics_cache_key(ca, ca.from_time, name='range:%s:%s:%s' % (
+            ca.to_time.isoformat(), granularity, ','.join(metrics)))
+        data, hit = cache.get_or_compute(key, compute)
+        return Response(data, headers={'X-Analytics-Cache': 'hit' if hit else 'miss'})
+
+
+def parse_day(params, name):
+    """
+    Required date query parameter
+    :param params: request.query_params
+    :param name: 'from'
+    :return: <date obj>
+    """
+    value = params.get(name)
+    try:
+        day = parse_date(value) if value else None
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: "Date as YYYY-MM-DD is required"})
+    return day
+
+
+class TeamAnalyticsAPIView(APIView):
+    """
+    Analytics of the organisation or of a team, for admins:
+    GET /analytics/team/?from=2019-01-01&to=2019-07-01&emails=a@a.com,b@b.com
+
+    All Users with a Calendar if 'emails' is not given. Computed from daily
+    rollups on a pool of settings.TEAM_ANALYTICS_PROCESSES processes
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        params = request.query_params
+        from_day, to_day = parse_day(params, 'from'), parse_day(params, 'to')
+        if from_day >= to_day:
+            raise ValidationError({'to': "Must be after 'from'"})
+        users = User.objects.filter(calendar__isnull=False)
+        emails = [email.strip() for email in params.get('emails', '').split(',') if email.strip()]
+        if emails:
+            users = users.filter(email__in=emails)
+        data = compute_team_analytics(set(users.values_list('pk', flat=True)), from_day, to_day,
+                                      processes=settings.TEAM_ANALYTICS_PROCESSES)
+        data.update({'from': from_day.isoformat(), 'to': to_day.isoformat()})
         return Response(data)
 
 
@@ -60,74 +249,234 @@ class CalendarAnalytics(object):
     """
 
     def __init__(self, user, months=24, from_time=None, to_time=None):
+        """
+        :param months: loaded months before 'to_time' if 'from_time' is not given
+        :param from_time: <DateTime obj> events starting from it are loaded
+        :param to_time: <DateTime obj> events starting before it are loaded, no bound if None
+        naive datetimes are taken in Calendar's timezone
+        """
         self.user = user
-        self.calander = Calendar.objects.get(user=user)
+        self.calander = Calendar.get_primary(user)
         self.timezone = pytz.timezone(self.calander.timezone or 'UTC')
         # from_datetime to to_datetime used to fetch events in specific duration
         to_datetime = to_time or datetime.today()
-        from_datetime = from_time or to_datetime - relativedelta(months=months)
+        from_datetime = self._localize(from_time or to_datetime - relativedelta(months=months))
+        self.from_time = from_datetime
+        self.to_time = self._localize(to_time) if to_time else None
 
         self.events = self.calander.event_set.filter(
             start_time__gte=from_datetime
         )
+        if self.to_time:
+            self.events = self.events.filter(start_time__lt=self.to_time)
 
-    def max_meetings_with(self):
+    def max_meetings_with(self, limit=None, from_time=None, to_time=None):
         """
         Returns list of people whom user had attended maximum meetings
+        :param limit: number of people, all if None
+        :param from_time: <DateTime obj>
+        :param to_time: <DateTime obj>
         :return: [{email: "a@a.com", count: 23}]
         """
-        attendees = Attendee.objects.filter(event__in=self.events) \
+        events = self.events
+        if from_time:
+            events = events.filter(start_time__gt=from_time)
+        if to_time:
+            events = events.filter(end_time__lt=to_time)
+        attendees = Attendee.objects.filter(event__in=events) \
             .values('account__email') \
             .exclude(account__email=self.user.email) \
             .annotate(count=Count('account__email')) \
-            .order_by('-count')
+            .order_by('-count', 'account__email')
 
         return [{'email': attendee["account__email"],
                  'count': attendee["count"]}
-                for attendee in attendees]
+                for attendee in attendees[:limit]]
 
     # used cached_property to reused this df again and again
     @cached_property
     def _events_df(self):
         """
         Converts instance's events to DataFrame
-        :return:
-        id  title  start_time  end_time     time_spent
-        1    xx    timsestamp  timsestamp   in seconds
-        """
-        data = self.events.values_list("id",
-                                       "title",
-                                       "start_time",
-                                       "end_time")
-
-        df = pd.DataFrame(data, columns=['id', 'title', 'start_time', 'end_time'])
-        # Convert start_time and start_time and end_time to  calander's timezone
-        df['start_time'] = df['start_time'].dt.tz_convert(self.timezone)
-        df['end_time'] = df['end_time'].dt.tz_convert(self.timezone)
-        # add new column 'time_spent' which stores time duration of meeting
-        df["time_spent"] = df.apply(lambda row: self._get_duration(row['start_time'], row['end_time']), axis=1)
-        return df
+        :return: see build_events_frame
+        """
+        return build_events_frame(self.events.values_list("title", "start_time", "end_time"))
+
+    def _localize(self, dt):
+        """
+        Aware datetime, naive datetime is taken in Calendar's timezone
+        """
+        if timezone.is_naive(dt):
+            dt = self.timezone.localize(dt)
+        return dt
+
+    def _local_day(self, dt):
+        return self._localize(dt).astimezone(self.timezone).date()
+
+    def _to_epoch(self, dt):
+        """
+        Seconds since epoch, naive datetime is taken in Calendar's timezone
+        """
+        return calendar.timegm(self._localize(dt).utctimetuple())
+
+    def _local_starts(self, df):
+        return pd.to_datetime(df['start'].values, unit='s', utc=True).tz_convert(self.timezone)
+
+    def _bucket_keys(self, df, bucket_format, local=None):
+        """
+        Month names or week numbers of events' start in Calendar's timezone,
+        same as strftime of '%B' and '%W'
+        :param df: frame of events
+        :param bucket_format: '%B' or '%W'
+        :param local: output of _local_starts(df) if already computed
+        :return: <numpy array> of keys
+        """
+        local = self._local_starts(df) if local is None else local
+        if bucket_format == '%B':
+            return MONTH_NAMES[local.month]
+        # weeks start on Monday, days before first Monday of year are week 00
+        return WEEK_NUMBERS[(local.dayofyear - 1 + 7 - local.dayofweek) // 7]
+
+    def _days(self, from_time, to_time):
+        """
+        Time spent and meetings per day of Calendar's timezone
+        :return: [(<date obj>, seconds, count)]
+        """
+        df = self._filter_df_by_duration(from_time, to_time)
+        local = self._local_starts(df)
+        grouped = df['time_spent'].groupby(local.year * 10000 + local.month * 100 + local.day) \
+            .agg(['sum', 'count'])
+        return [(date(key // 10000, key // 100 % 100, key % 100), int(seconds), int(count))
+                for key, seconds, count in zip(grouped.index, grouped['sum'], grouped['count'])]
+
+    def series(self, granularity, metrics=SERIES_METRICS):
+        """
+        Metrics of loaded events per bucket of Calendar's timezone, buckets
+        without meetings are included so the series has no gaps
+        :param granularity: one of GRANULARITIES
+        :param metrics: subset of SERIES_METRICS
+        :return: [{'start': '2019-06-10', 'time_spent': 3600, 'meetings': 1, 'avg_time': 3600.0,
+                   'busy_time': 3600, 'overlap_time': 0, 'conflict_time': 0}]
+        see busy_time_by_bucket for INTERVAL_METRICS, they clip meetings to buckets
+        """
+        last_day = self._local_day(self.to_time - timedelta(microseconds=1) if self.to_time
+                                   else timezone.now())
+        buckets = OrderedDict((start, [0, 0]) for start
+                              in get_bucket_starts(self._local_day(self.from_time), last_day, granularity))
+        for day, seconds, count in self._days(None, None):
+            day = day.date() if isinstance(day, datetime) else day
+            bucket = buckets.setdefault(get_bucket_start(day, granularity), [0, 0])
+            bucket[0] += seconds
+            bucket[1] += count
+        starts = sorted(buckets)
+
+        values = {
+            'time_spent': lambda index, seconds, count: seconds,
+            'meetings': lambda index, seconds, count: count,
+            'avg_time': lambda index, seconds, count: float(seconds) / count if count else 0.0,
+        }
+        if set(metrics) & set(INTERVAL_METRICS):
+            edges = [self._to_epoch(datetime.combine(start, time())) for start in starts]
+            edges.append(self._to_epoch(datetime.combine(starts[-1] + BUCKET_STEPS[granularity], time())))
+            for metric, times in zip(INTERVAL_METRICS, busy_time_by_bucket(*(self._intervals() + (edges,)))):
+                values[metric] = lambda index, seconds, count, times=times: int(times[index])
+
+        series = []
+        for index, start in enumerate(starts):
+            seconds, count = buckets[start]
+            bucket = {'start': start.isoformat()}
+            for metric in metrics:
+                bucket[metric] = values[metric](index, seconds, count)
+            series.append(bucket)
+        return series
+
+    def _intervals(self):
+        """
+        Loaded events as intervals
+        :return: (starts, ends) int64 arrays of seconds since epoch
+        """
+        df = self._events_df
+        return df['start'].values, df['end'].values
+
+    def _busy_by_interval(self, starts, ends):
+        """
+        Share of each event in the busy time of its day of Calendar's timezone,
+        see busy_time_by_interval
+        :param starts: int64 array of seconds since epoch
+        :param ends: int64 array of seconds since epoch
+        :return: int64 array
+        """
+        local = pd.to_datetime(starts, unit='s', utc=True).tz_convert(self.timezone)
+        return busy_time_by_interval(local.year * 10000 + local.month * 100 + local.day, starts, ends)
 
-    def _get_duration(self, start_time, end_time):
+    def _report_buckets(self, from_time, recent_from):
         """
-        Gets start_time and end_time, and returns
-        time duration in 'SECONDS'
-        :param start_time: <TimeStamp obj>
-        :param end_time: <TimeStamp obj>
-        :return: 123123 in Seconds
+        Time spent, busy time and meetings of events starting after 'from_time'
+        grouped by month, week and whether they start after 'recent_from',
+        month and week keys are computed once and grouped in one groupby
+        :return: [(month, week, recent, seconds, busy, count)]
         """
-        duration = end_time - start_time
-        return int(duration.total_seconds())
+        df = self._filter_df_by_duration(from_time, None)
+        local = self._local_starts(df)
+        keys = [self._bucket_keys(df, '%B', local),
+                self._bucket_keys(df, '%W', local),
+                df['start'].values > self._to_epoch(recent_from)]
+        frame = pd.DataFrame({'time_spent': df['time_spent'].values,
+                              'busy': self._busy_by_interval(df['start'].values, df['end'].values)})
+        grouped = frame.groupby(keys)
+        totals, counts = grouped.sum(), grouped.size()
+        return [(month, week, bool(recent), int(seconds), int(busy), int(count))
+                for (month, week, recent), seconds, busy, count
+                in zip(totals.index, totals['time_spent'], totals['busy'], counts)]
+
+    def report(self, from_time, recent_from):
+        """
+        Whole AnalyticsAPIView payload, events are bucketed once and every
+        metric is rolled up from these buckets. Time of months and weeks is
+        busy time, overlapping meetings of a day are counted once, and
+        'avg_time' is the average duration of a meeting
+        :param from_time: <DateTime obj> start of month and week stats
+        :param recent_from: <DateTime obj> start of 'last_3_months'
+        :return: {'month': {...}, 'week': {...}, 'top_attendee': [...], 'time_spent': {...}}
+        """
+        months, recent_months, weeks, week_time, week_meetings = {}, {}, {}, {}, {}
+        for month, week, recent, seconds, busy, count in self._report_buckets(from_time, recent_from):
+            months[month] = months.get(month, 0) + busy
+            if recent:
+                recent_months[month] = recent_months.get(month, 0) + busy
+            weeks[week] = weeks.get(week, 0) + busy
+            week_time[week] = week_time.get(week, 0) + seconds
+            week_meetings[week] = week_meetings.get(week, 0) + count
+
+        return {
+            "month": {
+                "busy": max(months, key=months.get),
+                "relax": min(months, key=months.get),
+                "last_3_months": recent_months,
+            },
+            "week": {
+                "busy": max(weeks, key=weeks.get),
+                "relax": min(weeks, key=weeks.get),
+                "avg_time": dict((week, float(seconds) / week_meetings[week])
+                                 for week, seconds in week_time.items()),
+                "meetings_cnt": week_meetings,
+            },
+            'top_attendee': self.max_meetings_with(limit=3),
+            "time_spent": self.time_spent_by_topic(),
+        }
 
     def _search_meetings(self, search_list):
         """
-        Search all meetings for letters provided
+        Search all meetings for letters provided, ignoring case
         :param search_list: ['str1', 'str2']
         :return: Return DataFrame
         """
         df = self._events_df
-        df = df[df['title'].str.contains('|'.join(search_list))]
-        return df
+        matcher = TopicMatcher(OrderedDict([('search', search_list)]))
+        titles = df['title'].cat
+        # every distinct title is matched once
+        found = np.array([bool(matcher.match(title)) for title in titles.categories], dtype=bool)
+        return df[found[titles.codes]]
 
     def time_spent_on(self, search_list):
         """
@@ -139,6 +488,18 @@ class CalendarAnalytics(object):
         df = self._search_meetings(search_list)
         return sum(df['time_spent'])
 
+    def time_spent_by_topic(self):
+        """
+        Returns time spent on each Topic in SECONDS,
+        every distinct title is classified once
+        :return: {'recruit': 3600, 'standup': 1800}
+        """
+        df = self._events_df
+        titles = df['title'].cat
+        per_title = np.bincount(titles.codes, weights=df['time_spent'].values,
+                                minlength=len(titles.categories))
+        return sum_by_topic(zip(titles.categories, per_title), load_matcher())
+
     def total_time_spent_by_month(self, from_time=None, to_time=None):
         """
         Returns Total time spent by MONTH for provided
@@ -149,7 +510,7 @@ class CalendarAnalytics(object):
                     'January': 261000}
         """
         df = self._filter_df_by_duration(from_time, to_time)
-        df = df.groupby(df['start_time'].dt.strftime('%B'))['time_spent'].sum()
+        df = df['time_spent'].groupby(self._bucket_keys(df, '%B')).sum()
         return df.to_dict()
 
     def total_time_spent_by_week(self, from_time=None, to_time=None):
@@ -162,7 +523,7 @@ class CalendarAnalytics(object):
                  '01': 261000}
         """
         df = self._filter_df_by_duration(from_time, to_time)
-        df = df.groupby(df['start_time'].dt.strftime('%W'))['time_spent'].sum()
+        df = df['time_spent'].groupby(self._bucket_keys(df, '%W')).sum()
         return df.to_dict()
 
     def avg_time_spent_by_week(self, from_time=None, to_time=None):
@@ -175,7 +536,7 @@ class CalendarAnalytics(object):
                  '01': 3600}
         """
         df = self._filter_df_by_duration(from_time, to_time)
-        df = df.groupby(df['start_time'].dt.strftime('%W'))['time_spent'].mean()
+        df = df['time_spent'].groupby(self._bucket_keys(df, '%W')).mean()
         return df.to_dict()
 
     def avg_meetings_by_week(self, from_time=None, to_time=None):
@@ -188,7 +549,7 @@ class CalendarAnalytics(object):
                  '01': 12}
         """
         df = self._filter_df_by_duration(from_time, to_time)
-        df = df.groupby(df['start_time'].dt.strftime('%W'))['time_spent'].agg('count')
+        df = df['time_spent'].groupby(self._bucket_keys(df, '%W')).agg('count')
         return df.to_dict()
 
     def _filter_df_by_duration(self, from_time, to_time):
@@ -200,7 +561,273 @@ class CalendarAnalytics(object):
         """
         df = self._events_df
         if from_time:
-            df = df[df['start_time'] > from_time]
+            df = df[df['start'].values > self._to_epoch(from_time)]
         if to_time:
-            df = df[df['end_time'] < to_time]
+            df = df[df['end'].values < self._to_epoch(to_time)]
         return df
+
+
+class SQLCalendarAnalytics(CalendarAnalytics):
+    """
+    CalendarAnalytics computed by the database, events are summed and
+    counted per day of Calendar's timezone and only these day buckets
+    are fetched, days are then rolled up into months and weeks.
+    Output is same as of CalendarAnalytics.
+
+    MySQL needs its timezone tables loaded for timezone conversion,
+    see mysql_tzinfo_to_sql
+    """
+
+    def _duration(self):
+        return ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())
+
+    def _filter_by_duration(self, from_time, to_time):
+        events = self.events
+        if from_time:
+            events = events.filter(start_time__gt=from_time)
+        if to_time:
+            events = events.filter(end_time__lt=to_time)
+        return events
+
+    def _days(self, from_time, to_time):
+        """
+        Time spent and meetings per day of Calendar's timezone
+        :return: [(<datetime obj of day>, seconds, count)]
+        """
+        days = self._filter_by_duration(from_time, to_time) \
+            .annotate(day=TruncDay('start_time', tzinfo=self.timezone)) \
+            .values('day') \
+            .annotate(time_spent=Sum(self._duration()), count=Count('id')) \
+            .order_by('day')
+        return [(day['day'], int(day['time_spent'].total_seconds()), day['count']) for day in days]
+
+    def _buckets(self, from_time, to_time, bucket_format):
+        """
+        Rolls days up into buckets
+        :param bucket_format: '%B' for month names, '%W' for week numbers
+        :return: {'bucket': [seconds, count]}
+        """
+        buckets = {}
+        for day, time_spent, count in self._days(from_time, to_time):
+            bucket = buckets.setdefault(day.strftime(bucket_format), [0, 0])
+            bucket[0] += time_spent
+            bucket[1] += count
+        return buckets
+
+    def _intervals(self):
+        rows = list(self.events.values_list('start_time', 'end_time'))
+        starts, ends = zip(*rows) if rows else ((), ())
+        return to_epoch_seconds(starts), to_epoch_seconds(ends)
+
+    def _report_buckets(self, from_time, recent_from):
+        """
+        Busy time is a union of intervals, which SQL does not aggregate,
+        it is computed from start and end of events
+        """
+        events = self._filter_by_duration(from_time, None)
+        recent = Case(When(start_time__gt=recent_from, then=Value(1)),
+                      default=Value(0), output_field=IntegerField())
+        days = events.annotate(day=TruncDay('start_time', tzinfo=self.timezone), recent=recent) \
+            .values('day', 'recent') \
+            .annotate(time_spent=Sum(self._duration()), count=Count('id')) \
+            .order_by('day')
+
+        rows = list(events.values_list('start_time', 'end_time'))
+        starts, ends = zip(*rows) if rows else ((), ())
+        starts, ends = to_epoch_seconds(starts), to_epoch_seconds(ends)
+        local = pd.to_datetime(starts, unit='s', utc=True).tz_convert(self.timezone)
+        keys = zip(local.year * 10000 + local.month * 100 + local.day, starts > self._to_epoch(recent_from))
+        busy = {}
+        for key, seconds in zip(keys, self._busy_by_interval(starts, ends).tolist()):
+            busy[key] = busy.get(key, 0) + seconds
+
+        return [(day['day'].strftime('%B'), day['day'].strftime('%W'), bool(day['recent']),
+                 int(day['time_spent'].total_seconds()),
+                 busy.get((day['day'].year * 10000 + day['day'].month * 100 + day['day'].day,
+                           bool(day['recent'])), 0),
+                 day['count']) for day in days]
+
+    def time_spent_by_topic(self):
+        """
+        Sums duration of Events per Topic tag set on ingestion
+        """
+        time_spent = dict.fromkeys(Topic.objects.values_list('name', flat=True), 0)
+        topics = self.events.filter(topic_tags__isnull=False) \
+            .values_list('topic_tags__topic__name') \
+            .annotate(time_spent=Sum(self._duration())) \
+            .order_by()
+        for topic, seconds in topics:
+            time_spent[topic] = int(seconds.total_seconds())
+        return time_spent
+
+    def time_spent_on(self, search_list):
+        """
+        Searches meeting for given Strings/Topics and
+        returns total time spent of it in SECONDS
+        :param search_list: ['str1', 'str2'], searched ignoring case
+        :return:
+        """
+        query = Q()
+        for term in search_list:
+            query |= Q(title__icontains=term)
+        total = self.events.filter(query).aggregate(time_spent=Sum(self._duration()))['time_spent']
+        return int(total.total_seconds()) if total else 0
+
+    def total_time_spent_by_month(self, from_time=None, to_time=None):
+        return dict((month, time_spent) for month, (time_spent, _)
+                    in self._buckets(from_time, to_time, '%B').items())
+
+    def total_time_spent_by_week(self, from_time=None, to_time=None):
+        return dict((week, time_spent) for week, (time_spent, _)
+                    in self._buckets(from_time, to_time, '%W').items())
+
+    def avg_time_spent_by_week(self, from_time=None, to_time=None):
+        return dict((week, float(time_spent) / count) for week, (time_spent, count)
+                    in self._buckets(from_time, to_time, '%W').items())
+
+    def avg_meetings_by_week(self, from_time=None, to_time=None):
+        return dict((week, count) for week, (_, count)
+                    in self._buckets(from_time, to_time, '%W').items())
+
+
+class RollupCalendarAnalytics(SQLCalendarAnalytics):
+    """
+    CalendarAnalytics summed from DailyRollup rows, at most one row per day
+    is read whatever the number of events. Ranges are resolved to whole days
+    of Calendar's timezone, i.e. a meeting starting on 'from_time's day
+    before 'from_time' is counted too.
+
+    Rollups are maintained on ingestion, existing events are backfilled by
+    migration 0016 and 'rebuild_rollups' recomputes them
+    """
+
+    def _rollups(self, from_time=None, to_time=None):
+        from_day = self._local_day(self.from_time)
+        if from_time:
+            from_day = max(from_day, self._local_day(from_time))
+        rollups = DailyRollup.objects.filter(calendar=self.calander, day__gte=from_day)
+        if to_time:
+            rollups = rollups.filter(day__lte=self._local_day(to_time))
+        if self.to_time:
+            rollups = rollups.filter(day__lte=self._last_day())
+        return rollups
+
+    def _last_day(self):
+        # to_time is exclusive, its day is loaded unless to_time is midnight
+        return self._local_day(self.to_time - timedelta(microseconds=1))
+
+    def max_meetings_with(self, limit=None, from_time=None, to_time=None):
+        """
+        Top attendees from CoAttendance counters, reads a row per month and
+        Account, ranges are resolved to whole months of Calendar's timezone
+        """
+        from_month = self._local_day(self.from_time).replace(day=1)
+        if from_time:
+            from_month = max(from_month, self._local_day(from_time).replace(day=1))
+        counters = CoAttendance.objects.filter(calendar=self.calander, month__gte=from_month)
+        if to_time:
+            counters = counters.filter(month__lte=self._local_day(to_time))
+        if self.to_time:
+            counters = counters.filter(month__lte=self._last_day())
+        attendees = counters.exclude(account__email=self.user.email) \
+            .values('account__email') \
+            .annotate(count=Sum('meetings')) \
+            .order_by('-count', 'account__email')
+
+        return [{'email': attendee["account__email"],
+                 'count': attendee["count"]}
+                for attendee in attendees[:limit]]
+
+    def _days(self, from_time, to_time):
+        return list(self._rollups(from_time, to_time).order_by('day')
+                    .values_list('day', 'time_spent_seconds', 'meetings'))
+
+    def _report_buckets(self, from_time, recent_from):
+        recent_day = self._local_day(recent_from)
+        return [(day.strftime('%B'), day.strftime('%W'), day >= recent_day, seconds, busy, count)
+                for day, seconds, busy, count in self._rollups(from_time).order_by('day')
+                .values_list('day', 'time_spent_seconds', 'busy_seconds', 'meetings')]
+
+    def time_spent_by_topic(self):
+        time_spent = dict.fromkeys(Topic.objects.values_list('name', flat=True), 0)
+        for topic_seconds in self._rollups().values_list('topic_seconds', flat=True):
+            for topic, seconds in json.loads(topic_seconds).items():
+                if topic in time_spent:
+                    time_spent[topic] += seconds
+        return time_spent
+
+
+class SnapshotCalendarAnalytics(CalendarAnalytics):
+    """
+    CalendarAnalytics of the columnar snapshot of Calendar's events, see
+    apps.calendar.snapshots. Snapshot files are memory mapped, only columns
+    a metric needs are opened and only rows in range are read, so events
+    are not fetched from database. Output is same as of CalendarAnalytics.
+
+    Snapshots are patched on ingestion and rebuilt on load when stale
+    """
+
+    def _snapshot(self, columns):
+        """
+        Rows of loaded events
+        :param columns: subset of SNAPSHOT_COLUMNS
+        :return: <EventSnapshot obj>
+        """
+        return load_snapshot(self.calander, columns).slice(
+            self._to_epoch(self.from_time), self._to_epoch(self.to_time) if self.to_time else None)
+
+    @cached_property
+    def _events_df(self):
+        return build_snapshot_frame(self._snapshot(('start', 'end', 'title')))
+
+    def max_meetings_with(self, limit=None, from_time=None, to_time=None):
+        """
+        Counts attendees column of events in range, only emails
+        of counted Accounts are read from database
+        """
+        snapshot = self._snapshot(('start', 'end', 'attendees'))
+        offsets, accounts = snapshot.columns['attendees']
+        selected = np.ones(len(snapshot), dtype=bool)
+        if from_time:
+            selected &= np.asarray(snapshot.columns['start']) > self._to_epoch(from_time)
+        if to_time:
+            selected &= np.asarray(snapshot.columns['end']) < self._to_epoch(to_time)
+        rows = np.repeat(np.arange(len(snapshot)), np.diff(offsets))
+        counts = np.bincount(np.asarray(accounts)[selected[rows]])
+
+        attendees = []
+        for chunk in chunks(np.flatnonzero(counts).tolist()):
+            attendees.extend((email, int(counts[pk])) for pk, email
+                             in Account.objects.filter(pk__in=chunk).exclude(email=self.user.email)
+                             .values_list('pk', 'email'))
+        attendees.sort(key=lambda attendee: (-attendee[1], attendee[0]))
+        return [{'email': email, 'count': count} for email, count in attendees[:limit]]
+
+    def time_spent_by_topic(self):
+        """
+        Sums duration of events per Topic tag set on ingestion
+        """
+        snapshot = self._snapshot(('start', 'end', 'topics'))
+        offsets, topic_ids = snapshot.columns['topics']
+        time_spent = np.asarray(snapshot.columns['end']) - np.asarray(snapshot.columns['start'])
+        per_topic = np.bincount(np.asarray(topic_ids), weights=np.repeat(time_spent, np.diff(offsets)))
+        return dict((name, int(per_topic[pk]) if pk < len(per_topic) else 0)
+                    for pk, name in Topic.objects.values_list('pk', 'name'))
+
+
+ANALYTICS_BACKENDS = {
+    'pandas': CalendarAnalytics,
+    'sql': SQLCalendarAnalytics,
+    'rollup': RollupCalendarAnalytics,
+    'snapshot': SnapshotCalendarAnalytics,
+}
+
+
+def get_calendar_analytics(user, **kwargs):
+    """
+    Analytics of User's primary Calendar computed by
+    settings.CALENDAR_ANALYTICS_BACKEND
+    :param user: <User> instance
+    :return: <CalendarAnalytics obj>
+    """
+    return ANALYTICS_BACKENDS[settings.CALENDAR_ANALYTICS_BACKEND](user, **kwargs)
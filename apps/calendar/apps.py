@@ -1,6 +1,25 @@
+from __future__ import absolute_import
+
 from django.apps import AppConfig
 
 
 class CalenderAnalyticsConfig(AppConfig):
     name = 'apps.calendar'
     verbose_name = 'Calender Analytics'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from apps.calendar import cache, rollups, snapshots
+        from apps.calendar.models import Topic
+        from apps.calendar.signals import events_ingested
+
+        events_ingested.connect(rollups.update_rollups, dispatch_uid='calendar.update_rollups')
+        events_ingested.connect(cache.invalidate_analytics, dispatch_uid='calendar.invalidate_analytics')
+        # reads data_version bumped by invalidate_analytics
+        events_ingested.connect(snapshots.update_snapshots, dispatch_uid='calendar.update_snapshots')
+
+        post_save.connect(cache.invalidate_topic_analytics, sender=Topic,
+                          dispatch_uid='calendar.invalidate_topic_analytics.save')
+        post_delete.connect(cache.invalidate_topic_analytics, sender=Topic,
+                            dispatch_uid='calendar.invalidate_topic_analytics.delete')
@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+
+import heapq
+from datetime import datetime
+
+import numpy as np
+import pytz
+from django.contrib.auth.models import User
+
+from apps.calendar.intervals import merge_intervals, to_epoch_seconds
+from apps.calendar.models import Account, Attendee, Event, DECLINED
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def get_epoch_seconds(dt):
+    """
+    :param dt: aware datetime
+    """
+    return int((dt - EPOCH).total_seconds())
+
+
+def load_busy_index(emails, window_start, window_end):
+    """
+    Busy time of participants in a window, from events of their primary
+    Calendars and events they attend and did not decline. Events of other
+    synced Calendars, i.e. shared team Calendars, do not make a participant
+    busy. Each participant's busy
+    time is merged into sorted disjoint intervals.
+    Number of queries does not depend on number of participants.
+    :param emails: ['a@a.com'] of Users or Accounts
+    :param window_start: aware datetime
+    :param window_end: aware datetime
+    :return: ({'a@a.com': (starts, ends)} int64 arrays of seconds since epoch,
+              set of emails neither synced nor attending any event)
+    """
+    emails = set(emails)
+    overlapping = {'start_time__lt': window_end, 'end_time__gt': window_start}
+    rows = list(Event.objects.filter(calendar__user__email__in=emails, calendar__is_primary=True, **overlapping)
+                .values_list('calendar__user__email', 'start_time', 'end_time').distinct())
+    rows += list(Attendee.objects.filter(account__email__in=emails,
+                                         **dict(('event__' + key, value) for key, value in overlapping.items()))
+                 .exclude(rsvp=DECLINED)
+                 .values_list('account__email', 'event__start_time', 'event__end_time'))
+
+    known = set(User.objects.filter(email__in=emails, calendar__isnull=False).values_list('email', flat=True))
+    known.update(Account.objects.filter(email__in=emails).values_list('email', flat=True))
+
+    index = {}
+    if rows:
+        owners, starts, ends = zip(*rows)
+        starts, ends = to_epoch_seconds(starts), to_epoch_seconds(ends)
+        # rows grouped by participant with one sort
+        participants, owner = np.unique(np.array(owners, dtype=object), return_inverse=True)
+        order = np.argsort(owner, kind='mergesort')
+        bounds = np.searchsorted(owner[order], np.arange(len(participants) + 1))
+        for number, email in enumerate(participants):
+            mine = order[bounds[number]:bounds[number + 1]]
+            index[email] = merge_intervals(starts[mine], ends[mine])
+    return index, emails - known
+
+
+def merge_busy(index):
+    """
+    k-way merge of participants' sorted busy intervals into their union
+    :param index: {'a@a.com': (starts, ends)} sorted disjoint intervals
+    :return: [[start, end]] sorted disjoint intervals
+    """
+    merged = []
+    for start, end in heapq.merge(*[zip(starts.tolist(), ends.tolist()) for starts, ends in index.values()]):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def get_free_slots(busy, window_start, window_end, min_duration):
+    """
+    Gaps between busy intervals within a window
+    :param busy: [[start, end]] sorted disjoint intervals
+    :param window_start: seconds since epoch
+    :param window_end: seconds since epoch
+    :param min_duration: seconds, shorter gaps are dropped
+    :return: [(start, end)]
+    """
+    slots = []
+    cursor = window_start
+    for start, end in busy:
+        if start >= window_end:
+            break
+        if start - cursor >= min_duration:
+            slots.append((cursor, start))
+        cursor = max(cursor, end)
+    if window_end - cursor >= min_duration:
+        slots.append((cursor, window_end))
+    return slots
+
+
+def find_common_free_slots(emails, window_start, window_end, min_duration):
+    """
+    Slots of at least 'min_duration' in which all participants are free
+    :param emails: ['a@a.com'] of Users or Accounts
+    :param window_start: aware datetime
+    :param window_end: aware datetime
+    :param min_duration: <timedelta obj>
+    :return: ([(start, end)] aware datetimes in UTC, set of unknown emails)
+    """
+    index, unknown = load_busy_index(emails, window_start, window_end)
+    slots = get_free_slots(merge_busy(index), get_epoch_seconds(window_start), get_epoch_seconds(window_end),
+                           min_duration.total_seconds())
+    return [(datetime.fromtimestamp(start, pytz.utc), datetime.fromtimestamp(end, pytz.utc))
+            for start, end in slots], unknown
@@ -0,0 +1,146 @@
+from __future__ import absolute_import
+
+import logging
+
+from googleapiclient.errors import HttpError
+
+from apps.calendar.identity import AccountResolver
+from apps.calendar.sync import build_service, get_or_create_calendar, CalendarSync, SyncResult, \
+    SYNCED_ACCESS_ROLES
+from apps.calendar.utils import chunks
+
+logger = logging.getLogger(__name__)
+
+# Calls sent in one batch HTTP request, Google accepts up to 1000
+# but recommends 50 as larger batches are throttled
+BATCH_SIZE = 50
+
+
+def execute_batch(service, requests, batch_size=BATCH_SIZE):
+    """
+    Executes independent requests as batch HTTP requests of 'batch_size' calls.
+    Requests may belong to different Users, each call is authorized with
+    credentials of its own service.
+    :param service: Google Calendar API service whose batch endpoint is used
+    :param requests: [(key, <HttpRequest obj>)]
+    :param batch_size: calls per batch HTTP request
+    :return: {key: (response, <HttpError obj> or None)}
+    """
+    results = {}
+    for chunk in chunks(requests, batch_size):
+        keys = {}
+
+        def callback(request_id, response, exception):
+            results[keys[request_id]] = (response, exception)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for index, (key, request) in enumerate(chunk):
+            keys[str(index)] = key
+            batch.add(request, request_id=str(index))
+        batch.execute()
+    return results
+
+
+def get_calendar_lists(services, batch_size=BATCH_SIZE):
+    """
+    calendarList of many Users, one call per User in every round,
+    Users with more pages continue in the next round
+    :param services: {user_pk: Google Calendar API service}
+    :return: ({user_pk: [calendar records]}, {user_pk: error})
+    """
+    calendars = dict((user_pk, []) for user_pk in services)
+    page_tokens = dict.fromkeys(services)
+    errors = {}
+    pending = list(services)
+    while pending:
+        requests = [(user_pk, services[user_pk].calendarList().list(pageToken=page_tokens[user_pk]))
+                    for user_pk in pending]
+        results = execute_batch(services[pending[0]], requests, batch_size)
+        pending = []
+        for user_pk, (response, error) in results.items():
+            if error is not None:
+                logger.warning("Calendar list of user %s failed: %s", user_pk, error)
+                errors[user_pk] = error
+                continue
+            calendars[user_pk].extend(response.get('items', []))
+            page_tokens[user_pk] = response.get('nextPageToken')
+            if page_tokens[user_pk]:
+                pending.append(user_pk)
+
+    for user_pk in errors:
+        del calendars[user_pk]
+    return calendars, errors
+
+
+def sync_users(users, service_factory=build_service, resolver=None, batch_size=BATCH_SIZE, on_round=None):
+    """
+    Syncs events of all Calendars of many Users with batched requests
+
+    Calendar lists of every User are fetched first, then events are fetched
+    in rounds: every round requests the next page of each Calendar which has
+    pages left in as few batch HTTP requests as possible. A failed call
+    fails its User only, other Calendars of that User are not requested
+    any more and the other Users are synced.
+    :param users: [<User> instance]
+    :param service_factory: callable(user) returning Google Calendar service
+    :param resolver: <AccountResolver> shared by all Calendars
+    :param batch_size: calls per batch HTTP request
+    :param on_round: called after every round of events requests
+    :return: {user_pk: <SyncResult> or exception}
+    """
+    resolver = resolver or AccountResolver()
+    users = dict((user.pk, user) for user in users)
+    services = {}
+    errors = {}
+    for user_pk, user in users.items():
+        try:
+            services[user_pk] = service_factory(user)
+        except Exception as error:
+            logger.warning("Service of user %s could not be built: %s", user_pk, error)
+            errors[user_pk] = error
+    if not services:
+        return errors
+
+    calendar_lists, list_errors = get_calendar_lists(services, batch_size)
+    errors.update(list_errors)
+
+    syncs = []
+    for user_pk, records in calendar_lists.items():
+        for record in records:
+            if record.get('accessRole', 'owner') in SYNCED_ACCESS_ROLES:
+                calendar = get_or_create_calendar(users[user_pk], record)
+                syncs.append((user_pk, CalendarSync(calendar, resolver=resolver)))
+
+    active = syncs
+    any_service = next(iter(services.values()))
+    while active:
+        requests = [(index, sync.request(services[user_pk]))
+                    for index, (user_pk, sync) in enumerate(active)]
+        results = execute_batch(any_service, requests, batch_size)
+        pending = []
+        for index, (user_pk, sync) in enumerate(active):
+            if user_pk in errors:
+                continue
+            response, error = results[index]
+            try:
+                if error is not None:
+                    if not (isinstance(error, HttpError) and sync.handle_error(error)):
+                        raise error
+                else:
+                    sync.handle_response(response)
+            except Exception as error:
+                # other Calendars of User are synced by the next sync of User
+                logger.warning("Sync of calendar %s failed: %s", sync.calendar.pk, error)
+                errors[user_pk] = error
+                continue
+            if not sync.done:
+                pending.append((user_pk, sync))
+        # a User failed in this round may still have Calendars pending
+        active = [(user_pk, sync) for user_pk, sync in pending if user_pk not in errors]
+        if on_round is not None:
+            on_round()
+
+    outcome = dict((user_pk, SyncResult.combine(sync.result for pk, sync in syncs if pk == user_pk))
+                   for user_pk in users)
+    outcome.update(errors)
+    return outcome
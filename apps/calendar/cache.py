@@ -0,0 +1,259 @@
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models import F
+
+from apps.calendar.models import Calendar
+
+logger = logging.getLogger(__name__)
+
+# Entries kept by 'locmem' and 'file' backends, least recently used are evicted
+MAX_ENTRIES = 1000
+
+
+class AnalyticsCache(object):
+    """
+    Analytics results of Calendars shared across requests, keys carry
+    Calendar's data_version so entries of changed Calendars are never hit
+    and are evicted as they age.
+    Hits and misses are counted per process and logged with every miss.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached value of key, computed and stored on a miss
+        :param compute: callable returning the value
+        :return: (value, True if it was a hit)
+        """
+        value = self.get(key)
+        hit = value is not None
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            value = compute()
+            self.set(key, value)
+            # misses are rare and already pay for compute, counters are logged with them
+            logger.info("Analytics cache miss %s, stats %s", key, self.stats())
+        return value, hit
+
+    def stats(self):
+        """
+        :return: {'hits': 90, 'misses': 10, 'hit_rate': 0.9}
+        """
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+class LocMemAnalyticsCache(AnalyticsCache):
+    """
+    Per-process LRU cache
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, location=None):
+        super(LocMemAnalyticsCache, self).__init__(max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileAnalyticsCache(AnalyticsCache):
+    """
+    JSON files in a directory shared by processes of a host,
+    files least recently read or written are evicted
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, location=None):
+        super(FileAnalyticsCache, self).__init__(max_entries)
+        self.directory = location or os.path.join(settings.BASE_DIR, '.cache', 'analytics')
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as cache_file:
+                value = json.load(cache_file)
+            # mtime is the last use, see _cull
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return value
+
+    def set(self, key, value):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # created by another process
+                pass
+        # written aside and renamed so readers never see a partial file
+        path = self._path(key)
+        tmp_path = '%s.%s.%s' % (path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(value, cache_file)
+        os.rename(tmp_path, path)
+        self._cull()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        return entries
+
+    def _cull(self):
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        for _, path in sorted(entries)[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for _, path in self._entries():
+                os.remove(path)
+
+
+class DjangoAnalyticsCache(AnalyticsCache):
+    """
+    Stores in a cache of settings.CACHES, i.e. memcached shared by all hosts,
+    eviction is done by that cache and bounded by its MAX_ENTRIES
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, location=None):
+        super(DjangoAnalyticsCache, self).__init__(max_entries)
+        self.cache = caches[location or 'default']
+
+    def _key(self, key):
+        # memcached does not accept long keys or spaces
+        return 'analytics:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value):
+        self.cache.set(self._key(key), value, None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+ANALYTICS_CACHE_BACKENDS = {
+    'locmem': LocMemAnalyticsCache,
+    'file': FileAnalyticsCache,
+    'django': DjangoAnalyticsCache,
+}
+
+_analytics_cache = None
+_analytics_cache_lock = threading.Lock()
+
+
+def get_analytics_cache():
+    """
+    AnalyticsCache configured by settings.CALENDAR_ANALYTICS_CACHE,
+    None if caching is disabled
+    """
+    global _analytics_cache
+    options = settings.CALENDAR_ANALYTICS_CACHE
+    if not options.get('BACKEND'):
+        return None
+    with _analytics_cache_lock:
+        if _analytics_cache is None:
+            _analytics_cache = ANALYTICS_CACHE_BACKENDS[options['BACKEND']](
+                max_entries=options.get('MAX_ENTRIES', MAX_ENTRIES),
+                location=options.get('LOCATION'))
+        return _analytics_cache
+
+
+def reset_analytics_cache(setting, **kwargs):
+    """
+    setting_changed receiver, rebuilds the cache when its settings change
+    """
+    global _analytics_cache
+    if setting == 'CALENDAR_ANALYTICS_CACHE':
+        _analytics_cache = None
+
+
+setting_changed.connect(reset_analytics_cache)
+
+
+def get_analytics_cache_key(ca, reference, name='report'):
+    """
+    Key of a result of CalendarAnalytics
+    :param ca: <CalendarAnalytics obj>
+    :param reference: <DateTime obj> time the result is computed relative to
+    :param name: name of the result
+    :return: 'report:RollupCalendarAnalytics:12:v7:Asia/Kolkata:2019-06-12T00:00:00+05:30'
+    """
+    calendar = ca.calander
+    return '%s:%s:%s:v%s:%s:%s' % (name, type(ca).__name__, calendar.pk, calendar.data_version,
+                                   calendar.timezone, reference.isoformat())
+
+
+def invalidate_analytics(sender, calendar, touched, **kwargs):
+    """
+    events_ingested receiver, bumps data_version of Calendars touched by a page
+    """
+    Calendar.bump_data_version(set(calendar_id for calendar_id, _ in touched) | {calendar.pk})
+
+
+def invalidate_topic_analytics(sender, **kwargs):
+    """
+    post_save and post_delete receiver of Topic, time spent per Topic
+    of every Calendar changes with the Topics
+    """
+    Calendar.objects.update(data_version=F('data_version') + 1)
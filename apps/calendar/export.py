@@ -0,0 +1,99 @@
+from __future__ import absolute_import
+
+import csv
+import json
+
+import six
+
+from apps.calendar.models import Attendee, EventTopic
+from apps.calendar.utils import chunks, BULK_CHUNK_SIZE
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_FIELDS = ('id', 'title', 'start_time', 'end_time', 'organiser', 'location', 'event_link',
+                 'attendees', 'topics')
+
+
+def iter_event_records(events, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Streams Events with their Attendees and Topics. Events are read
+    with a server-side cursor where the database supports it and
+    Attendees and Topics are fetched per chunk of events, so memory
+    does not grow with the number of events
+    :param events: queryset of Events
+    :param chunk_size: events per Attendee and Topic query
+    :return: generator of {'id': 'abc', 'title': 'Standup', 'start_time': '2019-06-24T04:30:00+00:00',
+                           'attendees': [{'email': 'a@a.com', 'rsvp': 'accepted'}], 'topics': ['standup'], ...}
+    """
+    rows = events.order_by('start_time', 'id') \
+        .values_list('id', 'title', 'start_time', 'end_time', 'organiser__email', 'location', 'event_link') \
+        .distinct() \
+        .iterator()
+    for chunk in chunks(rows, chunk_size):
+        event_ids = [row[0] for row in chunk]
+        attendees, topics = {}, {}
+        for event_id, email, rsvp in Attendee.objects.filter(event_id__in=event_ids) \
+                .order_by('event_id', 'account__email').values_list('event_id', 'account__email', 'rsvp'):
+            attendees.setdefault(event_id, []).append({'email': email, 'rsvp': rsvp})
+        for event_id, topic in EventTopic.objects.filter(event_id__in=event_ids) \
+                .order_by('event_id', 'topic__name').values_list('event_id', 'topic__name'):
+            topics.setdefault(event_id, []).append(topic)
+
+        for event_id, title, start_time, end_time, organiser, location, event_link in chunk:
+            yield {
+                'id': event_id,
+                'title': title,
+                'start_time': start_time.isoformat(),
+                'end_time': end_time.isoformat(),
+                'organiser': organiser,
+                'location': location,
+                'event_link': event_link,
+                'attendees': attendees.get(event_id, []),
+                'topics': topics.get(event_id, []),
+            }
+
+
+class Echo(object):
+    """
+    File like object returning what is written, lets csv.writer format
+    rows without buffering them
+    """
+
+    def write(self, value):
+        return value
+
+
+def to_csv_row(record):
+    """
+    Attendees are 'a@a.com:accepted;b@b.com:declined' and Topics 'recruit;standup'
+    """
+    values = dict(record,
+                  attendees=';'.join('%s:%s' % (attendee['email'], attendee['rsvp'])
+                                     for attendee in record['attendees']),
+                  topics=';'.join(record['topics']))
+    row = [values[field] for field in EXPORT_FIELDS]
+    if six.PY2:
+        # csv module of Python 2 only writes bytes
+        row = [value.encode('utf-8') if isinstance(value, six.text_type) else value for value in row]
+    return row
+
+
+def iter_export(records, output, lines_per_write=BULK_CHUNK_SIZE):
+    """
+    Serialises records, lines are joined in groups so a stream is
+    written in few large writes
+    :param records: output of iter_event_records
+    :param output: one of EXPORT_FORMATS
+    :return: generator of str
+    """
+    if output == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        lines = (writer.writerow(to_csv_row(record)) for record in records)
+    else:
+        lines = (json.dumps(record) + '\n' for record in records)
+    for chunk in chunks(lines, lines_per_write):
+        yield ''.join(chunk)
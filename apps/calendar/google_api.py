@@ -0,0 +1,135 @@
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import threading
+
+import httplib2
+import requests
+from django.conf import settings
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document, DISCOVERY_URI
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for Google before giving up on a request
+HTTP_TIMEOUT = 60
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+_local = threading.local()
+_session = None
+
+
+def get_session():
+    """
+    Process wide requests.Session, keeps connections to Google alive
+    :return: <requests.Session obj>
+    """
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        _session = session
+    return _session
+
+
+def get_http():
+    """
+    Per thread httplib2.Http, httplib2 is not thread safe but keeps
+    connections alive so every thread reuses its own instance
+    :return: <httplib2.Http obj>
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = _local.http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return http
+
+
+def _fetch_discovery_document():
+    url = DISCOVERY_URI.format(api='calendar', apiVersion='v3')
+    response = get_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response.text
+
+
+def get_discovery_document():
+    """
+    Calendar v3 discovery document, loaded once per process from the on-disk
+    cache at settings.CALENDAR_DISCOVERY_CACHE. Document is fetched from Google
+    and written to the cache if file does not exist.
+    rootUrl is replaced with settings.CALENDAR_API_ROOT_URL if set
+    :return: {discovery document}
+    """
+    global _discovery_document
+    if _discovery_document is not None:
+        return _discovery_document
+
+    with _discovery_lock:
+        if _discovery_document is not None:
+            return _discovery_document
+
+        path = settings.CALENDAR_DISCOVERY_CACHE
+        if os.path.exists(path):
+            with open(path) as cache:
+                content = cache.read()
+        else:
+            logger.info("Discovery document not cached, fetching it from Google")
+            content = _fetch_discovery_document()
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            # write and rename so other processes never read half written file
+            with open(path + '.tmp', 'w') as cache:
+                cache.write(content)
+            os.rename(path + '.tmp', path)
+
+        document = json.loads(content)
+        if settings.CALENDAR_API_ROOT_URL:
+            document['rootUrl'] = settings.CALENDAR_API_ROOT_URL
+        _discovery_document = document
+    return _discovery_document
+
+
+def reset():
+    """
+    Forgets cached discovery document and closes transports i.e. after settings change
+    """
+    global _discovery_document, _session
+    _discovery_document = None
+    if _session is not None:
+        _session.close()
+        _session = None
+    http = getattr(_local, 'http', None)
+    if http is not None:
+        for conn in http.connections.values():
+            conn.close()
+        _local.http = None
+
+
+def get_credentials(access_token, refresh_token):
+    """
+    google.auth Credentials of User
+    """
+    return Credentials(
+        token=access_token,
+        refresh_token=refresh_token,
+        client_id=settings.CALENDAR_CLIENT_ID,
+        token_uri=settings.GOOGLE_TOKEN_URI,
+        client_secret=settings.CALENDAR_CLIENT_SECRET,
+        scopes=settings.CALENDAR_SCOPE
+    )
+
+
+def build_calendar_service(credentials):
+    """
+    Google Calendar service built from the cached discovery document
+    and thread's keep-alive transport, no network call is made
+    :param credentials: google.auth Credentials
+    :return: Google Calendar API service
+    """
+    http = AuthorizedHttp(credentials, http=get_http())
+    return build_from_document(get_discovery_document(), http=http)
@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+
+import threading
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from apps.calendar.models import Account
+from apps.calendar.utils import BULK_CHUNK_SIZE, chunks
+
+
+class AccountResolver(object):
+    """
+    Request scoped Email -> Account map used while syncing
+
+    Every email is looked up in database only once, all emails of a
+    batch are loaded with one IN query per chunk and missing Accounts
+    are created in bulk. Further lookups are served from memory.
+
+    'hits' and 'misses' count emails served from memory and emails
+    which needed database respectively
+
+    Accounts created by a transaction which is rolled back must be
+    dropped with forget_uncommitted() before the resolver is used again
+    """
+
+    def __init__(self, chunk_size=BULK_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self._accounts = {}
+        # emails of Accounts created in transactions not committed yet
+        self._uncommitted = set()
+        # one resolver can be shared by threads syncing different calendars
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def __contains__(self, email):
+        return email in self._accounts
+
+    def resolve(self, emails):
+        """
+        Resolves emails to Accounts, missing Accounts are created
+        and linked to User if User with same email exists in system
+        :param emails: ['a@a.com', 'b@b.com']
+        :return: {'a@a.com': <Account instance>}
+        """
+        emails = set(emails)
+        with self._lock:
+            missing = emails.difference(self._accounts)
+            self.hits += len(emails) - len(missing)
+            self.misses += len(missing)
+            if missing:
+                self._load(missing)
+            return dict((email, self._accounts[email]) for email in emails)
+
+    def get(self, email):
+        """
+        Resolves single email to Account
+        :param email: 'a@a.com'
+        :return: <Account instance>
+        """
+        return self.resolve([email])[email]
+
+    def forget_uncommitted(self):
+        """
+        Drops Accounts created in transactions which did not commit,
+        i.e. after a page failed and before it is retried
+        """
+        with self._lock:
+            for email in self._uncommitted:
+                self._accounts.pop(email, None)
+            self._uncommitted.clear()
+
+    def _committed(self, emails):
+        with self._lock:
+            self._uncommitted.difference_update(emails)
+
+    def stats(self):
+        """
+        Counters for monitoring
+        :return: {'hits': 120, 'misses': 20, 'size': 20, 'hit_ratio': 0.857}
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._accounts),
+            'hit_ratio': round(float(self.hits) / lookups, 3) if lookups else 0.0,
+        }
+
+    def _load(self, emails):
+        """
+        Loads existing Accounts and bulk creates the missing ones
+        :param emails: set of emails which are not in memory
+        """
+        self._fetch(emails)
+        missing = emails.difference(self._accounts)
+        if not missing:
+            return
+
+        users = {}
+        for chunk in chunks(missing, self.chunk_size):
+            users.update(User.objects.filter(email__in=chunk).values_list('email', 'id'))
+        try:
+            with transaction.atomic():
+                Account.objects.bulk_create([Account(email=email, user_id=users.get(email))
+                                             for email in missing],
+                                            batch_size=self.chunk_size)
+        except IntegrityError:
+            # Account got created by concurrent sync in between
+            for email in missing:
+                Account.objects.get_or_create(email=email, defaults={'user_id': users.get(email)})
+        # bulk_create does not return primary keys on SQLite and MySQL
+        self._fetch(missing)
+        self._uncommitted.update(missing)
+        # runs at once outside of a transaction
+        transaction.on_commit(lambda: self._committed(missing))
+
+    def _fetch(self, emails):
+        for chunk in chunks(emails, self.chunk_size):
+            self._accounts.update((account.email, account)
+                                  for account in Account.objects.filter(email__in=chunk))
+
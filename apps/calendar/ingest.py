@@ -0,0 +1,375 @@
+from __future__ import absolute_import
+
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils.functional import cached_property
+
+from apps.calendar.identity import AccountResolver
+from apps.calendar.models import Event, EventTopic, Attendee, NEEDS_ACTION
+from apps.calendar.signals import events_ingested
+from apps.calendar.timeparse import parse_date, parse_datetime, parse_timestamps
+from apps.calendar.topics import build_event_topics, load_matcher
+from apps.calendar.utils import BULK_CHUNK_SIZE, chunks
+
+UNKNOWN_ORGANISER = "unknownorganizer@calendar.google.com"
+
+
+def get_utc_time(timezone_aware_ts, time_zone, is_date=False):
+    """
+    Converts datetime str to UTC datetime obj
+    :param timezone_aware_ts: String rep of datetime
+    :param time_zone: Calander time_zone
+    :param is_date: is timezone_aware_ts date ?
+    :return: utc aware datetime
+    """
+    if is_date:
+        return parse_date(timezone_aware_ts, time_zone)
+    return parse_datetime(timezone_aware_ts)
+
+
+def get_organiser_email(record):
+    """
+    Returns email of organiser if present in data
+    else returns email of creator
+    :param record: {'organizer': {'email': 'unknownorganizer@calendar.google.com'},
+                    'creator': {'email': 'creator@gmail.com'}}
+    :return: 'creator@gmail.com'
+    """
+    email = (record.get('organizer') or {}).get('email')
+    if not email or email == UNKNOWN_ORGANISER:
+        email = record['creator']['email']
+    return email
+
+
+def get_event_time(time_record, time_zone):
+    """
+    Google sends 'dateTime' for timed events and 'date' for all day events
+    :param time_record: {'dateTime': '2015-08-03T10:15:00+05:30'} or {'date': '2015-08-03'}
+    :param time_zone: Calendar time_zone
+    :return: utc aware datetime
+    """
+    if time_record.get("dateTime"):
+        return get_utc_time(time_record["dateTime"], time_zone)
+    return get_utc_time(time_record["date"], time_zone, is_date=True)
+
+
+def build_event(record, time_zone, organiser):
+    """
+    Builds unsaved <Event> from Google Event dict
+    :param record: Event dict from Google API
+    :param time_zone: Calendar time_zone
+    :param organiser: <Account> instance
+    :return: <Event instance>
+    """
+    return Event(
+        id=record['id'],
+        location=record.get('location', ''),
+        event_link=record['htmlLink'],
+        title=record.get('summary', ''),
+        description=record.get('description', ''),
+        organiser=organiser,
+        start_time=get_event_time(record['start'], time_zone),
+        end_time=get_event_time(record['end'], time_zone),
+        created_at=get_utc_time(record["created"], time_zone),
+        updated_at=get_utc_time(record["updated"], time_zone),
+    )
+
+
+def get_attendee_rsvps(record):
+    """
+    Returns RSVP of every attendee of Google Event dict, first
+    entry wins if attendee is listed twice
+    :param record: Event dict from Google API
+    :return: {'a@a.com': 'accepted'}
+    """
+    rsvps = {}
+    for attendee in record.get('attendees', []):
+        rsvps.setdefault(attendee['email'], attendee.get('responseStatus', NEEDS_ACTION))
+    return rsvps
+
+
+def bulk_update(objs, fields, max_params=900):
+    """
+    Updates 'fields' of already saved model instances with one
+    UPDATE ... SET field = CASE WHEN pk = .. THEN .. END per chunk
+    :param objs: [<Model instance>] of same model
+    :param fields: ['title', 'start_time']
+    :param max_params: bound parameters allowed per statement
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    model_fields = [model._meta.get_field(field) for field in fields]
+    # every row needs two parameters per field and one for pk IN (...)
+    chunk_size = max(1, max_params // (2 * len(model_fields) + 1))
+    for chunk in chunks(objs, chunk_size):
+        updates = {}
+        for field in model_fields:
+            updates[field.attname] = Case(*[When(pk=obj.pk,
+                                                 then=Value(getattr(obj, field.attname), output_field=field))
+                                            for obj in chunk],
+                                          output_field=field)
+        model.objects.filter(pk__in=[obj.pk for obj in chunk]).update(**updates)
+
+
+class EventIngestor(object):
+    """
+    Applies a page of Google Event dicts to a Calendar with
+    set based queries i.e. number of queries depends on number of
+    chunks and not on number of events in the page
+
+    - new Events are created along with their Attendees
+    - Events whose 'updated' is newer than stored 'updated_at' are rewritten
+      and their Attendees are diffed
+    - cancelled Events are unlinked from Calendar and deleted once
+      no Calendar links them
+    - unchanged Events are only linked to Calendar
+    - new and changed Events are tagged with their Topics
+
+    Pass same <AccountResolver> for all pages of a sync so
+    Attendees and Organisers are resolved only once
+    """
+    EVENT_FIELDS = ['event_link', 'title', 'description', 'location', 'organiser',
+                    'start_time', 'end_time', 'created_at', 'updated_at']
+
+    def __init__(self, calendar, resolver=None, chunk_size=BULK_CHUNK_SIZE):
+        self.calendar = calendar
+        self.chunk_size = chunk_size
+        self.resolver = resolver or AccountResolver(chunk_size=chunk_size)
+        self.stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'cancelled': 0}
+
+    def ingest(self, records):
+        """
+        Applies page of events to calendar
+        :param records: List of Event dicts from Google API
+        :return: [<Event instance>] of not cancelled events in order of records
+        """
+        # last record wins if same event appears twice in a page
+        records_by_id = {}
+        for record in records:
+            records_by_id[record['id']] = record
+        if not records_by_id:
+            return []
+        cancelled_ids = [event_id for event_id, record in records_by_id.items()
+                         if record.get('status') == 'cancelled']
+        for event_id in cancelled_ids:
+            del records_by_id[event_id]
+
+        updated = parse_timestamps([record['updated'] for record in records_by_id.values()],
+                                   self.calendar.timezone)
+        updated = dict(zip(records_by_id, updated))
+
+        with transaction.atomic():
+            events = self._existing_events(records_by_id)
+            new_records, changed = [], []
+            for event_id, record in records_by_id.items():
+                if event_id not in events:
+                    new_records.append(record)
+                elif updated[event_id] > events[event_id].updated_at:
+                    changed.append((events[event_id], record))
+            self._resolve_accounts(new_records + [record for _, record in changed])
+
+            # days of changed events before and after the change are touched
+            calendars = self._linked_calendars(changed)
+            touched = set((calendar_id, event.start_time) for event, _ in changed
+                          for calendar_id in calendars[event.id])
+            created = self._create_events(new_records)
+            events.update(created)
+            self._update_events(changed)
+            self._tag_events(list(created.values()), [event for event, _ in changed])
+            touched.update((calendar_id, event.start_time) for event, _ in changed
+                           for calendar_id in calendars[event.id])
+            linked = self._link_calendar(events)
+            touched.update((self.calendar.id, events[event_id].start_time) for event_id in linked)
+            touched.update(self._cancel_events(cancelled_ids))
+            if touched:
+                events_ingested.send(sender=self.__class__, calendar=self.calendar, touched=touched)
+
+        self.stats['created'] += len(new_records)
+        self.stats['updated'] += len(changed)
+        self.stats['unchanged'] += len(records_by_id) - len(new_records) - len(changed)
+        self.stats['cancelled'] += len(cancelled_ids)
+
+        data, seen = [], set()
+        for record in records:
+            if record['id'] in events and record['id'] not in seen:
+                seen.add(record['id'])
+                data.append(events[record['id']])
+        return data
+
+    def remove(self, event_ids):
+        """
+        Unlinks events which no longer exist in Google Calendar,
+        i.e. deleted while SyncToken was expired
+        :param event_ids: ['event_id']
+        """
+        event_ids = list(event_ids)
+        with transaction.atomic():
+            touched = self._cancel_events(event_ids)
+            if touched:
+                events_ingested.send(sender=self.__class__, calendar=self.calendar, touched=touched)
+        self.stats['cancelled'] += len(event_ids)
+
+    def _existing_events(self, records_by_id):
+        """
+        Fetches already stored Events
+        :return: {'event_id': <Event instance>}
+        """
+        events = {}
+        for chunk in chunks(records_by_id, self.chunk_size):
+            events.update(Event.objects.in_bulk(chunk))
+        return events
+
+    def _resolve_accounts(self, records):
+        """
+        Resolves Organisers and Attendees of records in one go
+        :return: {'a@a.com': <Account instance>}
+        """
+        emails = set()
+        for record in records:
+            emails.add(get_organiser_email(record))
+            emails.update(get_attendee_rsvps(record))
+        self.accounts = self.resolver.resolve(emails)
+        return self.accounts
+
+    def _linked_calendars(self, changed):
+        """
+        Calendars linking changed Events, rollups of all of them are affected
+        :param changed: [(<Event instance>, Event dict)]
+        :return: {'event_id': set([calendar_id])}
+        """
+        calendars = dict((event.id, set([self.calendar.id])) for event, _ in changed)
+        through = Event.calendar.through
+        for chunk in chunks(calendars, self.chunk_size):
+            for calendar_id, event_id in through.objects.filter(event_id__in=chunk) \
+                    .values_list('calendar_id', 'event_id'):
+                calendars[event_id].add(calendar_id)
+        return calendars
+
+    def _create_events(self, records):
+        """
+        Bulk creates Events along with their Attendees
+        :param records: List of Event dicts which are not stored yet
+        :return: {'event_id': <Event instance>}
+        """
+        if not records:
+            return {}
+
+        time_zone = self.calendar.timezone
+        events = [build_event(record, time_zone, self.accounts[get_organiser_email(record)])
+                  for record in records]
+        Event.objects.bulk_create(events, batch_size=self.chunk_size)
+
+        attendees = []
+        for event, record in zip(events, records):
+            for email, rsvp in get_attendee_rsvps(record).items():
+                attendees.append(Attendee(account=self.accounts[email], event=event, rsvp=rsvp))
+        Attendee.objects.bulk_create(attendees, batch_size=self.chunk_size)
+
+        return dict((event.id, event) for event in events)
+
+    def _update_events(self, changed):
+        """
+        Rewrites changed Events and applies diff of their Attendees
+        :param changed: [(<Event instance>, Event dict)]
+        """
+        if not changed:
+            return
+
+        time_zone = self.calendar.timezone
+        for event, record in changed:
+            fresh = build_event(record, time_zone, self.accounts[get_organiser_email(record)])
+            for field in self.EVENT_FIELDS:
+                setattr(event, field, getattr(fresh, field))
+        bulk_update([event for event, _ in changed], self.EVENT_FIELDS)
+
+        stored = {}
+        for chunk in chunks([event.id for event, _ in changed], self.chunk_size):
+            for pk, event_id, account_id, rsvp in Attendee.objects.filter(event_id__in=chunk) \
+                    .values_list('pk', 'event_id', 'account_id', 'rsvp'):
+                stored[(event_id, account_id)] = (pk, rsvp)
+
+        wanted = {}
+        for event, record in changed:
+            for email, rsvp in get_attendee_rsvps(record).items():
+                wanted[(event.id, self.accounts[email].pk)] = rsvp
+
+        removed = [pk for key, (pk, _) in stored.items() if key not in wanted]
+        for chunk in chunks(removed, self.chunk_size):
+            Attendee.objects.filter(pk__in=chunk).delete()
+
+        Attendee.objects.bulk_create([Attendee(event_id=event_id, account_id=account_id, rsvp=rsvp)
+                                      for (event_id, account_id), rsvp in wanted.items()
+                                      if (event_id, account_id) not in stored],
+                                     batch_size=self.chunk_size)
+
+        # one UPDATE per RSVP value
+        rsvp_changes = {}
+        for key, rsvp in wanted.items():
+            if key in stored and stored[key][1] != rsvp:
+                rsvp_changes.setdefault(rsvp, []).append(stored[key][0])
+        for rsvp, pks in rsvp_changes.items():
+            for chunk in chunks(pks, self.chunk_size):
+                Attendee.objects.filter(pk__in=chunk).update(rsvp=rsvp)
+
+    @cached_property
+    def matcher(self):
+        """
+        TopicMatcher loaded once per ingestor i.e. per sync
+        """
+        return load_matcher()
+
+    def _tag_events(self, created, changed):
+        """
+        Tags Events with their Topics, tags of changed Events are rebuilt
+        :param created: [<Event instance>] new Events
+        :param changed: [<Event instance>] rewritten Events
+        """
+        if not created and not changed:
+            return
+        for chunk in chunks([event.id for event in changed], self.chunk_size):
+            EventTopic.objects.filter(event_id__in=chunk).delete()
+        EventTopic.objects.bulk_create(build_event_topics(self.matcher, [(event.id, event.title)
+                                                                         for event in created + changed]),
+                                       batch_size=self.chunk_size)
+
+    def _link_calendar(self, events):
+        """
+        Links events to calendar if they are not linked already
+        :param events: {'event_id': <Event instance>}
+        :return: ['event_id'] of newly linked events
+        """
+        through = Event.calendar.through
+        linked = set()
+        for chunk in chunks(events, self.chunk_size):
+            linked.update(through.objects.filter(calendar_id=self.calendar.id,
+                                                 event_id__in=chunk)
+                          .values_list('event_id', flat=True))
+        new_links = [event_id for event_id in events if event_id not in linked]
+        through.objects.bulk_create([through(calendar_id=self.calendar.id, event_id=event_id)
+                                     for event_id in new_links],
+                                    batch_size=self.chunk_size)
+        return new_links
+
+    def _cancel_events(self, event_ids):
+        """
+        Unlinks cancelled events from calendar, Events which are
+        not linked to any other Calendar are deleted
+        :param event_ids: ['event_id']
+        :return: set([(calendar_id, start_time)]) of unlinked events
+        """
+        through = Event.calendar.through
+        touched = set()
+        for chunk in chunks(event_ids, self.chunk_size):
+            touched.update((self.calendar.id, start_time) for start_time in
+                           Event.objects.filter(pk__in=chunk, calendar=self.calendar)
+                           .values_list('start_time', flat=True))
+            through.objects.filter(calendar_id=self.calendar.id, event_id__in=chunk).delete()
+            still_linked = set(through.objects.filter(event_id__in=chunk)
+                               .values_list('event_id', flat=True))
+            orphans = [event_id for event_id in chunk if event_id not in still_linked]
+            if orphans:
+                Attendee.objects.filter(event_id__in=orphans).delete()
+                EventTopic.objects.filter(event_id__in=orphans).delete()
+                Event.objects.filter(pk__in=orphans).delete()
+        return touched
@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pandas as pd
+
+# Intervals are numpy int64 arrays of seconds since epoch, an interval
+# is [start, end) so meetings which only touch do not overlap
+
+
+def to_epoch_seconds(datetimes):
+    """
+    :param datetimes: aware datetimes
+    :return: int64 array of seconds since epoch
+    """
+    return pd.to_datetime(list(datetimes), utc=True).asi8 // 10 ** 9
+
+
+def sweep(starts, ends):
+    """
+    Number of intervals running over time, starts and ends are sorted
+    together once as a single int64 key, ends before starts at same time
+    :param starts: int64 array
+    :param ends: int64 array
+    :return: (points, level), level[i] intervals run from points[i] to points[i + 1]
+    """
+    keys = np.concatenate([starts * 2 + 1, ends * 2])
+    keys.sort()
+    points = keys >> 1
+    level = np.cumsum((keys & 1) * 2 - 1)
+    return points, level
+
+
+def merge_intervals(starts, ends):
+    """
+    Union of intervals, sorted by start and merged with a running max of ends
+    :param starts: int64 array
+    :param ends: int64 array
+    :return: (starts, ends) of disjoint intervals sorted by start,
+             intervals which only touch are merged too
+    """
+    if not len(starts):
+        return starts[:0], ends[:0]
+    order = np.argsort(starts)
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    # an interval opens a new group if it starts after all earlier ones ended
+    opens = np.empty(len(starts), dtype=bool)
+    opens[0] = True
+    opens[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(opens)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    return starts[first], reach[last]
+
+
+def integrate(points, weights, edges):
+    """
+    Integral of a step function from the first point to each edge
+    :param points: sorted int64 array where the function steps
+    :param weights: value of function from each point to the next one,
+                    zero after the last point
+    :param edges: sorted int64 array
+    :return: int64 array, same length as edges
+    """
+    integral = np.concatenate([[0], np.cumsum(weights[:-1] * np.diff(points))])
+    index = np.searchsorted(points, edges, side='right') - 1
+    total = np.zeros(len(edges), dtype=np.int64)
+    inside = index >= 0
+    index = index[inside]
+    total[inside] = integral[index] + weights[index] * (edges[inside] - points[index])
+    return total
+
+
+def busy_time_by_bucket(starts, ends, edges):
+    """
+    Occupied time per bucket, bucket i is [edges[i], edges[i + 1]) and
+    intervals are clipped to buckets
+    :param starts: int64 array
+    :param ends: int64 array
+    :param edges: sorted int64 array of bucket bounds
+    :return: (busy, overlap, conflict) int64 arrays of len(edges) - 1
+    busy: union of intervals
+    overlap: summed length of intervals minus busy, i.e. double booked time
+    conflict: time during which two or more intervals run
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    if not len(starts):
+        empty = np.zeros(max(len(edges) - 1, 0), dtype=np.int64)
+        return empty, empty.copy(), empty.copy()
+    points, level = sweep(np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64))
+    busy = np.diff(integrate(points, (level > 0).astype(np.int64), edges))
+    total = np.diff(integrate(points, level, edges))
+    conflict = np.diff(integrate(points, (level > 1).astype(np.int64), edges))
+    return busy, total - busy, conflict
+
+
+def busy_time_by_interval(keys, starts, ends):
+    """
+    Share of each interval in the union of intervals with the same key,
+    i.e. per day of their start, so sums over keys count overlapping time once.
+    Intervals are sorted by key and start and merged with a running max of
+    ends, ends of a key are lifted above all ends of previous keys so one
+    running max serves all keys
+    :param keys: int64 array, intervals are merged only with intervals of same key
+    :param starts: int64 array
+    :param ends: int64 array
+    :return: int64 array in order of input, summed per key it is the union of the key
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.maximum(np.asarray(ends, dtype=np.int64), starts)
+    if not len(starts):
+        return np.zeros(0, dtype=np.int64)
+    order = np.lexsort((starts, keys))
+    keys, starts, ends = keys[order], starts[order], ends[order]
+
+    opens = np.empty(len(keys), dtype=bool)
+    opens[0] = True
+    opens[1:] = keys[1:] != keys[:-1]
+    lift = (np.cumsum(opens) - 1) * (ends.max() - ends.min() + 1)
+    reach = np.maximum.accumulate(ends + lift) - lift
+    # time covered by earlier intervals of the key
+    covered = np.empty(len(keys), dtype=np.int64)
+    covered[1:] = reach[:-1]
+    covered[opens] = starts[opens]
+
+    busy = np.empty(len(keys), dtype=np.int64)
+    busy[order] = np.maximum(ends - np.maximum(starts, covered), 0)
+    return busy
@@ -0,0 +1,188 @@
+from __future__ import absolute_import
+
+import logging
+import traceback
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.calendar.models import SyncJob, PENDING, RUNNING, SUCCEEDED, FAILED
+from apps.calendar.sync import sync_user
+
+logger = logging.getLogger(__name__)
+
+# Retry delay is BACKOFF_BASE * 2 ** (attempts - 1), capped at BACKOFF_MAX
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+
+# RUNNING job whose worker reported no progress for this long is
+# taken as job of a dead worker and given back to the queue
+STALE_JOB_TIMEOUT = timedelta(minutes=30)
+
+
+def enqueue_sync(user):
+    """
+    Enqueues sync of User's Calendar, a User has at most
+    one PENDING job so repeated requests do not pile up. User row
+    is locked so concurrent requests do not both create a job
+    :param user: <User> instance
+    :return: <SyncJob instance>
+    """
+    with transaction.atomic():
+        list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        job = SyncJob.objects.filter(user=user, status=PENDING).first()
+        if job is None:
+            job = SyncJob.objects.create(user=user)
+    return job
+
+
+def get_backoff(attempts):
+    """
+    Returns delay before next attempt of a failed job
+    :param attempts: attempts done so far
+    :return: <timedelta obj>
+    """
+    return min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+
+
+def requeue_stale_jobs(now=None):
+    """
+    Gives RUNNING jobs of dead workers back to the queue, a live
+    worker beats on every page so long syncs are not taken over
+    :return: number of jobs re-queued
+    """
+    now = now or timezone.now()
+    stale = now - STALE_JOB_TIMEOUT
+    return SyncJob.objects.filter(status=RUNNING) \
+        .filter(Q(heartbeat_at__lt=stale) | Q(heartbeat_at__isnull=True, started_at__lt=stale)) \
+        .update(status=PENDING, worker='', run_after=now)
+
+
+def claim_next_job(worker):
+    """
+    Claims oldest runnable PENDING job, jobs are locked with
+    SELECT ... FOR UPDATE SKIP LOCKED where database supports it so
+    concurrent workers skip each other's rows. User row is locked too and
+    Users who already have a RUNNING job are skipped, so a User is never
+    synced by two workers at once.
+    :param worker: name of the worker
+    :return: <SyncJob instance> or None if queue is empty
+    """
+    now = timezone.now()
+    lock_kwargs = {}
+    if connection.features.has_select_for_update_skip_locked:
+        lock_kwargs['skip_locked'] = True
+
+    with transaction.atomic():
+        busy_users = SyncJob.objects.filter(status=RUNNING).values('user_id')
+        job = SyncJob.objects.select_for_update(**lock_kwargs) \
+            .filter(status=PENDING, run_after__lte=now) \
+            .exclude(user_id__in=busy_users) \
+            .order_by('run_after', 'pk') \
+            .first()
+        if job is None:
+            return None
+
+        # serialises claims of the same User across workers
+        list(User.objects.select_for_update().filter(pk=job.user_id).values_list('pk', flat=True))
+        if SyncJob.objects.filter(user_id=job.user_id, status=RUNNING).exists():
+            return None
+
+        # conditional update also guards backends without row locks i.e. SQLite
+        claimed = SyncJob.objects.filter(pk=job.pk, status=PENDING) \
+            .update(status=RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+                    attempts=F('attempts') + 1)
+        if not claimed:
+            return None
+    job.refresh_from_db()
+    return job
+
+
+def claim_user_job(user, worker):
+    """
+    Claims a job of given User for a sync run outside of the queue,
+    i.e. by 'sync_sweep'. PENDING job of User is taken over or a new
+    job is created, same locks as claim_next_job keep User from being
+    synced by a worker at the same time
+    :param user: <User> instance
+    :param worker: name of the claimer
+    :return: <SyncJob instance> or None if User is being synced
+    """
+    now = timezone.now()
+    claim = {'status': RUNNING, 'worker': worker, 'started_at': now, 'heartbeat_at': now}
+    with transaction.atomic():
+        list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        if SyncJob.objects.filter(user=user, status=RUNNING).exists():
+            return None
+        job = SyncJob.objects.filter(user=user, status=PENDING).order_by('pk').first()
+        if job is None:
+            return SyncJob.objects.create(user=user, attempts=1, **claim)
+        # conditional update also guards backends without row locks i.e. SQLite
+        if not SyncJob.objects.filter(pk=job.pk, status=PENDING).update(attempts=F('attempts') + 1, **claim):
+            return None
+    job.refresh_from_db()
+    return job
+
+
+def beat(jobs):
+    """
+    Records progress of RUNNING jobs, see requeue_stale_jobs
+    :param jobs: [<SyncJob instance>]
+    """
+    SyncJob.objects.filter(pk__in=[job.pk for job in jobs]).update(heartbeat_at=timezone.now())
+
+
+def complete_job(job, result):
+    """
+    Marks job SUCCEEDED
+    :param result: <SyncResult obj> of the sync
+    """
+    job.status = SUCCEEDED
+    job.pages_synced = result.pages
+    job.events_synced = result.events
+    job.last_error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'pages_synced', 'events_synced', 'last_error', 'finished_at'])
+    return job
+
+
+def fail_job(job, error, trace=''):
+    """
+    Failed job is retried with exponential backoff until 'max_attempts' is reached
+    :param error: exception of the attempt
+    :param trace: formatted traceback of error
+    """
+    job.last_error = "%s\n%s" % (error, trace)
+    if job.attempts < job.max_attempts:
+        job.status = PENDING
+        job.run_after = timezone.now() + get_backoff(job.attempts)
+    else:
+        job.status = FAILED
+        job.finished_at = timezone.now()
+    job.worker = ''
+    job.save(update_fields=['status', 'run_after', 'finished_at', 'worker', 'last_error'])
+    return job
+
+
+def run_job(job, sync=sync_user):
+    """
+    Runs claimed job, failed job is retried with exponential backoff
+    until 'max_attempts' is reached
+    :param job: <SyncJob> instance in RUNNING state
+    :param sync: callable(user, on_page) doing the sync
+    :return: <SyncJob instance>
+    """
+    def on_page(result):
+        SyncJob.objects.filter(pk=job.pk).update(pages_synced=result.pages,
+                                                 events_synced=result.events,
+                                                 heartbeat_at=timezone.now())
+
+    try:
+        result = sync(job.user, on_page=on_page)
+    except Exception as error:
+        logger.exception("Sync job %s of user %s failed", job.pk, job.user_id)
+        return fail_job(job, error, traceback.format_exc())
+    return complete_job(job, result)
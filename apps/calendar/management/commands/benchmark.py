@@ -0,0 +1,237 @@
+from __future__ import absolute_import
+
+import random
+import shutil
+import tempfile
+import time
+from calendar import timegm
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+from dateutil import parser
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from apps.calendar.api import build_events_frame, build_snapshot_frame
+from apps.calendar.intervals import busy_time_by_bucket
+from apps.calendar.management.commands.replay_events import fixture_records
+from apps.calendar.snapshots import build_columns, read_snapshot, write_snapshot
+from apps.calendar.timeparse import parse_timestamp, parse_timestamps
+
+
+def legacy_get_utc_time(timezone_aware_ts, time_zone, is_date=False):
+    """
+    get_utc_time before the dedicated parser, kept as baseline
+    """
+    tz = pytz.timezone(time_zone)
+    if is_date:
+        return tz.localize(parser.parse(timezone_aware_ts))
+    return parser.parse(timezone_aware_ts)
+
+
+def legacy_events_df(rows, time_zone):
+    """
+    CalendarAnalytics._events_df before the compact frame, kept as baseline
+    """
+    tz = pytz.timezone(time_zone)
+    df = pd.DataFrame(rows, columns=['id', 'title', 'start_time', 'end_time'])
+    df['start_time'] = df['start_time'].dt.tz_convert(tz)
+    df['end_time'] = df['end_time'].dt.tz_convert(tz)
+    df["time_spent"] = df.apply(lambda row: int((row['end_time'] - row['start_time']).total_seconds()), axis=1)
+    return df
+
+
+def synthetic_event_rows(size, seed=0):
+    """
+    (id, title, start_time, end_time) of events as fetched from database,
+    titles repeat like recurring meetings do
+    """
+    rnd = random.Random(seed)
+    start = datetime(2018, 1, 1, tzinfo=pytz.utc)
+    titles = ['Standup', 'Interview (Lead Mobile Developer)', 'Zoom call with client',
+              'Operation review', '1:1'] + ['Project sync %s' % index for index in range(200)]
+    rows = []
+    for index in range(size):
+        start_time = start + timedelta(minutes=15 * rnd.randint(0, 2 * 365 * 96))
+        rows.append(('event%07d' % index, rnd.choice(titles), start_time,
+                     start_time + timedelta(minutes=15 * rnd.randint(1, 8))))
+    return rows
+
+
+def epoch_seconds(dt):
+    return timegm(dt.utctimetuple())
+
+
+def python_busy_time(starts, ends, edges):
+    """
+    busy_time_by_bucket as a plain Python sweep, kept as reference
+    """
+    points = sorted([(end, -1) for end in ends] + [(start, 1) for start in starts])
+    result = []
+    for low, high in zip(edges[:-1], edges[1:]):
+        busy = total = conflict = level = 0
+        previous = low
+        for point, delta in points:
+            point = min(max(point, low), high)
+            span = point - previous
+            busy += span if level > 0 else 0
+            total += span * level
+            conflict += span if level > 1 else 0
+            previous = point
+            level += delta
+        result.append((busy, total - busy, conflict))
+    return result
+
+
+def synthetic_timestamps(size, seed=0):
+    """
+    Mix of 'dateTime' values in UTC and in offsets and all day 'date' values
+    as returned by Google
+    """
+    rnd = random.Random(seed)
+    start = datetime(2015, 1, 1)
+    offsets = ['Z', '+05:30', '-07:00', '+00:00', '+01:00']
+    values = []
+    for _ in range(size):
+        dt = start + timedelta(seconds=rnd.randint(0, 5 * 365 * 86400))
+        kind = rnd.random()
+        if kind < 0.1:
+            values.append(dt.strftime('%Y-%m-%d'))
+        elif kind < 0.5:
+            values.append(dt.strftime('%Y-%m-%dT%H:%M:%S') + '.%03dZ' % rnd.randint(0, 999))
+        else:
+            values.append(dt.strftime('%Y-%m-%dT%H:%M:%S') + rnd.choice(offsets))
+    return values
+
+
+def fixture_timestamps():
+    """
+    start, end, created and updated values of replay_events fixture records
+    """
+    values = []
+    for record in fixture_records():
+        for key in ('start', 'end'):
+            values.append(record[key].get('dateTime') or record[key]['date'])
+        values.extend([record['created'], record['updated']])
+    return values
+
+
+class Command(BaseCommand):
+    """
+    Micro benchmarks of hot paths:
+    python manage.py benchmark timeparse --size 100000
+    """
+    help = "Benchmarks hot paths against their previous implementation"
+
+    TARGETS = ('timeparse', 'frame', 'intervals', 'snapshot')
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=self.TARGETS)
+        parser.add_argument('--size', type=int, default=100000,
+                            help="Number of synthetic items")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Best of these many runs is reported")
+
+    def handle(self, *args, **options):
+        getattr(self, 'bench_%s' % options['target'])(options)
+
+    def timeit(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.time()
+            func()
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def report(self, name, count, baseline, current):
+        self.stdout.write("%-28s %9d items  baseline %9.0f/s  current %9.0f/s  speedup %5.1fx"
+                          % (name, count, count / baseline, count / current, baseline / current))
+
+    def bench_timeparse(self, options):
+        time_zone = 'Asia/Kolkata'
+        datasets = [
+            # fixtures are tiny, repeat them to get measurable timings
+            ('fixtures', fixture_timestamps() * 10000),
+            ('synthetic', synthetic_timestamps(options['size'])),
+        ]
+        for name, values in datasets:
+            expected = [legacy_get_utc_time(value, time_zone, is_date=len(value) == 10) for value in values]
+            if [parse_timestamp(value, time_zone) for value in values] != expected:
+                raise CommandError("Parser output differs from baseline for %s" % name)
+
+            baseline = self.timeit(lambda: [legacy_get_utc_time(value, time_zone, is_date=len(value) == 10)
+                                            for value in values], options['repeat'])
+            current = self.timeit(lambda: [parse_timestamp(value, time_zone) for value in values],
+                                  options['repeat'])
+            self.report(name, len(values), baseline, current)
+
+        # batch mode parses repeated values once, only meaningful for realistic data
+        values = datasets[-1][1]
+        batch = self.timeit(lambda: parse_timestamps(values, time_zone), options['repeat'])
+        self.report('synthetic (batch)', len(values), baseline, batch)
+
+    def bench_frame(self, options):
+        time_zone = 'Asia/Kolkata'
+        rows = synthetic_event_rows(options['size'])
+        compact_rows = [row[1:] for row in rows]
+
+        legacy = legacy_events_df(rows, time_zone)
+        compact = build_events_frame(compact_rows)
+        if list(legacy['time_spent']) != list(compact['time_spent']):
+            raise CommandError("Compact frame durations differ from baseline")
+
+        baseline = self.timeit(lambda: legacy_events_df(rows, time_zone), options['repeat'])
+        current = self.timeit(lambda: build_events_frame(compact_rows), options['repeat'])
+        self.report('events frame build', len(rows), baseline, current)
+
+        legacy_size = legacy.memory_usage(deep=True).sum()
+        compact_size = compact.memory_usage(deep=True).sum()
+        self.stdout.write("%-28s %9d items  baseline %7.0f B/event  current %7.0f B/event  %5.1fx smaller"
+                          % ('events frame memory', len(rows), float(legacy_size) / len(rows),
+                             float(compact_size) / len(rows), float(legacy_size) / compact_size))
+
+    def bench_intervals(self, options):
+        rows = synthetic_event_rows(options['size'])
+        starts = np.array([epoch_seconds(row[2]) for row in rows], dtype=np.int64)
+        ends = np.array([epoch_seconds(row[3]) for row in rows], dtype=np.int64)
+        # weekly buckets over the two years of synthetic events
+        edges = np.arange(starts.min(), ends.max() + 7 * 86400, 7 * 86400)
+
+        # reference walks all points per bucket, only compare a few buckets
+        sample = edges[:4]
+        expected = python_busy_time(starts.tolist(), ends.tolist(), sample.tolist())
+        if list(zip(*[values.tolist() for values in busy_time_by_bucket(starts, ends, sample)])) != expected:
+            raise CommandError("Busy time differs from reference")
+
+        current = self.timeit(lambda: busy_time_by_bucket(starts, ends, edges), options['repeat'])
+        busy, overlap, conflict = busy_time_by_bucket(starts, ends, edges)
+        self.stdout.write("%-28s %9d items  %d buckets  %.3fs  %9.0f/s"
+                          % ('busy time by week', len(rows), len(edges) - 1, current, len(rows) / current))
+        self.stdout.write("%-28s busy %.0fh  double booked %.0fh  conflicting %.0fh"
+                          % ('totals', busy.sum() / 3600.0, overlap.sum() / 3600.0, conflict.sum() / 3600.0))
+
+    def bench_snapshot(self, options):
+        rows = synthetic_event_rows(options['size'])
+        compact_rows = [row[1:] for row in rows]
+        snapshot = build_columns(rows, [], [])
+        snapshot.data_version = 0
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(CALENDAR_SNAPSHOT_DIR=directory):
+                write_snapshot(0, snapshot)
+
+                def load():
+                    return build_snapshot_frame(read_snapshot(0, ('start', 'end', 'title')))
+
+                expected = build_events_frame(compact_rows)
+                if sorted(load()['time_spent']) != sorted(expected['time_spent']):
+                    raise CommandError("Snapshot frame differs from database frame")
+                # baseline excludes fetching the rows, the database frame is slower still
+                baseline = self.timeit(lambda: build_events_frame(compact_rows), options['repeat'])
+                current = self.timeit(load, options['repeat'])
+                self.report('events frame cold load', len(rows), baseline, current)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,27 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from apps.calendar.models import Calendar
+from apps.calendar.snapshots import build_snapshot, write_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Writes columnar snapshots of events, i.e. before switching to the 'snapshot' analytics backend:
+    python manage.py build_snapshots --calendar 12
+    """
+    help = "Rebuilds columnar event snapshots of Calendars from database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calendar', type=int, action='append', dest='calendars',
+                            help="Calendar id to rebuild, repeat for many, default all")
+
+    def handle(self, *args, **options):
+        calendars = Calendar.objects.order_by('pk')
+        if options['calendars']:
+            calendars = calendars.filter(pk__in=options['calendars'])
+        for calendar in calendars.iterator():
+            snapshot = build_snapshot(calendar)
+            write_snapshot(calendar.pk, snapshot)
+            self.stdout.write("Calendar %s: %s events" % (calendar.pk, len(snapshot)))
@@ -0,0 +1,50 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.calendar.export import EXPORT_FORMATS, iter_event_records, iter_export
+from apps.calendar.models import Event
+from apps.calendar.timeparse import parse_datetime
+from apps.calendar.utils import BULK_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Streams events with their attendees and topics to a file:
+    python manage.py export_events --format csv --output events.csv --from 2019-01-01T00:00:00Z
+    """
+    help = "Exports events as CSV or NDJSON in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='output_format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--output', default='-', help="File to write, '-' writes stdout")
+        parser.add_argument('--calendar', type=int, action='append', dest='calendars',
+                            help="Calendar id to export, repeat for many, default all")
+        parser.add_argument('--from', dest='from_time', help="Events starting from this RFC3339 timestamp")
+        parser.add_argument('--to', dest='to_time', help="Events starting before this RFC3339 timestamp")
+        parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE,
+                            help="Events per attendee and topic query")
+
+    def handle(self, *args, **options):
+        events = Event.objects.all()
+        if options['calendars']:
+            events = events.filter(calendar__in=options['calendars'])
+        for option, lookup in (('from_time', 'start_time__gte'), ('to_time', 'start_time__lt')):
+            if options[option]:
+                try:
+                    value = parse_datetime(options[option])
+                except (ValueError, OverflowError):
+                    value = None
+                if value is None or timezone.is_naive(value):
+                    raise CommandError("--%s must be an RFC3339 timestamp" % option[:-5])
+                events = events.filter(**{lookup: value})
+
+        exported = iter_export(iter_event_records(events, options['chunk_size']), options['output_format'])
+        if options['output'] == '-':
+            for data in exported:
+                self.stdout.write(data, ending='')
+            return
+        with open(options['output'], 'w') as output:
+            for data in exported:
+                output.write(data)
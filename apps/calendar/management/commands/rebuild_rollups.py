@@ -0,0 +1,27 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from apps.calendar.models import Calendar
+from apps.calendar.rollups import rebuild_coattendance, rebuild_rollups
+
+
+class Command(BaseCommand):
+    """
+    Backfills DailyRollup and CoAttendance rows from events, i.e. after deploying rollups:
+    python manage.py rebuild_rollups --calendar 12
+    """
+    help = "Recomputes daily rollups and co-attendance counters of Calendars from their events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calendar', type=int, action='append', dest='calendars',
+                            help="Calendar id to rebuild, repeat for many, default all")
+
+    def handle(self, *args, **options):
+        calendars = Calendar.objects.order_by('pk')
+        if options['calendars']:
+            calendars = calendars.filter(pk__in=options['calendars'])
+        for calendar in calendars.iterator():
+            days = rebuild_rollups(calendar)
+            months = rebuild_coattendance(calendar)
+            self.stdout.write("Calendar %s: %s days, %s months" % (calendar.pk, days, months))
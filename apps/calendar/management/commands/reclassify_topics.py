@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from apps.calendar.models import Calendar
+from apps.calendar.rollups import rebuild_rollups
+from apps.calendar.topics import reclassify_events, RECLASSIFY_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Retags stored Events after Topics were added, edited or removed:
+    python manage.py reclassify_topics
+    """
+    help = "Rebuilds Topic tags of all Events and the daily rollups summed from them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=RECLASSIFY_CHUNK_SIZE,
+                            help="Events retagged per transaction")
+        parser.add_argument('--skip-rollups', action='store_true',
+                            help="Only retag Events, run rebuild_rollups later")
+
+    def handle(self, *args, **options):
+        events, tags = reclassify_events(chunk_size=options['chunk_size'])
+        self.stdout.write("Retagged %s events with %s topic tags" % (events, tags))
+        if options['skip_rollups']:
+            return
+        calendars = 0
+        for calendar in Calendar.objects.order_by('pk').iterator():
+            rebuild_rollups(calendar)
+            calendars += 1
+        self.stdout.write("Rebuilt rollups of %s calendars" % calendars)
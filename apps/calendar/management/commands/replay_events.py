@@ -0,0 +1,138 @@
+from __future__ import absolute_import
+
+import json
+import os
+import resource
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.calendar.identity import AccountResolver
+from apps.calendar.ingest import EventIngestor
+from apps.calendar.rollups import deferred_months
+from apps.calendar.sync import get_or_create_calendar, ingest_page, EVENTS_PAGE_SIZE
+from apps.calendar.utils import chunks
+
+# Google Event dicts as returned by events().list, ingested by tests too
+FIXTURE_PATH = os.path.join(settings.BASE_DIR, 'apps', 'calendar', 'testdata', 'events.json')
+
+
+def read_records(paths):
+    """
+    Streams Event dicts from newline delimited JSON files, a line is either
+    an Event or a captured events().list response with 'items'
+    :param paths: ['events.ndjson'], '-' reads stdin
+    """
+    for path in paths:
+        stream = sys.stdin if path == '-' else open(path)
+        try:
+            for number, line in enumerate(stream, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as error:
+                    raise CommandError("%s:%s is not valid JSON: %s" % (path, number, error))
+                if 'items' in record:
+                    for item in record['items']:
+                        yield item
+                else:
+                    yield record
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def fixture_records():
+    """
+    Events of FIXTURE_PATH
+    """
+    with open(FIXTURE_PATH) as fixture:
+        return iter(json.load(fixture))
+
+
+def get_peak_rss():
+    """
+    Peak resident memory of the process in MB
+    """
+    # ru_maxrss is KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+class Command(BaseCommand):
+    """
+    Feeds recorded Google events into the ingestion path without OAuth or network:
+    python manage.py replay_events dump.ndjson --users 50 --distinct
+    """
+    help = "Replays newline delimited event JSON into Calendars of synthetic users"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help="Newline delimited JSON files, '-' for stdin")
+        parser.add_argument('--fixtures', action='store_true',
+                            help="Replay events of apps/calendar/testdata/events.json")
+        parser.add_argument('--users', type=int, default=1,
+                            help="Synthetic users every event is ingested for")
+        parser.add_argument('--distinct', action='store_true',
+                            help="Give every user own copy of events instead of a shared Calendar")
+        parser.add_argument('--repeat', type=int, default=1,
+                            help="Replay input these many times, repeats hit the update path")
+        parser.add_argument('--page-size', type=int, default=EVENTS_PAGE_SIZE,
+                            help="Events ingested at once, as a page of events().list")
+        parser.add_argument('--timezone', default='Asia/Kolkata',
+                            help="Timezone of the synthetic Calendars")
+
+    def get_calendars(self, count, time_zone):
+        calendars = []
+        for index in range(count):
+            email = 'replay-%s@replay.local' % index
+            user, _ = User.objects.get_or_create(username='replay-%s' % index, defaults={'email': email})
+            calendars.append(get_or_create_calendar(user, {'id': email, 'summary': email,
+                                                           'timeZone': time_zone, 'primary': True}))
+        return calendars
+
+    def handle(self, *args, **options):
+        if not options['paths'] and not options['fixtures']:
+            raise CommandError("Give files to replay or --fixtures")
+
+        calendars = self.get_calendars(options['users'], options['timezone'])
+        resolver = AccountResolver()
+        ingestors = [EventIngestor(calendar, resolver=resolver) for calendar in calendars]
+
+        events = queries = 0
+        started = time.time()
+        # months are recomputed once at the end as by a sync, its time is included
+        with deferred_months():
+            for _ in range(options['repeat']):
+                records = fixture_records() if options['fixtures'] else read_records(options['paths'])
+                for page in chunks(records, options['page_size']):
+                    for index, ingestor in enumerate(ingestors):
+                        if options['distinct']:
+                            page_records = [dict(record, id='%s_u%s' % (record['id'], index)) for record in page]
+                        else:
+                            page_records = page
+                        with CaptureQueriesContext(connection) as context:
+                            ingest_page(ingestor, page_records)
+                        queries += len(context.captured_queries)
+                        events += len(page_records)
+        elapsed = time.time() - started
+
+        stats = {}
+        for ingestor in ingestors:
+            for key, value in ingestor.stats.items():
+                stats[key] = stats.get(key, 0) + value
+
+        self.stdout.write("Replayed %s events for %s users in %.2fs" % (events, len(calendars), elapsed))
+        self.stdout.write("Throughput: %.0f events/s" % (events / elapsed if elapsed else 0))
+        self.stdout.write("Queries: %s (%.2f per event)" % (queries, float(queries) / events if events else 0))
+        self.stdout.write("Peak RSS: %.1f MB" % get_peak_rss())
+        self.stdout.write("Events: %s" % ', '.join('%s %s' % (key, stats[key]) for key in sorted(stats)))
+        self.stdout.write("Accounts: %s" % resolver.stats())
+
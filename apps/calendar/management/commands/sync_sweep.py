@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+
+import os
+import socket
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from apps.calendar.batch import sync_users, BATCH_SIZE
+from apps.calendar.identity import AccountResolver
+from apps.calendar.jobs import beat, claim_user_job, complete_job, fail_job
+from apps.calendar.models import SyncJob, RUNNING
+from apps.calendar.utils import chunks
+
+
+class Command(BaseCommand):
+    """
+    Scheduled org-wide refresh, Google calls of many Users are batched:
+    python manage.py sync_sweep --users-per-sweep 200
+
+    A SyncJob of every User is claimed before the User is synced, so
+    sync workers skip Users of the sweep and vice versa
+    """
+    help = "Syncs Calendars of all Users using batched Google API requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users-per-sweep', type=int, default=100,
+                            help="Users synced together, bounds memory of a sweep")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Calls per batch HTTP request")
+        parser.add_argument('--name', default="sweep:%s:%s" % (socket.gethostname(), os.getpid()),
+                            help="Worker name stored on claimed jobs")
+
+    def handle(self, *args, **options):
+        # Users being synced by a worker are picked up by the next sweep
+        busy_users = SyncJob.objects.filter(status=RUNNING).values('user_id')
+        users = User.objects.filter(useroauthtoken__isnull=False) \
+            .exclude(pk__in=busy_users).order_by('pk')
+
+        resolver = AccountResolver()
+        failed = 0
+        for group in chunks(users, options['users_per_sweep']):
+            jobs = {}
+            for user in group:
+                job = claim_user_job(user, options['name'])
+                if job is not None:
+                    jobs[user.pk] = job
+            claimed = [user for user in group if user.pk in jobs]
+            if not claimed:
+                continue
+
+            outcome = sync_users(claimed, resolver=resolver, batch_size=options['batch_size'],
+                                 on_round=lambda: beat(jobs.values()))
+            for user in claimed:
+                result = outcome[user.pk]
+                if isinstance(result, Exception):
+                    failed += 1
+                    fail_job(jobs[user.pk], result)
+                    self.stderr.write("User %s failed: %s" % (user.pk, result))
+                else:
+                    complete_job(jobs[user.pk], result)
+                    self.stdout.write("User %s: %s events in %s pages"
+                                      % (user.pk, result.events, result.pages))
+        self.stdout.write("Sweep done, %s users failed" % failed)
@@ -0,0 +1,48 @@
+from __future__ import absolute_import
+
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.calendar.jobs import claim_next_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    """
+    Drains SyncJob queue, run as many workers as needed:
+    python manage.py sync_worker
+    """
+    help = "Claims and runs pending Calendar sync jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit when queue is empty instead of polling")
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help="Seconds to sleep when queue is empty")
+        parser.add_argument('--name', default="%s:%s" % (socket.gethostname(), os.getpid()),
+                            help="Worker name stored on claimed jobs")
+
+    def handle(self, *args, **options):
+        worker = options['name']
+        self.stdout.write("Worker %s started" % worker)
+        try:
+            while True:
+                close_old_connections()
+                requeue_stale_jobs()
+                job = claim_next_job(worker)
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                job = run_job(job)
+                self.stdout.write("Job %s of user %s: %s, %s events in %s pages"
+                                  % (job.pk, job.user_id, job.status,
+                                     job.events_synced, job.pages_synced))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Worker %s stopped" % worker)
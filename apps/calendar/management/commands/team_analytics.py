@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+
+import json
+from multiprocessing import cpu_count
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from apps.calendar.team import compute_team_analytics, TEAM_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Prints analytics of the organisation or of a team as JSON:
+    python manage.py team_analytics --from 2019-01-01 --to 2019-07-01 --processes 8
+    """
+    help = "Computes team analytics from daily rollups on a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_day', required=True, help="First day, YYYY-MM-DD")
+        parser.add_argument('--to', dest='to_day', required=True, help="Day after the last one, YYYY-MM-DD")
+        parser.add_argument('--emails', default='',
+                            help="Comma separated emails of members, all Users with a Calendar if empty")
+        parser.add_argument('--processes', type=int, default=cpu_count(),
+                            help="Size of the process pool")
+        parser.add_argument('--chunk-size', type=int, default=TEAM_CHUNK_SIZE,
+                            help="Users aggregated per task")
+
+    def handle(self, *args, **options):
+        from_day, to_day = parse_date(options['from_day']), parse_date(options['to_day'])
+        if from_day is None or to_day is None or from_day >= to_day:
+            raise CommandError("--from and --to must be days as YYYY-MM-DD, --to after --from")
+        users = User.objects.filter(calendar__isnull=False)
+        emails = [email.strip() for email in options['emails'].split(',') if email.strip()]
+        if emails:
+            users = users.filter(email__in=emails)
+        data = compute_team_analytics(set(users.values_list('pk', flat=True)), from_day, to_day,
+                                      processes=options['processes'], chunk_size=options['chunk_size'])
+        data.update({'from': from_day.isoformat(), 'to': to_day.isoformat()})
+        self.stdout.write(json.dumps(data, indent=2, sort_keys=True))
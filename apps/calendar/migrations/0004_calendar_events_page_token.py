@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0003_auto_20191209_0902'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendar',
+            name='events_page_token',
+            field=models.TextField(blank=True, default=b'', help_text=b'PageToken of the next page of an unfinished events sync, used to resume the sync'),
+        ),
+    ]
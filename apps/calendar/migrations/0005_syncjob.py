@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:12
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('calendar', '0004_calendar_events_page_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[(b'pending', b'Pending'), (b'running', b'Running'), (b'succeeded', b'Succeeded'), (b'failed', b'Failed')], db_index=True, default=b'pending', help_text=b'Status of the job', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text=b'Number of times job has been started')),
+                ('max_attempts', models.PositiveIntegerField(default=5, help_text=b'Job fails after these many attempts')),
+                ('run_after', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text=b'Job is not claimed before this time, used for backoff')),
+                ('worker', models.CharField(blank=True, help_text=b'Worker which claimed the job', max_length=255)),
+                ('pages_synced', models.PositiveIntegerField(default=0, help_text=b'Pages of events persisted so far')),
+                ('events_synced', models.PositiveIntegerField(default=0, help_text=b'Events persisted so far')),
+                ('last_error', models.TextField(blank=True, help_text=b'Error of the last failed attempt')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text=b'Time when job was enqueued')),
+                ('started_at', models.DateTimeField(blank=True, help_text=b'Time when last attempt started', null=True)),
+                ('finished_at', models.DateTimeField(blank=True, help_text=b'Time when job succeeded or failed', null=True)),
+                ('user', models.ForeignKey(help_text=b'User whose Calendar is synced', on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def mark_existing_calendars_primary(apps, schema_editor):
+    """
+    Only primary Calendars were synced before
+    """
+    Calendar = apps.get_model('calendar', 'Calendar')
+    Calendar.objects.update(is_primary=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0005_syncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendar',
+            name='is_primary',
+            field=models.BooleanField(default=False, help_text=b'Is this the primary Calendar of User'),
+        ),
+        migrations.AlterField(
+            model_name='calendar',
+            name='cal_id',
+            field=models.CharField(help_text=b"Calender's ID", max_length=255),
+        ),
+        migrations.RunPython(mark_existing_calendars_primary, migrations.RunPython.noop),
+    ]
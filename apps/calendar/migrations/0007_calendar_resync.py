@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0006_calendar_is_primary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendar',
+            name='resync_started_at',
+            field=models.DateTimeField(blank=True, help_text=b'When a full resync in time windows started after SyncToken expired, null if none is running', null=True),
+        ),
+        migrations.AddField(
+            model_name='calendar',
+            name='resync_window',
+            field=models.PositiveIntegerField(default=0, help_text=b'Index of the time window being resynced'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0007_calendar_resync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text=b"Day in Calendar's timezone")),
+                ('busy_seconds', models.BigIntegerField(default=0, help_text=b'Total duration of meetings starting on day')),
+                ('meetings', models.PositiveIntegerField(default=0, help_text=b'Number of meetings starting on day')),
+                ('topic_seconds', models.TextField(default=b'{}', help_text=b'JSON of duration of meetings per topic i.e. {"standup": 1800}')),
+                ('calendar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='calendar.Calendar')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyrollup',
+            unique_together=set([('calendar', 'day')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0008_dailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendar',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0, help_text=b'Bumped whenever events of the Calendar change, cached analytics of older versions are stale'),
+        ),
+    ]
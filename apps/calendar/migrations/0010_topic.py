@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0009_calendar_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventTopic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_tags', to='calendar.Event')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Topic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text=b"Key of the Topic in analytics i.e. 'standup'", max_length=100, unique=True)),
+                ('terms', models.TextField(default=b'[]', help_text=b'JSON list of terms i.e. ["standup", "Stand up"]')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='eventtopic',
+            name='topic',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='calendar.Topic'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventtopic',
+            unique_together=set([('event', 'topic')]),
+        ),
+    ]
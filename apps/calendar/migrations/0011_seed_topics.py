@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations
+
+# Events tagged per query
+BATCH_SIZE = 1000
+
+# Topics which were hardcoded in AnalyticsAPIView
+TOPICS = [
+    ('recruit', ['Recruitment', 'Interview', 'Resume']),
+    ('standup', ['standup', 'Stand up', 'catch up']),
+    ('zoom', ['Zoom call']),
+    ('operation', ['Operation']),
+]
+
+
+def seed_topics(apps, schema_editor):
+    Topic = apps.get_model('calendar', 'Topic')
+    for name, terms in TOPICS:
+        Topic.objects.get_or_create(name=name, defaults={'terms': json.dumps(terms)})
+
+
+def tag_events(apps, schema_editor):
+    """
+    Events synced before Topics existed get their tags, a title is on a
+    Topic when it contains any of the Topic's terms ignoring case
+    """
+    Event = apps.get_model('calendar', 'Event')
+    EventTopic = apps.get_model('calendar', 'EventTopic')
+    Topic = apps.get_model('calendar', 'Topic')
+
+    topics = [(topic.pk, [term.lower() for term in json.loads(topic.terms) if term])
+              for topic in Topic.objects.order_by('pk')]
+    tags = []
+    for event_id, title in Event.objects.order_by('pk').values_list('id', 'title').iterator():
+        title = (title or '').lower()
+        tags.extend(EventTopic(event_id=event_id, topic_id=topic_id)
+                    for topic_id, terms in topics if any(term in title for term in terms))
+        if len(tags) >= BATCH_SIZE:
+            EventTopic.objects.bulk_create(tags)
+            tags = []
+    EventTopic.objects.bulk_create(tags)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0010_topic'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_topics, migrations.RunPython.noop),
+        migrations.RunPython(tag_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0011_seed_topics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoAttendance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text=b"First day of month in Calendar's timezone")),
+                ('meetings', models.PositiveIntegerField(default=0, help_text=b'Number of meetings starting in month attended by Account')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='calendar.Account')),
+                ('calendar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='calendar.Calendar')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='coattendance',
+            unique_together=set([('calendar', 'month', 'account')]),
+        ),
+    ]
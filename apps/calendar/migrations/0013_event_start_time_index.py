@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 02:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0012_coattendance'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='start_time',
+            field=models.DateTimeField(db_index=True, help_text=b'Start time of the event'),
+        ),
+    ]
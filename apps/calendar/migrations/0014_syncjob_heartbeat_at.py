@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 03:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0013_event_start_time_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, help_text=b'Time when worker last reported progress of the attempt', null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 03:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0014_syncjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyrollup',
+            name='time_spent_seconds',
+            field=models.BigIntegerField(default=0, help_text=b'Total duration of meetings starting on day'),
+        ),
+        migrations.AlterField(
+            model_name='dailyrollup',
+            name='busy_seconds',
+            field=models.BigIntegerField(default=0, help_text=b'Union of meetings starting on day, overlapping time is counted once'),
+        ),
+    ]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import pytz
+from django.db import migrations
+from django.db.models import Count, F
+from django.db.models.functions import TruncMonth
+
+# Frozen copy of apps.calendar.rollups as of this migration
+BATCH_SIZE = 100
+
+
+def get_busy_seconds(intervals):
+    """
+    Length of the union of (start_time, end_time) intervals
+    """
+    busy = 0
+    reach = None
+    for start_time, end_time in sorted(intervals):
+        if reach is not None and end_time <= reach:
+            continue
+        busy += int((end_time - max(start_time, reach or start_time)).total_seconds())
+        reach = end_time
+    return busy
+
+
+def aggregate_days(rows, time_zone):
+    """
+    :param rows: [(event_id, start_time, end_time, topic)]
+    :return: {<date obj>: [time_spent_seconds, busy_seconds, meetings, {'topic': seconds}]}
+    """
+    tz = pytz.timezone(time_zone or 'UTC')
+    days = {}
+    intervals = {}
+    seen = set()
+    for event_id, start_time, end_time, topic in rows:
+        seconds = int((end_time - start_time).total_seconds())
+        local_day = start_time.astimezone(tz).date()
+        day = days.setdefault(local_day, [0, 0, 0, {}])
+        if event_id not in seen:
+            seen.add(event_id)
+            day[0] += seconds
+            day[2] += 1
+            if end_time > start_time:
+                intervals.setdefault(local_day, []).append((start_time, end_time))
+        if topic is not None:
+            day[3][topic] = day[3].get(topic, 0) + seconds
+    for local_day, day_intervals in intervals.items():
+        days[local_day][1] = get_busy_seconds(day_intervals)
+    return days
+
+
+def aggregate_months(Attendee, calendar):
+    """
+    :return: {(<date obj>, account_id): meetings}
+    """
+    tz = pytz.timezone(calendar.timezone or 'UTC')
+    months = {}
+    rows = Attendee.objects.filter(event__calendar=calendar) \
+        .annotate(month=TruncMonth('event__start_time', tzinfo=tz)) \
+        .values_list('month', 'account_id') \
+        .annotate(meetings=Count('id')) \
+        .order_by()
+    for month, account_id, meetings in rows:
+        key = (month.astimezone(tz).date(), account_id)
+        months[key] = months.get(key, 0) + meetings
+    return months
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    'rollup' is the default analytics backend, Calendars synced before
+    rollups existed would have no DailyRollup and CoAttendance rows
+    """
+    Attendee = apps.get_model('calendar', 'Attendee')
+    Calendar = apps.get_model('calendar', 'Calendar')
+    CoAttendance = apps.get_model('calendar', 'CoAttendance')
+    DailyRollup = apps.get_model('calendar', 'DailyRollup')
+    Event = apps.get_model('calendar', 'Event')
+
+    for calendar in Calendar.objects.order_by('pk').iterator():
+        rows = Event.objects.filter(calendar=calendar) \
+            .values_list('id', 'start_time', 'end_time', 'topic_tags__topic__name')
+        totals = aggregate_days(rows.iterator(), calendar.timezone)
+        DailyRollup.objects.filter(calendar=calendar).delete()
+        DailyRollup.objects.bulk_create([
+            DailyRollup(calendar=calendar, day=day, time_spent_seconds=time_spent_seconds,
+                        busy_seconds=busy_seconds, meetings=meetings, topic_seconds=json.dumps(topics, sort_keys=True))
+            for day, (time_spent_seconds, busy_seconds, meetings, topics) in totals.items()],
+            batch_size=BATCH_SIZE)
+
+        CoAttendance.objects.filter(calendar=calendar).delete()
+        CoAttendance.objects.bulk_create([
+            CoAttendance(calendar=calendar, month=month, account_id=account_id, meetings=meetings)
+            for (month, account_id), meetings in aggregate_months(Attendee, calendar).items()],
+            batch_size=BATCH_SIZE)
+
+        Calendar.objects.filter(pk=calendar.pk).update(data_version=F('data_version') + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar', '0015_dailyrollup_busy_union'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
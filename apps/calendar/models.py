@@ -1,7 +1,9 @@
+import json
 from datetime import datetime
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 NEEDS_ACTION = 'needsAction'
 DECLINED = 'declined'
@@ -15,6 +17,18 @@ RSVP_CHOICES = (
     (ACCEPTED, 'Accepted')
 )
 
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+JOB_STATUS_CHOICES = (
+    (PENDING, 'Pending'),
+    (RUNNING, 'Running'),
+    (SUCCEEDED, 'Succeeded'),
+    (FAILED, 'Failed')
+)
+
 
 class Calendar(models.Model):
     """
@@ -23,12 +37,15 @@ class Calendar(models.Model):
     """
     user = models.ForeignKey(User)
 
+    # not unique as shared Calendars are synced for each of their Users
     cal_id = models.CharField(
         max_length=255,
-        unique=True,
         help_text="Calender's ID"
     )
 
+    is_primary = models.BooleanField(default=False,
+                                     help_text="Is this the primary Calendar of User")
+
     title = models.CharField(max_length=500,
                              help_text="Title/Summary of the Calendar")
 
@@ -40,12 +57,46 @@ class Calendar(models.Model):
                                          help_text="SyncToken of the events in Calendar "
                                                    "used to get any new events of the Calendar")
 
+    events_page_token = models.TextField(blank=True, default='',
+                                         help_text="PageToken of the next page of an unfinished "
+                                                   "events sync, used to resume the sync")
+
+    resync_started_at = models.DateTimeField(null=True, blank=True,
+                                             help_text="When a full resync in time windows started "
+                                                       "after SyncToken expired, null if none is running")
+
+    resync_window = models.PositiveIntegerField(default=0,
+                                                help_text="Index of the time window being resynced")
+
+    data_version = models.PositiveIntegerField(default=0,
+                                               help_text="Bumped whenever events of the Calendar change, "
+                                                         "cached analytics of older versions are stale")
+
     class Meta:
         unique_together = ('user', 'cal_id')
 
     def __unicode__(self):
         return self.title
 
+    @classmethod
+    def bump_data_version(cls, calendar_ids):
+        """
+        Marks analytics of Calendars stale
+        :param calendar_ids: [calendar_pk]
+        """
+        cls.objects.filter(pk__in=list(calendar_ids)).update(data_version=models.F('data_version') + 1)
+
+    @classmethod
+    def get_primary(cls, user):
+        """
+        Returns primary Calendar of User, or the oldest
+        Calendar if primary is not synced yet
+        """
+        calendar = cls.objects.filter(user=user).order_by('-is_primary', 'pk').first()
+        if calendar is None:
+            raise cls.DoesNotExist("User %s has no Calendar" % user.pk)
+        return calendar
+
 
 class Account(models.Model):
     """
@@ -133,7 +184,10 @@ class Event(models.Model):
                                   help_text="Organiser's field, "
                                             "set to creator if creator is User"
                                   )
+    # ranges of a Calendar's events are read through this index
+    # and the (event, calendar) index of the Calendar links
     start_time = models.DateTimeField(
+        db_index=True,
         help_text='Start time of the event'
     )
     end_time = models.DateTimeField(
@@ -154,3 +208,141 @@ class Event(models.Model):
         Return's if current token is expired or not
         """
         return datetime.now() < self.end_time
+
+
+class SyncJob(models.Model):
+    """
+    Durable queue of events syncs, a job is claimed and run
+    by 'sync_worker' management command
+    "User has many SyncJobs"
+    """
+    user = models.ForeignKey(User,
+                             help_text="User whose Calendar is synced")
+
+    status = models.CharField(
+        max_length=20,
+        choices=JOB_STATUS_CHOICES,
+        default=PENDING,
+        db_index=True,
+        help_text='Status of the job'
+    )
+    attempts = models.PositiveIntegerField(default=0,
+                                           help_text="Number of times job has been started")
+    max_attempts = models.PositiveIntegerField(default=5,
+                                               help_text="Job fails after these many attempts")
+    run_after = models.DateTimeField(default=timezone.now,
+                                     db_index=True,
+                                     help_text="Job is not claimed before this time, used for backoff")
+    worker = models.CharField(max_length=255, blank=True,
+                              help_text="Worker which claimed the job")
+
+    pages_synced = models.PositiveIntegerField(default=0,
+                                               help_text="Pages of events persisted so far")
+    events_synced = models.PositiveIntegerField(default=0,
+                                                help_text="Events persisted so far")
+    last_error = models.TextField(blank=True,
+                                  help_text="Error of the last failed attempt")
+
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      help_text='Time when job was enqueued')
+    started_at = models.DateTimeField(null=True, blank=True,
+                                      help_text='Time when last attempt started')
+    heartbeat_at = models.DateTimeField(null=True, blank=True,
+                                        help_text='Time when worker last reported progress of the attempt')
+    finished_at = models.DateTimeField(null=True, blank=True,
+                                       help_text='Time when job succeeded or failed')
+
+    def __unicode__(self):
+        return "%s %s" % (self.user.username, self.status)
+
+
+class DailyRollup(models.Model):
+    """
+    Time spent and busy time of a Calendar per day of Calendar's timezone,
+    kept up to date by ingestion, see apps.calendar.rollups
+    """
+    calendar = models.ForeignKey(Calendar, on_delete=models.CASCADE)
+
+    day = models.DateField(help_text="Day in Calendar's timezone")
+
+    time_spent_seconds = models.BigIntegerField(default=0,
+                                                help_text="Total duration of meetings starting on day")
+
+    busy_seconds = models.BigIntegerField(default=0,
+                                          help_text="Union of meetings starting on day, "
+                                                    "overlapping time is counted once")
+
+    meetings = models.PositiveIntegerField(default=0,
+                                           help_text="Number of meetings starting on day")
+
+    topic_seconds = models.TextField(default='{}',
+                                     help_text="JSON of duration of meetings per topic "
+                                               "i.e. {\"standup\": 1800}")
+
+    class Meta:
+        unique_together = ('calendar', 'day')
+
+    def __unicode__(self):
+        return "%s %s" % (self.calendar_id, self.day)
+
+    def get_topic_seconds(self):
+        return json.loads(self.topic_seconds)
+
+
+class Topic(models.Model):
+    """
+    Topic of meetings, a meeting is on a Topic when its title contains
+    any of the Topic's terms ignoring case.
+    Run 'reclassify_topics' after changing Topics to retag stored Events
+    """
+    name = models.CharField(max_length=100, unique=True,
+                            help_text="Key of the Topic in analytics i.e. 'standup'")
+
+    terms = models.TextField(default='[]',
+                             help_text="JSON list of terms i.e. [\"standup\", \"Stand up\"]")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return self.name
+
+    def get_terms(self):
+        return json.loads(self.terms)
+
+
+class EventTopic(models.Model):
+    """
+    Topic tag of an Event, set on ingestion by apps.calendar.topics.TopicMatcher
+    """
+    event = models.ForeignKey(Event, related_name='topic_tags', on_delete=models.CASCADE)
+
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('event', 'topic')
+
+    def __unicode__(self):
+        return "%s %s" % (self.event_id, self.topic_id)
+
+
+class CoAttendance(models.Model):
+    """
+    Number of a Calendar's meetings an Account attends per month of
+    Calendar's timezone, kept up to date by ingestion, see apps.calendar.rollups
+    """
+    calendar = models.ForeignKey(Calendar, on_delete=models.CASCADE)
+
+    month = models.DateField(help_text="First day of month in Calendar's timezone")
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+
+    meetings = models.PositiveIntegerField(default=0,
+                                           help_text="Number of meetings starting in month "
+                                                     "attended by Account")
+
+    class Meta:
+        # also the index of top attendees of a Calendar in a range of months
+        unique_together = ('calendar', 'month', 'account')
+
+    def __unicode__(self):
+        return "%s %s %s" % (self.calendar_id, self.month, self.account_id)
@@ -0,0 +1,317 @@
+from __future__ import absolute_import
+
+import json
+import threading
+from calendar import timegm
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+
+from apps.calendar.ingest import bulk_update
+from apps.calendar.intervals import busy_time_by_interval
+from apps.calendar.models import Attendee, Calendar, CoAttendance, DailyRollup, Event
+from apps.calendar.timeparse import get_timezone
+from apps.calendar.utils import chunks
+
+# Days recomputed by one query
+DAYS_PER_QUERY = 100
+
+# Months of CoAttendance recomputed by one query
+MONTHS_PER_QUERY = 12
+
+# rows of Events joined with their Topic tags
+ROLLUP_FIELDS = ('id', 'start_time', 'end_time', 'topic_tags__topic__name')
+
+# months touched by pages ingested within deferred_months of this thread
+_deferred = threading.local()
+
+
+def get_local_day(start_time, time_zone):
+    """
+    Day of event in Calendar's timezone
+    :param start_time: aware datetime
+    :param time_zone: 'Asia/Kolkata'
+    :return: <date obj>
+    """
+    return start_time.astimezone(get_timezone(time_zone)).date()
+
+
+def get_day_range(day, time_zone):
+    """
+    UTC bounds of a day in Calendar's timezone
+    :return: (start, end) aware datetimes, end is exclusive
+    """
+    tz = get_timezone(time_zone)
+    start = tz.localize(datetime(day.year, day.month, day.day))
+    next_day = day + timedelta(days=1)
+    return start, tz.localize(datetime(next_day.year, next_day.month, next_day.day))
+
+
+def aggregate_days(rows, time_zone):
+    """
+    Sums events per day of Calendar's timezone
+    :param rows: [(event_id, start_time, end_time, topic)], an event has a row
+                 per Topic tag and a single row with None topic if it has no tags
+    :return: {<date obj>: [time_spent_seconds, busy_seconds, meetings, {'topic': seconds}]}
+    busy_seconds is the union of meetings starting on day, see busy_time_by_interval
+    """
+    days = {}
+    seen = set()
+    intervals = []
+    for event_id, start_time, end_time, topic in rows:
+        seconds = int((end_time - start_time).total_seconds())
+        local_day = get_local_day(start_time, time_zone)
+        day = days.setdefault(local_day, [0, 0, 0, {}])
+        if event_id not in seen:
+            seen.add(event_id)
+            day[0] += seconds
+            day[2] += 1
+            intervals.append((local_day.toordinal(), timegm(start_time.utctimetuple()),
+                              timegm(end_time.utctimetuple())))
+        if topic is not None:
+            day[3][topic] = day[3].get(topic, 0) + seconds
+
+    if intervals:
+        ordinals, starts, ends = zip(*intervals)
+        for ordinal, busy in zip(ordinals, busy_time_by_interval(ordinals, starts, ends).tolist()):
+            days[date.fromordinal(ordinal)][1] += busy
+    return days
+
+
+def save_days(calendar, days, totals):
+    """
+    Writes rollups of 'days', days without events are deleted
+    :param days: [<date obj>] recomputed days
+    :param totals: aggregate_days output for these days
+    """
+    stored = {}
+    for chunk in chunks(days, DAYS_PER_QUERY):
+        for rollup in DailyRollup.objects.filter(calendar=calendar, day__in=chunk):
+            stored[rollup.day] = rollup
+
+    created, changed, emptied = [], [], []
+    for day in days:
+        if day not in totals:
+            if day in stored:
+                emptied.append(stored[day].pk)
+            continue
+        time_spent_seconds, busy_seconds, meetings, topics = totals[day]
+        values = {'time_spent_seconds': time_spent_seconds, 'busy_seconds': busy_seconds,
+                  'meetings': meetings, 'topic_seconds': json.dumps(topics, sort_keys=True)}
+        rollup = stored.get(day)
+        if rollup is None:
+            created.append(DailyRollup(calendar=calendar, day=day, **values))
+        elif any(getattr(rollup, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(rollup, field, value)
+            changed.append(rollup)
+
+    DailyRollup.objects.bulk_create(created, batch_size=DAYS_PER_QUERY)
+    bulk_update(changed, ['time_spent_seconds', 'busy_seconds', 'meetings', 'topic_seconds'])
+    for chunk in chunks(emptied, DAYS_PER_QUERY):
+        DailyRollup.objects.filter(pk__in=chunk).delete()
+
+
+def recompute_days(calendar, days):
+    """
+    Recomputes rollups of some days of Calendar from its events
+    :param calendar: <Calendar> instance
+    :param days: [<date obj>] in Calendar's timezone
+    """
+    days = sorted(set(days))
+    totals = {}
+    for chunk in chunks(days, DAYS_PER_QUERY):
+        query = Q()
+        for day in chunk:
+            start, end = get_day_range(day, calendar.timezone)
+            query |= Q(start_time__gte=start, start_time__lt=end)
+        rows = Event.objects.filter(query, calendar=calendar).values_list(*ROLLUP_FIELDS)
+        totals.update(aggregate_days(rows, calendar.timezone))
+    save_days(calendar, days, totals)
+
+
+def rebuild_rollups(calendar):
+    """
+    Recomputes all rollups of Calendar from its events, used for backfills
+    :param calendar: <Calendar> instance
+    :return: number of days with events
+    """
+    rows = Event.objects.filter(calendar=calendar).values_list(*ROLLUP_FIELDS)
+    totals = aggregate_days(rows.iterator(), calendar.timezone)
+    with transaction.atomic():
+        stored = DailyRollup.objects.filter(calendar=calendar).values_list('day', flat=True)
+        save_days(calendar, set(stored) | set(totals), totals)
+        Calendar.bump_data_version([calendar.pk])
+    return len(totals)
+
+
+def get_local_month(start_time, time_zone):
+    """
+    Month of event in Calendar's timezone
+    :return: <date obj> of first day of month
+    """
+    return get_local_day(start_time, time_zone).replace(day=1)
+
+
+def get_month_range(month, time_zone):
+    """
+    UTC bounds of a month in Calendar's timezone
+    :return: (start, end) aware datetimes, end is exclusive
+    """
+    tz = get_timezone(time_zone)
+    next_month = month + relativedelta(months=1)
+    return (tz.localize(datetime(month.year, month.month, 1)),
+            tz.localize(datetime(next_month.year, next_month.month, 1)))
+
+
+def aggregate_months(calendar, months=None):
+    """
+    Counts meetings of Calendar per month and attending Account
+    :param months: [<date obj>] first days of months, all months if None
+    :return: {(<date obj>, account_id): meetings}
+    """
+    attendees = Attendee.objects.filter(event__calendar=calendar)
+    if months is None:
+        queries = [Q()]
+    else:
+        queries = []
+        for chunk in chunks(months, MONTHS_PER_QUERY):
+            query = Q()
+            for month in chunk:
+                start, end = get_month_range(month, calendar.timezone)
+                query |= Q(event__start_time__gte=start, event__start_time__lt=end)
+            queries.append(query)
+
+    totals = {}
+    tz = get_timezone(calendar.timezone)
+    for query in queries:
+        rows = attendees.filter(query) \
+            .annotate(month=TruncMonth('event__start_time', tzinfo=tz)) \
+            .values_list('month', 'account_id') \
+            .annotate(meetings=Count('id')) \
+            .order_by()
+        for month, account_id, meetings in rows:
+            key = (get_local_day(month, calendar.timezone), account_id)
+            totals[key] = totals.get(key, 0) + meetings
+    return totals
+
+
+def save_months(calendar, months, totals):
+    """
+    Writes CoAttendance of 'months', Accounts no longer attending are deleted
+    :param months: [<date obj>] recomputed months
+    :param totals: aggregate_months output for these months
+    :return: number of rows created, changed or deleted
+    """
+    stored = {}
+    for chunk in chunks(months, MONTHS_PER_QUERY):
+        for counter in CoAttendance.objects.filter(calendar=calendar, month__in=chunk):
+            stored[(counter.month, counter.account_id)] = counter
+
+    created, changed = [], []
+    for (month, account_id), meetings in totals.items():
+        counter = stored.get((month, account_id))
+        if counter is None:
+            created.append(CoAttendance(calendar=calendar, month=month, account_id=account_id,
+                                        meetings=meetings))
+        elif counter.meetings != meetings:
+            counter.meetings = meetings
+            changed.append(counter)
+    emptied = [stale.pk for key, stale in stored.items() if key not in totals]
+
+    CoAttendance.objects.bulk_create(created, batch_size=DAYS_PER_QUERY)
+    bulk_update(changed, ['meetings'])
+    for chunk in chunks(emptied, DAYS_PER_QUERY):
+        CoAttendance.objects.filter(pk__in=chunk).delete()
+    return len(created) + len(changed) + len(emptied)
+
+
+def recompute_months(calendar, months):
+    """
+    Recomputes CoAttendance of some months of Calendar from its Attendees
+    :param months: [<date obj>] first days of months in Calendar's timezone
+    :return: number of rows written, see save_months
+    """
+    months = sorted(set(months))
+    return save_months(calendar, months, aggregate_months(calendar, months))
+
+
+@contextmanager
+def deferred_months(write_lock=None):
+    """
+    CoAttendance of months touched by pages ingested in the block is
+    recomputed once on exit instead of after every page, so a sync
+    aggregates a month once however many of its pages touch it.
+    Calendars whose counters changed get data_version bumped again as
+    analytics may have been cached between their last page and exit
+    :param write_lock: held while counters are written, see CalendarSync
+    """
+    if getattr(_deferred, 'months', None) is not None:
+        # months are recomputed by the outer block
+        yield
+        return
+    _deferred.months = {}
+    try:
+        yield
+    finally:
+        months, _deferred.months = _deferred.months, None
+        if months:
+            if write_lock is None:
+                recompute_deferred_months(months)
+            else:
+                with write_lock:
+                    recompute_deferred_months(months)
+
+
+def recompute_deferred_months(months):
+    """
+    :param months: {calendar_pk: set(<date obj>)} first days of touched months
+    """
+    with transaction.atomic():
+        calendars = Calendar.objects.in_bulk(list(months))
+        changed = [calendar_id for calendar_id, calendar in calendars.items()
+                   if recompute_months(calendar, months[calendar_id])]
+        if changed:
+            Calendar.bump_data_version(changed)
+
+
+def rebuild_coattendance(calendar):
+    """
+    Recomputes all CoAttendance of Calendar from its Attendees, used for backfills
+    :return: number of months with meetings
+    """
+    totals = aggregate_months(calendar)
+    with transaction.atomic():
+        stored = CoAttendance.objects.filter(calendar=calendar).values_list('month', flat=True)
+        save_months(calendar, set(stored) | set(month for month, _ in totals), totals)
+        Calendar.bump_data_version([calendar.pk])
+    return len(set(month for month, _ in totals))
+
+
+def update_rollups(sender, calendar, touched, **kwargs):
+    """
+    events_ingested receiver, recomputes days and months of Calendars touched by a page,
+    months are only collected within deferred_months
+    """
+    start_times = {}
+    for calendar_id, start_time in touched:
+        start_times.setdefault(calendar_id, []).append(start_time)
+
+    calendars = {calendar.pk: calendar}
+    others = [pk for pk in start_times if pk not in calendars]
+    if others:
+        calendars.update(Calendar.objects.in_bulk(others))
+
+    deferred = getattr(_deferred, 'months', None)
+    for calendar_id, times in start_times.items():
+        cal = calendars[calendar_id]
+        recompute_days(cal, [get_local_day(start_time, cal.timezone) for start_time in times])
+        months = [get_local_month(start_time, cal.timezone) for start_time in times]
+        if deferred is None:
+            recompute_months(cal, months)
+        else:
+            deferred.setdefault(calendar_id, set()).update(months)
@@ -0,0 +1,8 @@
+from __future__ import absolute_import
+
+from django.dispatch import Signal
+
+# Sent by EventIngestor inside the transaction of a page.
+# 'touched' is a set of (calendar_id, start_time) of events created, changed,
+# linked or cancelled, old start_time of changed events is included too
+events_ingested = Signal(providing_args=['calendar', 'touched'])
@@ -0,0 +1,299 @@
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from apps.calendar.intervals import to_epoch_seconds
+from apps.calendar.models import Attendee, Calendar, Event, EventTopic
+from apps.calendar.utils import chunks
+
+logger = logging.getLogger(__name__)
+
+# Columns of a snapshot, rows are events of a Calendar sorted by start:
+# 'start', 'end' int64 seconds since epoch, 'title' int32 codes into sorted titles,
+# 'topics' Topic pks and 'attendees' Account pks of each event
+SNAPSHOT_COLUMNS = ('start', 'end', 'title', 'topics', 'attendees')
+# stored as values of all rows plus offsets, values of row i are values[offsets[i]:offsets[i + 1]]
+LIST_COLUMNS = ('topics', 'attendees')
+# files of other writes older than this are left over by concurrent writes, seconds
+ORPHAN_AGE = 3600
+
+
+class EventSnapshot(object):
+    """
+    Columns of events of a Calendar, read from .npy files memory mapped
+    so only pages of columns and rows in use are loaded
+    """
+
+    def __init__(self, columns, titles=None, data_version=None):
+        """
+        :param columns: {'start': int64 array, 'topics': (offsets, values)} subset of SNAPSHOT_COLUMNS
+        :param titles: sorted distinct titles, codes of 'title' index it
+        :param data_version: Calendar.data_version the snapshot is built at
+        """
+        self.columns = columns
+        self.titles = titles
+        self.data_version = data_version
+
+    def __len__(self):
+        for name, column in self.columns.items():
+            return len(column[0]) - 1 if name in LIST_COLUMNS else len(column)
+        return 0
+
+    def take(self, rows):
+        """
+        Snapshot of some rows
+        :param rows: int array of row indexes
+        """
+        columns = {}
+        for name, column in self.columns.items():
+            if name in LIST_COLUMNS:
+                offsets, values = column
+                counts = np.diff(offsets)[rows]
+                new_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+                index = np.repeat(offsets[:-1][rows] - new_offsets[:-1], counts) + np.arange(new_offsets[-1])
+                columns[name] = (new_offsets, np.asarray(values)[index])
+            else:
+                columns[name] = np.asarray(column)[rows]
+        return EventSnapshot(columns, self.titles, self.data_version)
+
+    def slice(self, from_epoch=None, to_epoch=None):
+        """
+        Rows starting in [from_epoch, to_epoch), rows are sorted by start
+        so arrays are only sliced and stay memory mapped
+        """
+        start = self.columns['start']
+        low = np.searchsorted(start, from_epoch) if from_epoch is not None else 0
+        high = np.searchsorted(start, to_epoch) if to_epoch is not None else len(start)
+        columns = {}
+        for name, column in self.columns.items():
+            if name in LIST_COLUMNS:
+                offsets, values = column
+                columns[name] = (offsets[low:high + 1] - offsets[low], values[offsets[low]:offsets[high]])
+            else:
+                columns[name] = column[low:high]
+        return EventSnapshot(columns, self.titles, self.data_version)
+
+    def get_titles(self):
+        """
+        :return: object array of title of each row
+        """
+        return np.array(self.titles, dtype=object)[np.asarray(self.columns['title'])]
+
+
+def build_columns(rows, topics, attendees):
+    """
+    Snapshot of event rows sorted by start
+    :param rows: [(event_id, title, start_time, end_time)]
+    :param topics: [(event_id, topic_pk)]
+    :param attendees: [(event_id, account_pk)]
+    :return: <EventSnapshot obj>
+    """
+    event_ids, titles, starts, ends = zip(*rows) if rows else ((), (), (), ())
+    start, end = to_epoch_seconds(starts), to_epoch_seconds(ends)
+    order = np.lexsort((end, start))
+    distinct, codes = np.unique(np.array(titles, dtype=object), return_inverse=True)
+    columns = {'start': start[order], 'end': end[order], 'title': codes[order].astype(np.int32)}
+
+    position = dict((event_ids[row], index) for index, row in enumerate(order))
+    for name, pairs, dtype in (('topics', topics, np.int32), ('attendees', attendees, np.int64)):
+        owners = np.array([position[event_id] for event_id, _ in pairs], dtype=np.int64)
+        values = np.array([value for _, value in pairs], dtype=dtype)
+        by_row = np.argsort(owners, kind='mergesort')
+        offsets = np.searchsorted(owners[by_row], np.arange(len(order) + 1)).astype(np.int64)
+        columns[name] = (offsets, values[by_row])
+    return EventSnapshot(columns, list(distinct))
+
+
+def concat_snapshots(first, second):
+    """
+    Rows of both snapshots sorted by start, titles are merged
+    """
+    titles = np.concatenate([first.get_titles(), second.get_titles()])
+    distinct, codes = np.unique(titles, return_inverse=True)
+    columns = {'title': codes.astype(np.int32)}
+    for name in ('start', 'end'):
+        columns[name] = np.concatenate([first.columns[name], second.columns[name]]).astype(np.int64)
+    for name in LIST_COLUMNS:
+        (first_offsets, first_values), (second_offsets, second_values) = first.columns[name], second.columns[name]
+        columns[name] = (np.concatenate([first_offsets[:-1], second_offsets + first_offsets[-1]]),
+                         np.concatenate([first_values, second_values]))
+    snapshot = EventSnapshot(columns, list(distinct))
+    return snapshot.take(np.lexsort((columns['end'], columns['start'])))
+
+
+def load_rows(events):
+    """
+    Rows of build_columns for a queryset of Events, three queries
+    """
+    rows = list(events.values_list('id', 'title', 'start_time', 'end_time').distinct())
+    event_ids = events.values('id')
+    topics = list(EventTopic.objects.filter(event_id__in=event_ids).values_list('event_id', 'topic_id'))
+    attendees = list(Attendee.objects.filter(event_id__in=event_ids).values_list('event_id', 'account_id'))
+    return rows, topics, attendees
+
+
+def build_snapshot(calendar):
+    """
+    Snapshot of all events of a Calendar read from database
+    :param calendar: <Calendar> instance
+    """
+    snapshot = build_columns(*load_rows(Event.objects.filter(calendar=calendar)))
+    snapshot.data_version = calendar.data_version
+    return snapshot
+
+
+def get_snapshot_dir(calendar_id):
+    return os.path.join(settings.CALENDAR_SNAPSHOT_DIR, str(calendar_id))
+
+
+def read_meta(calendar_id):
+    """
+    :return: {'data_version': 3, 'rows': 120, 'token': 'a1b2'} or None if no snapshot is stored
+    """
+    try:
+        with open(os.path.join(get_snapshot_dir(calendar_id), 'meta.json')) as meta_file:
+            return json.load(meta_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_snapshot(calendar_id, snapshot):
+    """
+    Stores a snapshot, column files of a write carry a new token and
+    meta.json is renamed over the previous one, so readers always see
+    a complete snapshot. Only files of the replaced snapshot are removed,
+    files of a concurrent write are left to it
+    """
+    directory = get_snapshot_dir(calendar_id)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another process
+            pass
+    token = uuid.uuid4().hex
+    for name, column in snapshot.columns.items():
+        arrays = zip(('%s_offsets' % name, name), column) if name in LIST_COLUMNS else [(name, column)]
+        for file_name, array in arrays:
+            np.save(os.path.join(directory, '%s.%s.npy' % (file_name, token)), np.asarray(array))
+    with open(os.path.join(directory, 'titles.%s.json' % token), 'w') as titles_file:
+        json.dump(snapshot.titles, titles_file)
+
+    replaced = read_meta(calendar_id)
+    meta_path = os.path.join(directory, 'meta.json')
+    with open(meta_path + '.' + token, 'w') as meta_file:
+        json.dump({'data_version': snapshot.data_version, 'rows': len(snapshot), 'token': token}, meta_file)
+    os.rename(meta_path + '.' + token, meta_path)
+
+    # open memory maps of replaced files stay readable after removal
+    orphaned = time.time() - ORPHAN_AGE
+    for name in os.listdir(directory):
+        if name == 'meta.json' or token in name:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if (replaced and replaced['token'] in name) or os.path.getmtime(path) < orphaned:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def read_snapshot(calendar_id, columns=SNAPSHOT_COLUMNS):
+    """
+    Memory maps stored columns of a snapshot
+    :param columns: subset of SNAPSHOT_COLUMNS, other columns are not opened
+    :return: <EventSnapshot obj> or None if no snapshot is stored
+    """
+    meta = read_meta(calendar_id)
+    if meta is None:
+        return None
+    directory, token = get_snapshot_dir(calendar_id), meta['token']
+
+    def load(name):
+        return np.load(os.path.join(directory, '%s.%s.npy' % (name, token)), mmap_mode='r')
+
+    try:
+        arrays, titles = {}, None
+        for name in columns:
+            arrays[name] = (load('%s_offsets' % name), load(name)) if name in LIST_COLUMNS else load(name)
+        if 'title' in columns:
+            with open(os.path.join(directory, 'titles.%s.json' % token)) as titles_file:
+                titles = json.load(titles_file)
+    except (IOError, OSError, ValueError):
+        # replaced by a concurrent write
+        return None
+    return EventSnapshot(arrays, titles, meta['data_version'])
+
+
+def load_snapshot(calendar, columns=SNAPSHOT_COLUMNS):
+    """
+    Snapshot of Calendar at its current data_version, built from
+    database and stored when missing or stale
+    :param calendar: <Calendar> instance
+    """
+    snapshot = read_snapshot(calendar.pk, columns)
+    if snapshot is None or snapshot.data_version != calendar.data_version:
+        snapshot = build_snapshot(calendar)
+        write_snapshot(calendar.pk, snapshot)
+        snapshot = EventSnapshot(dict((name, snapshot.columns[name]) for name in columns),
+                                 snapshot.titles, snapshot.data_version)
+    return snapshot
+
+
+def patch_snapshot(calendar_id, snapshot, start_times):
+    """
+    Replaces rows of events starting at 'start_times' with their
+    rows read from database
+    :param start_times: [aware datetime]
+    :return: <EventSnapshot obj>
+    """
+    start_times = list(set(start_times))
+    kept = np.flatnonzero(~np.in1d(snapshot.columns['start'], to_epoch_seconds(start_times)))
+    snapshot = snapshot.take(kept)
+    for chunk in chunks(start_times):
+        events = Event.objects.filter(calendar=calendar_id, start_time__in=chunk)
+        snapshot = concat_snapshots(snapshot, build_columns(*load_rows(events)))
+    return snapshot
+
+
+def update_snapshots(sender, calendar, touched, **kwargs):
+    """
+    events_ingested receiver, patches stored snapshots of Calendars touched
+    by a page. Connected after invalidate_analytics so a snapshot one
+    data_version behind is patched to the bumped version, any other
+    snapshot is rebuilt on its next load.
+    Files are written once the page is committed, a rolled back page
+    never reaches a snapshot
+    """
+    start_times = {}
+    for calendar_id, start_time in touched:
+        start_times.setdefault(calendar_id, []).append(start_time)
+    transaction.on_commit(lambda: patch_snapshots(start_times))
+
+
+def patch_snapshots(start_times):
+    """
+    Patches stored snapshots which are one data_version behind
+    :param start_times: {calendar_pk: [start_time]} of touched events
+    """
+    metas = dict((calendar_id, read_meta(calendar_id)) for calendar_id in start_times)
+    metas = dict((calendar_id, meta) for calendar_id, meta in metas.items() if meta is not None)
+    if not metas:
+        return
+    versions = dict(Calendar.objects.filter(pk__in=list(metas)).values_list('pk', 'data_version'))
+    for calendar_id, meta in metas.items():
+        snapshot = read_snapshot(calendar_id)
+        if snapshot is None or meta['data_version'] + 1 != versions.get(calendar_id):
+            logger.info("Snapshot of calendar %s is stale, it is rebuilt on next load", calendar_id)
+            continue
+        snapshot = patch_snapshot(calendar_id, snapshot, start_times[calendar_id])
+        snapshot.data_version = versions[calendar_id]
+        write_snapshot(calendar_id, snapshot)
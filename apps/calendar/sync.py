@@ -0,0 +1,415 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from apps.calendar.google_api import build_calendar_service
+from apps.calendar.identity import AccountResolver
+from apps.calendar.ingest import EventIngestor
+from apps.calendar.models import Calendar, Event
+from apps.calendar.rollups import deferred_months
+from apps.calendar.tokens import get_user_credentials
+from apps.calendar.utils import get_calendar_list
+
+logger = logging.getLogger(__name__)
+
+# Maximum events Google returns per page, memory of a sync is bounded by it
+EVENTS_PAGE_SIZE = 250
+
+# Calendars of a User fetched at once
+SYNC_CALENDAR_THREADS = getattr(settings, 'SYNC_CALENDAR_THREADS', 8)
+
+# Calendars with lower access do not expose event details
+SYNCED_ACCESS_ROLES = ('reader', 'writer', 'owner')
+
+# Resync after SyncToken expired fetches events in windows of RESYNC_WINDOW,
+# upcoming events first and then back in time till RESYNC_HISTORY,
+# anything older is fetched in one last window
+RESYNC_WINDOW = timedelta(days=30)
+RESYNC_HISTORY = timedelta(days=360)
+
+# Maximum page size of events().list, used when only tokens are fetched
+TOKEN_PAGE_SIZE = 2500
+
+
+def get_resync_windows(started_at):
+    """
+    Time windows of a resync, newest first
+    :param started_at: when resync started
+    :return: [(time_min or None, time_max or None)]
+    """
+    windows = [(started_at, None)]
+    count = int(RESYNC_HISTORY.total_seconds() // RESYNC_WINDOW.total_seconds())
+    for index in range(count):
+        windows.append((started_at - RESYNC_WINDOW * (index + 1), started_at - RESYNC_WINDOW * index))
+    windows.append((None, started_at - RESYNC_WINDOW * count))
+    return windows
+
+
+class SyncResult(object):
+    """
+    Outcome of syncing events of a Calendar
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.events = 0
+        self.resumed = False
+
+    def __repr__(self):
+        return "<SyncResult pages=%s events=%s resumed=%s>" % (self.pages, self.events, self.resumed)
+
+    @classmethod
+    def combine(cls, results):
+        """
+        Sums results of many Calendars
+        :param results: [<SyncResult>]
+        :return: <SyncResult>
+        """
+        combined = cls()
+        for result in results:
+            combined.pages += result.pages
+            combined.events += result.events
+            combined.resumed = combined.resumed or result.resumed
+        return combined
+
+
+def build_service(user):
+    """
+    Builds Google Calendar service with User's credentials,
+    Access Token is refreshed through apps.calendar.tokens
+    :param user: <User> instance
+    :return: Google Calendar API service
+    """
+    return build_calendar_service(get_user_credentials(user))
+
+
+def sync_user(user, on_page=None, threads=SYNC_CALENDAR_THREADS, service_factory=build_service):
+    """
+    Syncs events of all Calendars of User
+
+    Calendars are fetched concurrently on a pool of 'threads' threads, each
+    thread has its own service as HTTP connection is not thread safe.
+    Pages are written one at a time so Events shared by Calendars
+    are not inserted twice.
+    :param user: <User> instance
+    :param on_page: called with combined <SyncResult> after every persisted page
+    :param threads: size of thread pool
+    :param service_factory: callable(user) returning Google Calendar service
+    :return: <SyncResult>
+    """
+    calendar_records = get_calendar_list(user, service_factory(user))
+    calendars = [get_or_create_calendar(user, record) for record in calendar_records
+                 if record.get('accessRole', 'owner') in SYNCED_ACCESS_ROLES]
+
+    resolver = AccountResolver()
+    write_lock = threading.Lock()
+    main_thread = threading.current_thread()
+    results = {}
+
+    def on_calendar_page(calendar, result):
+        results[calendar.pk] = result
+        if on_page:
+            on_page(SyncResult.combine(list(results.values())))
+
+    def sync(calendar):
+        try:
+            result = sync_calendar_events(service_factory(user), calendar,
+                                          resolver=resolver,
+                                          write_lock=write_lock,
+                                          on_page=lambda result: on_calendar_page(calendar, result))
+            return calendar, result, None
+        except Exception as error:
+            logger.exception("Sync of calendar %s failed", calendar.pk)
+            return calendar, None, error
+        finally:
+            if threading.current_thread() is not main_thread:
+                connection.close()
+
+    if threads <= 1 or len(calendars) <= 1:
+        outcomes = [sync(calendar) for calendar in calendars]
+    else:
+        pool = ThreadPool(min(threads, len(calendars)))
+        try:
+            outcomes = pool.map(sync, calendars)
+        finally:
+            pool.close()
+            pool.join()
+
+    errors = [error for _, _, error in outcomes if error is not None]
+    if errors:
+        # other Calendars are synced, failed ones resume from their page token on retry
+        raise errors[0]
+    return SyncResult.combine(result for _, result, _ in outcomes)
+
+
+class CalendarSync(object):
+    """
+    Page by page sync of events of a Calendar. Requests are executed by
+    the caller so pages of many Calendars can be fetched in one batch,
+    see apps.calendar.batch
+
+    Page token of the next page is stored on calendar after every page so an
+    interrupted sync resumes from there. 'nextSyncToken' is stored only
+    after the last page is persisted.
+
+    When Google rejects the SyncToken with 410 Gone the Calendar is resynced:
+    a fresh SyncToken is fetched first (tokens only, no events) so changes
+    made during the resync are picked by the next sync, then events are
+    fetched in time windows newest first, see get_resync_windows. Stored
+    events of a window which Google did not return are removed. Progress is
+    stored on calendar so an interrupted resync resumes at its window, the
+    window is fetched again from its first page as ids seen in its earlier
+    pages are only kept in memory.
+    """
+
+    def __init__(self, calendar, resolver=None, page_size=EVENTS_PAGE_SIZE, on_page=None, write_lock=None):
+        """
+        :param calendar: <Calendar> instance
+        :param resolver: <AccountResolver> shared by all pages
+        :param page_size: events per page
+        :param on_page: called with <SyncResult> after every persisted page
+        :param write_lock: held while a page is written, shared by Calendars synced together
+        """
+        self.calendar = calendar
+        self.resolver = resolver or AccountResolver()
+        self.ingestor = EventIngestor(calendar, resolver=self.resolver)
+        self.page_size = page_size
+        self.on_page = on_page
+        self.write_lock = write_lock
+        self.result = SyncResult()
+        self.done = False
+
+        # sync_token will make sure we are not fetching same events again and again
+        self.sync_token = calendar.events_sync_token or None
+        self.page_token = calendar.events_page_token or None
+        self.result.resumed = bool(self.page_token) or self.resyncing
+        # ids seen in current window and in whole resync, events spanning
+        # windows are returned for each of them but written once
+        self.window_ids = set()
+        self.resynced_ids = set()
+        if self.resyncing and calendar.events_sync_token:
+            # removal at the end of the window needs ids of all its pages
+            self.page_token = None
+
+    @property
+    def resyncing(self):
+        return self.calendar.resync_started_at is not None
+
+    def get_window(self):
+        return get_resync_windows(self.calendar.resync_started_at)[self.calendar.resync_window]
+
+    def request(self, service):
+        """
+        Request of the next page
+        :param service: Google Calendar API service
+        :return: <HttpRequest obj>
+        """
+        if not self.resyncing:
+            return service.events().list(calendarId=self.calendar.cal_id,
+                                         maxResults=self.page_size,
+                                         pageToken=self.page_token,
+                                         syncToken=self.sync_token)
+        if not self.calendar.events_sync_token:
+            return service.events().list(calendarId=self.calendar.cal_id,
+                                         maxResults=TOKEN_PAGE_SIZE,
+                                         pageToken=self.page_token,
+                                         fields='nextPageToken,nextSyncToken')
+        time_min, time_max = self.get_window()
+        return service.events().list(calendarId=self.calendar.cal_id,
+                                     maxResults=self.page_size,
+                                     pageToken=self.page_token,
+                                     timeMin=time_min.isoformat() if time_min else None,
+                                     timeMax=time_max.isoformat() if time_max else None)
+
+    def handle_error(self, error):
+        """
+        Recovers from a rejected page token by starting the current listing
+        again and from an expired SyncToken by starting a resync
+        :param error: <HttpError obj>
+        :return: True if next page can be requested, False if error must be raised
+        """
+        status = error.resp.status
+        if self.page_token and status in (400, 410):
+            logger.warning("Page token of calendar %s rejected, restarting sync", self.calendar.pk)
+            self.page_token = None
+            self.calendar.events_page_token = ''
+            self.calendar.save(update_fields=['events_page_token'])
+            self.window_ids = set()
+            self.result.resumed = False
+            return True
+        if status == 410 and self.sync_token and not self.resyncing:
+            self.start_resync()
+            return True
+        return False
+
+    def start_resync(self):
+        logger.warning("SyncToken of calendar %s expired, resyncing in windows", self.calendar.pk)
+        calendar = self.calendar
+        calendar.resync_started_at = timezone.now()
+        calendar.resync_window = 0
+        calendar.events_sync_token = ''
+        calendar.events_page_token = ''
+        calendar.save(update_fields=['resync_started_at', 'resync_window',
+                                     'events_sync_token', 'events_page_token'])
+        self.sync_token = None
+        self.page_token = None
+
+    def handle_response(self, response):
+        """
+        Persists page and moves to the next one
+        :param response: events().list response
+        """
+        calendar = self.calendar
+        if self.resyncing and not calendar.events_sync_token:
+            # tokens only listing of a resync
+            self.page_token = response.get('nextPageToken')
+            calendar.events_page_token = self.page_token or ''
+            if not self.page_token:
+                calendar.events_sync_token = response.get('nextSyncToken')
+            calendar.save(update_fields=['events_sync_token', 'events_page_token'])
+            return
+
+        records = response.get('items', [])
+        if self.resyncing:
+            self.window_ids.update(record['id'] for record in records)
+            fresh = [record for record in records if record['id'] not in self.resynced_ids]
+            self.resynced_ids.update(record['id'] for record in fresh)
+            self.ingest(fresh)
+        else:
+            self.ingest(records)
+        self.result.pages += 1
+        self.result.events += len(records)
+        if self.on_page:
+            self.on_page(self.result)
+
+        self.page_token = response.get('nextPageToken')
+        if self.page_token:
+            calendar.events_page_token = self.page_token
+            calendar.save(update_fields=['events_page_token'])
+            return
+
+        if self.resyncing:
+            self.finish_window()
+            if self.resyncing:
+                return
+        else:
+            # store the nextSyncToken in calendar as it belongs to calendar only
+            calendar.events_sync_token = response.get("nextSyncToken")
+            calendar.events_page_token = ''
+            calendar.save(update_fields=['events_sync_token', 'events_page_token'])
+        self.done = True
+        logger.info("Synced calendar %s %r, account resolver stats %s",
+                    calendar.pk, self.result, self.resolver.stats())
+
+    def ingest(self, records):
+        if self.write_lock is None:
+            ingest_page(self.ingestor, records)
+        else:
+            with self.write_lock:
+                ingest_page(self.ingestor, records)
+
+    def finish_window(self):
+        """
+        Removes stored events of the window Google did not return and moves
+        to the next window, resync is over after the last window
+        """
+        calendar = self.calendar
+        time_min, time_max = self.get_window()
+        # same filter as Google's, events ending after timeMin and starting before timeMax
+        stored = Event.objects.filter(calendar=calendar)
+        if time_min:
+            stored = stored.filter(end_time__gt=time_min)
+        if time_max:
+            stored = stored.filter(start_time__lt=time_max)
+        removed = [event_id for event_id in stored.values_list('id', flat=True)
+                   if event_id not in self.window_ids]
+        if removed:
+            if self.write_lock is None:
+                self.ingestor.remove(removed)
+            else:
+                with self.write_lock:
+                    self.ingestor.remove(removed)
+        self.window_ids = set()
+
+        calendar.events_page_token = ''
+        if calendar.resync_window + 1 < len(get_resync_windows(calendar.resync_started_at)):
+            calendar.resync_window += 1
+        else:
+            logger.info("Resync of calendar %s finished", calendar.pk)
+            calendar.resync_started_at = None
+            calendar.resync_window = 0
+        calendar.save(update_fields=['events_page_token', 'resync_started_at', 'resync_window'])
+
+
+def sync_calendar_events(service, calendar, resolver=None, page_size=EVENTS_PAGE_SIZE, on_page=None,
+                         write_lock=None):
+    """
+    Fetches events of calendar page by page and persists each page
+    as it arrives, each page is committed in its own transaction.
+    CoAttendance of touched months is recomputed once the pages are done
+    :param service: Google Calendar API service
+    :param calendar: <Calendar> instance
+    :param resolver: <AccountResolver> shared by all pages
+    :param page_size: events per page
+    :param on_page: called with <SyncResult> after every persisted page
+    :param write_lock: held while a page is written, shared by Calendars synced together
+    :return: <SyncResult>
+    """
+    sync = CalendarSync(calendar, resolver=resolver, page_size=page_size,
+                        on_page=on_page, write_lock=write_lock)
+    with deferred_months(write_lock):
+        while not sync.done:
+            try:
+                response = sync.request(service).execute()
+            except HttpError as error:
+                if not sync.handle_error(error):
+                    raise
+                continue
+            sync.handle_response(response)
+    return sync.result
+
+
+def ingest_page(ingestor, records):
+    """
+    Persists page of events, page is retried once if an Event got inserted by
+    a concurrent sync of another User sharing the Calendar
+    """
+    try:
+        return ingestor.ingest(records)
+    except IntegrityError:
+        logger.warning("Page of calendar %s conflicted with concurrent sync, retrying",
+                       ingestor.calendar.pk)
+        # Accounts created by the failed attempt were rolled back
+        ingestor.resolver.forget_uncommitted()
+        return ingestor.ingest(records)
+
+
+def get_or_create_calendar(user, calendar_record):
+    """
+    Look if calendar  already exists for user
+    If exists then update title and timezone which are dynamic
+    If not then creat new one
+    :param calendar_record:{'id': 'sarukumesh@gmail.com',
+                             'summary': 'sarukumesh@gmail.com',
+                             'timeZone': 'Asia/Calcutta',
+                             'primary': True}
+    :param request:
+    :return:
+    """
+    calendar, _ = Calendar.objects.update_or_create(user=user,
+                                                    cal_id=calendar_record["id"],
+                                                    defaults={
+                                                        'title': calendar_record["summary"],
+                                                        'timezone': calendar_record["timeZone"],
+                                                        'is_primary': calendar_record.get("primary", False),
+                                                    })
+
+    return calendar
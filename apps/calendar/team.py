@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+
+import json
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+from django.db import connections
+from django.db.models import Sum
+
+from apps.calendar.models import Calendar, CoAttendance, DailyRollup
+from apps.calendar.utils import chunks
+
+# Users whose aggregates are computed by one task of the pool
+TEAM_CHUNK_SIZE = 200
+
+# Entries of ranked lists in team analytics
+TEAM_TOP = 10
+
+
+def get_primary_calendars(user_ids):
+    """
+    Primary Calendar of each User, same as Calendar.get_primary
+    :return: {calendar_pk: user email}
+    """
+    calendars = {}
+    seen = set()
+    for calendar_id, user_id, email in Calendar.objects.filter(user_id__in=user_ids) \
+            .order_by('user_id', '-is_primary', 'pk').values_list('pk', 'user_id', 'user__email'):
+        if user_id not in seen:
+            seen.add(user_id)
+            calendars[calendar_id] = email
+    return calendars
+
+
+def aggregate_users(user_ids, from_day, to_day):
+    """
+    Partial team analytics of some Users, computed from DailyRollup and
+    CoAttendance rows of their primary Calendars. Runs in pool workers.
+    :param user_ids: [user_pk]
+    :param from_day: <date obj> first day, inclusive
+    :param to_day: <date obj> last day, exclusive
+    :return: {'users': 2, 'members': {email: [seconds, busy, meetings]}, 'months': Counter,
+              'weeks': Counter, 'topics': Counter, 'collaborators': Counter}
+    'users' counts Users with a primary Calendar, with or without rollups in range,
+    'months' and 'weeks' are busy time like the report of a single User
+    """
+    calendars = get_primary_calendars(user_ids)
+    rows = list(DailyRollup.objects.filter(calendar_id__in=list(calendars), day__gte=from_day, day__lt=to_day)
+                .values_list('calendar_id', 'day', 'time_spent_seconds', 'busy_seconds', 'meetings',
+                             'topic_seconds'))
+    partial = {'users': len(calendars), 'members': {}, 'months': Counter(), 'weeks': Counter(),
+               'topics': Counter(), 'collaborators': Counter()}
+
+    if rows:
+        calendar_ids, days, seconds, busy, meetings, topics = zip(*rows)
+        calendar_ids = np.array(calendar_ids)
+        days = np.array(days, dtype='datetime64[D]')
+        seconds = np.array(seconds, dtype=np.int64)
+        busy = np.array(busy, dtype=np.int64)
+        meetings = np.array(meetings, dtype=np.int64)
+
+        # per member totals
+        members, member = np.unique(calendar_ids, return_inverse=True)
+        member_seconds = np.bincount(member, weights=seconds, minlength=len(members))
+        member_busy = np.bincount(member, weights=busy, minlength=len(members))
+        member_meetings = np.bincount(member, weights=meetings, minlength=len(members))
+        for index, calendar_id in enumerate(members):
+            partial['members'][calendars[calendar_id]] = [int(member_seconds[index]), int(member_busy[index]),
+                                                          int(member_meetings[index])]
+
+        # 1970-01-01 was a Thursday, weeks start on Monday
+        week_starts = days - (days.astype(np.int64) + 3) % 7
+        for key, buckets in (('months', days.astype('datetime64[M]')), ('weeks', week_starts)):
+            starts, bucket = np.unique(buckets, return_inverse=True)
+            totals = np.bincount(bucket, weights=busy, minlength=len(starts))
+            partial[key].update(dict((str(start), int(total)) for start, total in zip(starts, totals)))
+
+        for topic_seconds in topics:
+            partial['topics'].update(json.loads(topic_seconds))
+
+    counters = CoAttendance.objects.filter(calendar_id__in=list(calendars), month__gte=from_day.replace(day=1),
+                                           month__lt=to_day) \
+        .values_list('calendar_id', 'account__email') \
+        .annotate(count=Sum('meetings')) \
+        .order_by()
+    for calendar_id, email, count in counters:
+        if email != calendars[calendar_id]:
+            partial['collaborators'][email] += count
+    return partial
+
+
+def _aggregate_chunk(args):
+    return aggregate_users(*args)
+
+
+def merge_partials(partials):
+    """
+    Merges partial team analytics of workers
+    """
+    merged = {'users': 0, 'members': {}, 'months': Counter(), 'weeks': Counter(), 'topics': Counter(),
+              'collaborators': Counter()}
+    for partial in partials:
+        merged['users'] += partial['users']
+        merged['members'].update(partial['members'])
+        for key in ('months', 'weeks', 'topics', 'collaborators'):
+            merged[key].update(partial[key])
+    return merged
+
+
+def compute_team_analytics(user_ids, from_day, to_day, processes=1, chunk_size=TEAM_CHUNK_SIZE):
+    """
+    Analytics of a team of Users, Users are split into chunks which
+    are aggregated on a process pool and merged
+    :param user_ids: [user_pk]
+    :param from_day: <date obj> first day, inclusive
+    :param to_day: <date obj> last day, exclusive
+    :param processes: size of the pool, chunks are aggregated in this process if 1
+    :param chunk_size: Users per task
+    :return: {'members': 120, 'time_spent': 3600, 'busy_time': 3600, 'meetings': 1,
+              'months': {'2019-06': 3600}, 'weeks': {'2019-06-24': 3600},
+              'topics': {'standup': 1800},
+              'top_collaborators': [{'email': 'a@a.com', 'count': 3}],
+              'busiest_members': [{'email': 'b@b.com', 'time_spent': 3600, 'busy_time': 3600, 'meetings': 1}]}
+    'time_spent' sums durations, 'busy_time' counts overlapping meetings of a
+    member once, 'months' and 'weeks' are busy time
+    """
+    tasks = [(chunk, from_day, to_day) for chunk in chunks(sorted(user_ids), chunk_size)]
+    if processes > 1 and len(tasks) > 1:
+        # forked workers must open own database connections
+        connections.close_all()
+        pool = Pool(processes)
+        try:
+            partials = pool.imap_unordered(_aggregate_chunk, tasks)
+            merged = merge_partials(partials)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        merged = merge_partials(_aggregate_chunk(task) for task in tasks)
+
+    members = merged['members']
+    busiest = sorted(members.items(), key=lambda item: (-item[1][1], item[0]))[:TEAM_TOP]
+    collaborators = sorted(merged['collaborators'].items(), key=lambda item: (-item[1], item[0]))[:TEAM_TOP]
+    return {
+        'members': merged['users'],
+        'time_spent': sum(seconds for seconds, _, _ in members.values()),
+        'busy_time': sum(busy for _, busy, _ in members.values()),
+        'meetings': sum(meetings for _, _, meetings in members.values()),
+        'months': dict(merged['months']),
+        'weeks': dict(merged['weeks']),
+        'topics': dict(merged['topics']),
+        'top_collaborators': [{'email': email, 'count': count} for email, count in collaborators],
+        'busiest_members': [{'email': email, 'time_spent': seconds, 'busy_time': busy, 'meetings': meetings}
+                            for email, (seconds, busy, meetings) in busiest],
+    }
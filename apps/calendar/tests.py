@@ -1,86 +1,65 @@
-import mock as mock
-import pandas as pd
+from __future__ import absolute_import
+
+import csv
+import email
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+import mock
+import numpy as np
+import six
+from dateutil import parser
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, connections
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from googleapiclient.errors import HttpError
 from pandas._libs.tslibs.timestamps import Timestamp
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import parse_qs, urlparse
 
-from apps.calendar.api import CalendarAnalytics
-from apps.calendar.models import Calendar, Event
-from apps.calendar.views import get_or_create_events, get_or_create_calendar, get_organiser, get_utc_time, \
-    create_attendees
+from apps.authenticate.models import UserOauthToken
+from apps.calendar import google_api
+from apps.calendar.api import CalendarAnalytics, SQLCalendarAnalytics, RollupCalendarAnalytics, \
+    SnapshotCalendarAnalytics, AnalyticsRangeAPIView, GRANULARITIES, SERIES_METRICS, build_events_frame, \
+    get_calendar_analytics
+from apps.calendar.availability import find_common_free_slots, load_busy_index
+from apps.calendar.batch import sync_users
+from apps.calendar.cache import FileAnalyticsCache, LocMemAnalyticsCache
+from apps.calendar.export import iter_event_records
+from apps.calendar.identity import AccountResolver
+from apps.calendar.ingest import EventIngestor, get_utc_time
+from apps.calendar.intervals import busy_time_by_bucket
+from apps.calendar.jobs import (enqueue_sync, claim_next_job, claim_user_job, requeue_stale_jobs, run_job,
+                               STALE_JOB_TIMEOUT)
+from apps.calendar.management.commands.replay_events import fixture_records
+from apps.calendar.models import Calendar, Event, Attendee, Account, SyncJob, DailyRollup, EventTopic, Topic, \
+    CoAttendance, PENDING, RUNNING, SUCCEEDED, FAILED
+from apps.calendar.rollups import aggregate_months
+from apps.calendar.snapshots import build_snapshot, get_snapshot_dir, load_snapshot, read_meta, read_snapshot, \
+    write_snapshot, ORPHAN_AGE, SNAPSHOT_COLUMNS
+from apps.calendar.sync import build_service, get_or_create_calendar, ingest_page, sync_calendar_events, sync_user, \
+    SyncResult
+from apps.calendar.team import compute_team_analytics
+from apps.calendar.timeparse import parse_datetime, parse_date, parse_timestamps
+from apps.calendar.tokens import get_access_token, TokenRefreshError
+from apps.calendar.topics import TopicMatcher, reclassify_events
+from apps.calendar.utils import get_calendar_list, get_new_access_token
+from apps.calendar.views import get_or_create_events, get_organiser, create_attendees
 
 
 class TestEventCreation(TestCase):
-    EVENTS_DATA = [
-        {
-            "end": {
-                "dateTime": "2015-06-24T15:30:00+05:30"
-            },
-            "description": "descicption1",
-            "created": "2015-06-19T16:20:45.000Z",
-            "htmlLink": "www.example.com/1",
-            "updated": "2015-06-24T04:31:45.434Z",
-            "summary": "One on one ",
-            "start": {
-                "dateTime": "2015-06-24T14:30:00+05:30"
-            },
-            "location": "Skype",
-            "attendees": [
-                {
-                    "self": True,
-                    "email": "admin@admin.com",
-                    "responseStatus": "accepted"
-                },
-                {
-                    "organizer": True,
-                    "displayName": "Giles Barker",
-                    "email": "user@admin.com",
-                    "responseStatus": "accepted"
-                }
-            ],
-            "organizer": {
-                "email": "user@admin.com"
-            },
-            "creator": {
-                "email": "admin@admin.com"
-            },
-            "id": "752jkq80k2213ed13e13134"
-        },
-        {
-            "end": {
-                "timeZone": "Asia/Kolkata",
-                "dateTime": "2015-08-03T10:15:00+05:30"
-            },
-            "created": "2015-08-03T04:04:32.000Z",
-            "htmlLink": "www.example.com/2",
-            "updated": "2015-08-03T08:25:01.102Z",
-            "summary": "Standup Meeting",
-            "start": {
-                "timeZone": "Asia/Kolkata",
-                "dateTime": "2015-08-03T10:00:00+05:30"
-            },
-            "attendees": [
-                {
-                    "email": "admin@admin.com",
-                    "responseStatus": "declined"
-                },
-                {
-                    "email": "admin2@admin.com",
-                    "responseStatus": "needsAction"
-                },
-                {
-                    "email": "user2@admin.com",
-                    "responseStatus": "accepted"
-                }
-            ],
-            "organizer": {
-                "email": "admin@group.calendar.google.com"
-            },
-            "creator": {
-                "email": "admin2@admin.com"
-            },
-            "id": "752jkq80k2213ed13jgpo"
-        }]
+    EVENTS_DATA = list(fixture_records())
 
     def setUp(self):
         self.user = User.objects.create(username='admin',
@@ -173,6 +152,980 @@ class TestEventCreation(TestCase):
         self.assertEquals(actual_output[0].event, event)
 
 
+def make_event_records(count, attendees=3, prefix='evt'):
+    """
+    Builds 'count' synthetic Google Event dicts
+    """
+    records = []
+    for index in range(count):
+        records.append({
+            "id": "%s%05d" % (prefix, index),
+            "status": "confirmed",
+            "htmlLink": "www.example.com/%s" % index,
+            "summary": "Meeting %s" % index,
+            "created": "2019-06-19T16:20:45.000Z",
+            "updated": "2019-06-24T04:31:45.434Z",
+            "start": {"dateTime": "2019-06-24T14:30:00+05:30"},
+            "end": {"dateTime": "2019-06-24T15:30:00+05:30"},
+            "creator": {"email": "admin@admin.com"},
+            "organizer": {"email": "org%s@admin.com" % (index % 5)},
+            "attendees": [{"email": "user%s@admin.com" % ((index + offset) % 20),
+                           "responseStatus": "accepted"}
+                          for offset in range(attendees)],
+        })
+    return records
+
+
+class FakeEventsService(object):
+    """
+    Stand-in of Google Calendar service serving events().list pages
+    Page N is requested with pageToken 'pageN'
+    """
+
+    def __init__(self, pages, sync_token='next-sync-token', fail_on=None):
+        self.pages = pages
+        self.sync_token = sync_token
+        self.fail_on = fail_on
+        self.requests = []
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        self.requests.append(kwargs)
+        index = int((kwargs.get('pageToken') or 'page0')[4:])
+        if index == self.fail_on:
+            self.fail_on = None
+            return mock.Mock(execute=mock.Mock(side_effect=RuntimeError('connection reset')))
+        pages = self.get_pages(kwargs)
+        response = {'items': pages[index]}
+        if index + 1 < len(pages):
+            response['nextPageToken'] = 'page%s' % (index + 1)
+        else:
+            response['nextSyncToken'] = self.sync_token
+        return mock.Mock(execute=mock.Mock(return_value=response))
+
+    def get_pages(self, kwargs):
+        return self.pages
+
+
+class FakeCalendarsService(FakeEventsService):
+    """
+    Stand-in of Google Calendar service with many Calendars
+    :param calendars: {'calendar_id': [page1, page2]}
+    """
+
+    def __init__(self, calendars, **kwargs):
+        super(FakeCalendarsService, self).__init__(pages=None, **kwargs)
+        self.calendars = calendars
+
+    def get_pages(self, kwargs):
+        return self.calendars[kwargs['calendarId']]
+
+    def calendarList(self):
+        items = [{'id': cal_id, 'summary': cal_id, 'timeZone': 'Asia/Kolkata',
+                  'accessRole': 'owner', 'primary': index == 0}
+                 for index, cal_id in enumerate(sorted(self.calendars))]
+        return mock.Mock(list=mock.Mock(return_value=mock.Mock(
+            execute=mock.Mock(return_value={'items': items}))))
+
+
+def make_timed_record(event_id, days, hours=1):
+    """
+    Google Event dict starting 'days' from now
+    """
+    start = timezone.now().replace(microsecond=0) + timedelta(days=days)
+    record = make_event_records(1, prefix=event_id)[0]
+    record.update({'id': event_id,
+                   'start': {'dateTime': start.isoformat()},
+                   'end': {'dateTime': (start + timedelta(hours=hours)).isoformat()}})
+    return record
+
+
+class FakeWindowedService(object):
+    """
+    Stand-in of Google Calendar service filtering events by timeMin/timeMax,
+    rejects 'expired-sync-token' with 410 Gone
+    """
+
+    def __init__(self, records, page_size=2, fail_on_request=None):
+        self.records = records
+        self.page_size = page_size
+        self.fail_on_request = fail_on_request
+        self.requests = []
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        self.requests.append(kwargs)
+        if len(self.requests) == self.fail_on_request:
+            return mock.Mock(execute=mock.Mock(side_effect=RuntimeError('connection reset')))
+        if kwargs.get('syncToken') == 'expired-sync-token':
+            return mock.Mock(execute=mock.Mock(side_effect=HttpError(mock.Mock(status=410), b'Gone')))
+        if kwargs.get('fields') == 'nextPageToken,nextSyncToken':
+            return mock.Mock(execute=mock.Mock(return_value={'nextSyncToken': 'fresh-sync-token'}))
+
+        records = self.records
+        if kwargs.get('timeMin'):
+            time_min = parse_datetime(kwargs['timeMin'])
+            records = [record for record in records if parse_datetime(record['end']['dateTime']) > time_min]
+        if kwargs.get('timeMax'):
+            time_max = parse_datetime(kwargs['timeMax'])
+            records = [record for record in records if parse_datetime(record['start']['dateTime']) < time_max]
+        index = int((kwargs.get('pageToken') or 'page0')[4:])
+        response = {'items': records[index * self.page_size:(index + 1) * self.page_size]}
+        if (index + 1) * self.page_size < len(records):
+            response['nextPageToken'] = 'page%s' % (index + 1)
+        else:
+            response['nextSyncToken'] = 'window-sync-token'
+        return mock.Mock(execute=mock.Mock(return_value=response))
+
+
+class TestTimeParse(TestCase):
+
+    def test_parse_datetime_matches_dateutil(self):
+        for value in ["2015-08-03T10:15:00+05:30", "2015-06-19T16:20:45.000Z",
+                      "2015-06-24T04:31:45.434Z", "2015-06-24T04:31:45.123456789-07:00",
+                      "2015-06-24 04:31:45+00:00", "Mon, 24 Jun 2015 04:31:45 GMT"]:
+            self.assertEqual(parse_datetime(value), parser.parse(value), value)
+        self.assertEqual(parse_datetime("2015-08-03T10:15:00+05:30").isoformat(),
+                         '2015-08-03T10:15:00+05:30')
+
+    def test_parse_date_uses_calendar_timezone(self):
+        self.assertEqual(parse_date("2015-08-03", "Asia/Kolkata").isoformat(),
+                         '2015-08-03T00:00:00+05:30')
+        self.assertEqual(parse_date("2015-08-03", "Europe/London").isoformat(),
+                         '2015-08-03T00:00:00+01:00')
+
+    def test_parse_timestamps(self):
+        values = ["2015-08-03", "2015-08-03T10:15:00Z", "2015-08-03"]
+        self.assertEqual([dt.isoformat() for dt in parse_timestamps(values, "Asia/Kolkata")],
+                         ['2015-08-03T00:00:00+05:30', '2015-08-03T10:15:00+00:00',
+                          '2015-08-03T00:00:00+05:30'])
+
+
+# Minimal Calendar v3 discovery document, enough for the calls made by sync
+DISCOVERY_DOCUMENT = {
+    'kind': 'discovery#restDescription',
+    'name': 'calendar',
+    'version': 'v3',
+    'rootUrl': 'https://www.googleapis.com/',
+    'servicePath': 'calendar/v3/',
+    'batchPath': 'batch/calendar/v3',
+    'parameters': {},
+    'schemas': dict((name, {'id': name, 'type': 'object'})
+                    for name in ('CalendarList', 'Calendar', 'Events')),
+    'resources': {
+        'calendarList': {'methods': {'list': {
+            'id': 'calendar.calendarList.list', 'path': 'users/me/calendarList', 'httpMethod': 'GET',
+            'parameters': {'pageToken': {'type': 'string', 'location': 'query'}},
+            'response': {'$ref': 'CalendarList'}}}},
+        'calendars': {'methods': {'get': {
+            'id': 'calendar.calendars.get', 'path': 'calendars/{calendarId}', 'httpMethod': 'GET',
+            'parameters': {'calendarId': {'type': 'string', 'location': 'path', 'required': True}},
+            'parameterOrder': ['calendarId'], 'response': {'$ref': 'Calendar'}}}},
+        'events': {'methods': {'list': {
+            'id': 'calendar.events.list', 'path': 'calendars/{calendarId}/events', 'httpMethod': 'GET',
+            'parameters': {'calendarId': {'type': 'string', 'location': 'path', 'required': True},
+                           'pageToken': {'type': 'string', 'location': 'query'},
+                           'syncToken': {'type': 'string', 'location': 'query'},
+                           'timeMin': {'type': 'string', 'location': 'query'},
+                           'timeMax': {'type': 'string', 'location': 'query'},
+                           'fields': {'type': 'string', 'location': 'query'},
+                           'maxResults': {'type': 'integer', 'location': 'query'}},
+            'parameterOrder': ['calendarId'], 'response': {'$ref': 'Events'}}}},
+    },
+}
+
+
+StandInRequest = namedtuple('StandInRequest', 'command path headers')
+
+
+class StandInGoogleHandler(BaseHTTPRequestHandler):
+    """
+    Serves canned JSON responses keyed by path, keeps connections alive.
+    Calls of a batch request are answered from the same responses.
+    """
+    protocol_version = 'HTTP/1.1'
+    batch_path = '/batch/calendar/v3'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def dispatch(self, request):
+        self.server.requests.append((request.command, request.path))
+        path = request.path.split('?')[0]
+        response = self.server.responses.get(path, (404, {'error': {'code': 404}}))
+        if callable(response):
+            response = response(request)
+        status, body = response
+        if callable(body):
+            body = body(request)
+        return status, json.dumps(body)
+
+    def dispatch_batch(self):
+        self.server.requests.append((self.command, self.path))
+        message = email.message_from_string('Content-Type: %s\r\n\r\n%s'
+                                            % (self.headers.get('Content-Type'), self.body))
+        parts = []
+        for part in message.get_payload():
+            request_line, raw = part.get_payload().split('\n', 1)
+            command, path, _ = request_line.split(' ')
+            status, content = self.dispatch(StandInRequest(command, path, email.message_from_string(raw)))
+            parts.append('--batch\r\nContent-Type: application/http\r\n'
+                         'Content-ID: <response-%s>\r\n\r\n'
+                         'HTTP/1.1 %s OK\r\nContent-Type: application/json\r\n\r\n%s\r\n'
+                         % (part['Content-ID'][1:-1], status, content))
+        return 200, ''.join(parts) + '--batch--', 'multipart/mixed; boundary=batch'
+
+    def respond(self):
+        if self.path == self.batch_path:
+            status, content, content_type = self.dispatch_batch()
+        else:
+            status, content = self.dispatch(self)
+            content_type = 'application/json'
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.respond()
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInGoogleServer(ThreadingMixIn, HTTPServer):
+    # kept alive connections must not block shutdown
+    daemon_threads = True
+
+
+class StandInGoogleTestCase(TestCase):
+    """
+    Runs a local stand-in of Google API and points discovery document and
+    token endpoint at it
+    """
+    responses = {}
+
+    def setUp(self):
+        self.server = StandInGoogleServer(('127.0.0.1', 0), StandInGoogleHandler)
+        self.server.responses = dict(self.responses)
+        self.server.requests = []
+        self.server.connections = 0
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        url = 'http://127.0.0.1:%s/' % self.server.server_port
+
+        self.cache_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.cache_dir, 'calendar.v3.json'), 'w') as cache:
+            json.dump(DISCOVERY_DOCUMENT, cache)
+        self.settings_override = override_settings(
+            CALENDAR_DISCOVERY_CACHE=os.path.join(self.cache_dir, 'calendar.v3.json'),
+            CALENDAR_API_ROOT_URL=url,
+            GOOGLE_TOKEN_URI=url + 'token')
+        self.settings_override.enable()
+        google_api.reset()
+
+    def tearDown(self):
+        google_api.reset()
+        self.server.shutdown()
+        self.server.server_close()
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def build_service(self, token='access-token'):
+        return google_api.build_calendar_service(google_api.get_credentials(token, 'refresh-token'))
+
+
+class TestGoogleApiClient(StandInGoogleTestCase):
+    responses = {
+        '/calendar/v3/users/me/calendarList': (200, {'items': [{'id': 'admin@admin.com'}]}),
+        '/token': (200, {'access_token': 'new-access-token', 'expires_in': 3600}),
+    }
+
+    def test_discovery_document_is_loaded_once(self):
+        with mock.patch('apps.calendar.google_api._fetch_discovery_document') as fetch:
+            self.build_service()
+            with mock.patch('apps.calendar.google_api.open', create=True) as opened:
+                self.build_service()
+                self.assertFalse(opened.called)
+            self.assertFalse(fetch.called)
+
+    def test_missing_discovery_document_is_fetched_and_cached(self):
+        os.remove(settings.CALENDAR_DISCOVERY_CACHE)
+        with mock.patch('apps.calendar.google_api._fetch_discovery_document',
+                        return_value=json.dumps(DISCOVERY_DOCUMENT)) as fetch:
+            self.build_service()
+        self.assertEqual(fetch.call_count, 1)
+        self.assertTrue(os.path.exists(settings.CALENDAR_DISCOVERY_CACHE))
+
+    def test_services_share_keep_alive_connection(self):
+        user = User.objects.create(username='admin', email='admin@admin.com')
+        for _ in range(3):
+            calendars = get_calendar_list(user, self.build_service())
+        self.assertEqual(calendars, [{'id': 'admin@admin.com'}])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_token_refresh_uses_pooled_session(self):
+        self.assertEqual(get_new_access_token('refresh-token'), 'new-access-token')
+        self.assertEqual(get_new_access_token('refresh-token'), 'new-access-token')
+        self.assertEqual(self.server.requests, [('POST', '/token'), ('POST', '/token')])
+        self.assertEqual(self.server.connections, 1)
+
+
+class TestTokenManager(StandInGoogleTestCase):
+    responses = {
+        '/token': (200, {'access_token': 'new-access-token', 'expires_in': 3600}),
+    }
+
+    def setUp(self):
+        super(TestTokenManager, self).setUp()
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.user_oauth = UserOauthToken.objects.create(
+            user=self.user, access_token='access-token', refresh_token='refresh-token',
+            token_expiry=timezone.now() + timedelta(hours=1))
+
+    def expire_token(self):
+        UserOauthToken.objects.update(token_expiry=timezone.now() + timedelta(minutes=1))
+
+    def test_valid_token_is_not_refreshed(self):
+        self.assertEqual(get_access_token(self.user), 'access-token')
+        self.assertEqual(self.server.requests, [])
+
+    def test_token_is_refreshed_before_expiry(self):
+        self.expire_token()
+        self.assertEqual(get_access_token(self.user), 'new-access-token')
+        self.assertEqual(get_access_token(self.user), 'new-access-token')
+
+        user_oauth = UserOauthToken.objects.get(user=self.user)
+        self.assertGreater(user_oauth.token_expiry, timezone.now() + timedelta(minutes=55))
+        self.assertEqual(self.server.requests, [('POST', '/token')])
+
+    def test_rejected_refresh_token_is_not_retried(self):
+        self.expire_token()
+        self.server.responses['/token'] = (400, {'error': 'invalid_grant'})
+        with self.assertRaises(TokenRefreshError):
+            get_access_token(self.user)
+        self.assertEqual(len(self.server.requests), 1)
+
+    @mock.patch('apps.calendar.tokens.REFRESH_RETRY_DELAY', 0)
+    def test_refresh_retries_are_capped(self):
+        self.expire_token()
+        self.server.responses['/token'] = (503, {'error': 'backendError'})
+        with self.assertRaises(TokenRefreshError):
+            get_access_token(self.user)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_unauthorized_request_refreshes_token_once(self):
+        def calendar_list(handler):
+            if 'new-access-token' in handler.headers.get('Authorization', ''):
+                return 200, {'items': [{'id': 'admin@admin.com'}]}
+            return 401, {'error': {'code': 401}}
+        self.server.responses['/calendar/v3/users/me/calendarList'] = calendar_list
+
+        calendars = get_calendar_list(self.user, build_service(self.user))
+        self.assertEqual(calendars, [{'id': 'admin@admin.com'}])
+        self.assertEqual([path for method, path in self.server.requests].count('/token'), 1)
+        self.assertEqual(UserOauthToken.objects.get(user=self.user).access_token, 'new-access-token')
+
+
+class TestConcurrentTokenRefresh(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        UserOauthToken.objects.create(user=self.user, access_token='access-token',
+                                      refresh_token='refresh-token', token_expiry=timezone.now())
+
+    @mock.patch('apps.calendar.tokens.request_access_token')
+    def test_concurrent_refreshes_are_coalesced(self, request_access_token):
+        def slow_refresh(refresh_token):
+            time.sleep(0.2)
+            return {'access_token': 'new-access-token', 'expires_in': 3600}
+        request_access_token.side_effect = slow_refresh
+
+        tokens = []
+        # in-memory test database is shared with threads as LiveServerTestCase does
+        shared = connections['default']
+        shared.allow_thread_sharing = True
+
+        def refresh():
+            connections['default'] = shared
+            tokens.append(get_access_token(self.user))
+
+        threads = [threading.Thread(target=refresh) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        shared.allow_thread_sharing = False
+
+        self.assertEqual(tokens, ['new-access-token'] * 4)
+        self.assertEqual(request_access_token.call_count, 1)
+
+
+def serve_event_pages(pages):
+    """
+    Stand-in events().list response serving 'pages', page N is requested with pageToken 'pageN'
+    """
+    def respond(request):
+        query = parse_qs(urlparse(request.path).query)
+        index = int(query.get('pageToken', ['page0'])[0][4:])
+        response = {'items': pages[index]}
+        if index + 1 < len(pages):
+            response['nextPageToken'] = 'page%s' % (index + 1)
+        else:
+            response['nextSyncToken'] = 'next-sync-token'
+        return 200, response
+    return respond
+
+
+class TestBatchSync(StandInGoogleTestCase):
+
+    def setUp(self):
+        super(TestBatchSync, self).setUp()
+        self.users = []
+        for name in ('admin', 'other'):
+            user = User.objects.create(username=name, email='%s@admin.com' % name)
+            UserOauthToken.objects.create(user=user, access_token='token-%s' % name,
+                                          refresh_token='refresh-token',
+                                          token_expiry=timezone.now() + timedelta(hours=1))
+            self.users.append(user)
+
+        shared = make_event_records(2, prefix='shared')
+        self.server.responses.update({
+            '/calendar/v3/users/me/calendarList': self.serve_calendar_list,
+            '/calendar/v3/calendars/admin%40admin.com/events': serve_event_pages(
+                [make_event_records(3, prefix='admin%s' % page) for page in range(3)]),
+            '/calendar/v3/calendars/other%40admin.com/events': serve_event_pages(
+                [make_event_records(3, prefix='other%s' % page) for page in range(2)]),
+            '/calendar/v3/calendars/team%40admin.com/events': serve_event_pages([shared]),
+        })
+
+    def serve_calendar_list(self, request):
+        def record(cal_id):
+            return {'id': cal_id, 'summary': cal_id, 'timeZone': 'Asia/Kolkata', 'accessRole': 'owner'}
+        if 'token-other' in request.headers.get('Authorization', ''):
+            return 200, {'items': [record('other@admin.com'), record('team@admin.com')]}
+        # calendar list of admin has two pages
+        if 'pageToken' in request.path:
+            return 200, {'items': [record('team@admin.com')]}
+        return 200, {'items': [record('admin@admin.com')], 'nextPageToken': 'page1'}
+
+    def test_calls_of_all_users_are_batched_per_round(self):
+        outcome = sync_users(self.users)
+
+        self.assertEqual((outcome[self.users[0].pk].pages, outcome[self.users[0].pk].events), (4, 11))
+        self.assertEqual((outcome[self.users[1].pk].pages, outcome[self.users[1].pk].events), (3, 8))
+        self.assertEqual(Event.objects.count(), 17)
+        self.assertEqual(Calendar.objects.get(user=self.users[1], cal_id='team@admin.com').event_set.count(), 2)
+        self.assertEqual(Calendar.objects.filter(events_sync_token='next-sync-token').count(), 4)
+
+        # 2 rounds of calendar lists and 3 rounds of events, one batch request each
+        batches = [request for request in self.server.requests if request[0] == 'POST']
+        self.assertEqual(len(batches), 5)
+        self.assertEqual(len(self.server.requests) - len(batches), 3 + 7)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_batches_are_split_by_batch_size(self):
+        sync_users(self.users, batch_size=2)
+        # events rounds have 4, 2 and 1 calls
+        batches = [request for request in self.server.requests if request[0] == 'POST']
+        self.assertEqual(len(batches), 2 + 2 + 1 + 1)
+
+    def test_failed_call_fails_its_user_only(self):
+        self.server.responses['/calendar/v3/calendars/other%40admin.com/events'] = \
+            (403, {'error': {'code': 403, 'message': 'rateLimitExceeded'}})
+        outcome = sync_users(self.users)
+
+        self.assertIsInstance(outcome[self.users[1].pk], HttpError)
+        self.assertEqual(outcome[self.users[0].pk].events, 11)
+        self.assertEqual(Calendar.objects.get(user=self.users[0], cal_id='admin@admin.com').event_set.count(), 9)
+
+    def test_failed_user_is_not_requested_any_more(self):
+        self.server.responses['/calendar/v3/calendars/other%40admin.com/events'] = \
+            (403, {'error': {'code': 403, 'message': 'rateLimitExceeded'}})
+        team = serve_event_pages([make_event_records(2, prefix='team%s' % page) for page in range(3)])
+        callers = []
+
+        def serve_team(request):
+            callers.append('token-other' in request.headers.get('Authorization', ''))
+            return team(request)
+        self.server.responses['/calendar/v3/calendars/team%40admin.com/events'] = serve_team
+        rounds = mock.Mock()
+
+        outcome = sync_users(self.users, on_round=rounds)
+
+        self.assertIsInstance(outcome[self.users[1].pk], HttpError)
+        # other fails in first round, only admin requests later pages of team
+        self.assertEqual(callers, [False, True, False, False])
+        self.assertEqual(rounds.call_count, 3)
+
+    def test_sweep_claims_jobs_of_users(self):
+        busy = SyncJob.objects.create(user=self.users[1], status=RUNNING, worker='worker-1',
+                                      started_at=timezone.now(), heartbeat_at=timezone.now())
+        pending = SyncJob.objects.create(user=self.users[0])
+
+        call_command('sync_sweep', name='sweep-1', stdout=six.StringIO())
+
+        pending.refresh_from_db()
+        self.assertEqual((pending.status, pending.worker, pending.events_synced), (SUCCEEDED, 'sweep-1', 11))
+        self.assertEqual(SyncJob.objects.get(pk=busy.pk).status, RUNNING)
+        self.assertFalse(Calendar.objects.filter(user=self.users[1]).exists())
+
+
+class TestEventIngestor(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin',
+                                        email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user,
+                                                cal_id=self.user.email,
+                                                title=self.user.email,
+                                                timezone='Asia/Kolkata',
+                                                events_sync_token="events_sync_token")
+
+    def test_ingest_creates_events_attendees_and_links(self):
+        colleague = User.objects.create(username='user0', email='user0@admin.com')
+        records = make_event_records(10)
+        events = EventIngestor(self.calendar).ingest(records)
+
+        self.assertEqual([event.id for event in events], [record['id'] for record in records])
+        self.assertEqual(Event.objects.count(), 10)
+        self.assertEqual(Attendee.objects.count(), 30)
+        self.assertEqual(self.calendar.event_set.count(), 10)
+        self.assertEqual(Account.objects.get(email='user0@admin.com').user, colleague)
+        self.assertIsNone(Account.objects.get(email='user1@admin.com').user)
+
+    def test_ingest_query_count_is_constant(self):
+        # warm up accounts so both runs only differ by page size
+        EventIngestor(self.calendar).ingest(make_event_records(20, prefix='warm'))
+
+        # 8 for events, 1 for Topics, 3 for rollups of touched days,
+        # 3 for co-attendance of touched months and 1 for data_version
+        with self.assertNumQueries(16):
+            EventIngestor(self.calendar).ingest(make_event_records(10, prefix='small'))
+        with self.assertNumQueries(16):
+            EventIngestor(self.calendar).ingest(make_event_records(150, prefix='large'))
+
+    def test_ingest_existing_events_are_only_linked(self):
+        records = make_event_records(3)
+        EventIngestor(self.calendar).ingest(records)
+        other = Calendar.objects.create(user=self.user, cal_id='team@group.calendar.google.com',
+                                        title='Team', timezone='Asia/Kolkata')
+
+        EventIngestor(other).ingest(records)
+
+        self.assertEqual(Event.objects.count(), 3)
+        self.assertEqual(Attendee.objects.count(), 9)
+        self.assertEqual(other.event_set.count(), 3)
+
+    def test_ingest_applies_changes(self):
+        records = make_event_records(3)
+        EventIngestor(self.calendar).ingest(records)
+
+        changed = dict(records[0], summary='Moved meeting', updated='2019-06-25T04:31:45.434Z',
+                       start={'dateTime': '2019-06-25T14:30:00+05:30'},
+                       attendees=[{'email': 'user0@admin.com', 'responseStatus': 'declined'},
+                                  {'email': 'new@admin.com', 'responseStatus': 'tentative'}])
+        # same 'updated' means nothing changed even if payload differs
+        stale = dict(records[1], summary='Ignored')
+        ingestor = EventIngestor(self.calendar)
+        ingestor.ingest([changed, stale])
+
+        self.assertEqual(ingestor.stats, {'created': 0, 'updated': 1, 'unchanged': 1, 'cancelled': 0})
+        event = Event.objects.get(id=records[0]['id'])
+        self.assertEqual(event.title, 'Moved meeting')
+        self.assertEqual(event.start_time.isoformat(), '2019-06-25T09:00:00+00:00')
+        self.assertEqual(dict(event.attendee_set.values_list('account__email', 'rsvp')),
+                         {'user0@admin.com': 'declined', 'new@admin.com': 'tentative'})
+        self.assertEqual(Event.objects.get(id=records[1]['id']).title, 'Meeting 1')
+
+    def test_ingest_cancelled_events(self):
+        records = make_event_records(4)
+        EventIngestor(self.calendar).ingest(records)
+        other = Calendar.objects.create(user=self.user, cal_id='team@group.calendar.google.com',
+                                        title='Team', timezone='Asia/Kolkata')
+        EventIngestor(other).ingest(records[:1])
+
+        page = [{'id': records[0]['id'], 'status': 'cancelled'},
+                {'id': records[1]['id'], 'status': 'cancelled'},
+                make_event_records(1, prefix='after')[0]]
+        events = EventIngestor(self.calendar).ingest(page)
+
+        # events after a cancelled one are still applied
+        self.assertEqual([event.id for event in events], ['after00000'])
+        self.assertEqual(set(self.calendar.event_set.values_list('id', flat=True)),
+                         {records[2]['id'], records[3]['id'], 'after00000'})
+        # still linked to other calendar so kept, orphan is deleted
+        self.assertTrue(Event.objects.filter(id=records[0]['id']).exists())
+        self.assertFalse(Event.objects.filter(id=records[1]['id']).exists())
+        self.assertFalse(Attendee.objects.filter(event_id=records[1]['id']).exists())
+
+
+class TestSyncCalendarEvents(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin',
+                                        email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user,
+                                                cal_id=self.user.email,
+                                                title=self.user.email,
+                                                timezone='Asia/Kolkata',
+                                                events_sync_token='')
+        self.pages = [make_event_records(5, prefix='page%s-' % index) for index in range(3)]
+
+    def test_sync_persists_pages_and_stores_sync_token(self):
+        result = sync_calendar_events(FakeEventsService(self.pages), self.calendar)
+
+        self.assertEqual((result.pages, result.events), (3, 15))
+        self.assertEqual(self.calendar.event_set.count(), 15)
+        self.calendar.refresh_from_db()
+        self.assertEqual(self.calendar.events_sync_token, 'next-sync-token')
+        self.assertEqual(self.calendar.events_page_token, '')
+
+    def test_interrupted_sync_resumes_from_last_page(self):
+        service = FakeEventsService(self.pages, fail_on=2)
+        with self.assertRaises(RuntimeError):
+            sync_calendar_events(service, self.calendar)
+
+        self.calendar.refresh_from_db()
+        # first two pages are committed, sync token is not stored yet
+        self.assertEqual(self.calendar.event_set.count(), 10)
+        self.assertEqual(self.calendar.events_page_token, 'page2')
+        self.assertEqual(self.calendar.events_sync_token, '')
+
+        result = sync_calendar_events(service, self.calendar)
+        self.assertTrue(result.resumed)
+        self.assertEqual(result.pages, 1)
+        self.assertEqual(service.requests[-1]['pageToken'], 'page2')
+        self.assertEqual(self.calendar.event_set.count(), 15)
+        self.assertEqual(self.calendar.events_sync_token, 'next-sync-token')
+
+    def test_months_are_recomputed_once_per_sync(self):
+        def counters():
+            return dict(((counter.month, counter.account_id), counter.meetings)
+                        for counter in CoAttendance.objects.filter(calendar=self.calendar))
+
+        with mock.patch('apps.calendar.rollups.aggregate_months', wraps=aggregate_months) as aggregate:
+            sync_calendar_events(FakeEventsService(self.pages), self.calendar)
+        self.assertEqual(aggregate.call_count, 1)
+        self.assertEqual(counters(), aggregate_months(self.calendar))
+        # a bump per page and one for counters written at the end
+        self.assertEqual(Calendar.objects.get(pk=self.calendar.pk).data_version, 4)
+
+        # pages committed before a failure are counted too
+        CoAttendance.objects.all().delete()
+        Event.objects.all().delete()
+        self.calendar.events_sync_token = ''
+        with self.assertRaises(RuntimeError):
+            sync_calendar_events(FakeEventsService(self.pages, fail_on=2), self.calendar)
+        self.assertEqual(sum(counters().values()), 10 * 3)
+
+
+class TestResync(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='expired-sync-token')
+        self.records = [make_timed_record('upcoming', 10), make_timed_record('recent', -5),
+                        make_timed_record('recent2', -6),
+                        # spans boundary of the first two past windows
+                        make_timed_record('spanning', -31, hours=72),
+                        make_timed_record('older', -100), make_timed_record('ancient', -500)]
+        # deleted in Google while SyncToken was expired
+        other_calendar = Calendar.objects.create(user=User.objects.create(username='other'),
+                                                 cal_id='other', title='other', timezone='Asia/Kolkata')
+        get_or_create_events(self.calendar, [make_timed_record('deleted', -45),
+                                             make_timed_record('deleted-ancient', -600)])
+        get_or_create_events(self.calendar, [make_timed_record('shared-deleted', -7)])
+        get_or_create_events(other_calendar, [make_timed_record('shared-deleted', -7)])
+
+    def test_expired_sync_token_resyncs_in_windows_newest_first(self):
+        service = FakeWindowedService(self.records)
+        with mock.patch('apps.calendar.sync.ingest_page', wraps=ingest_page) as ingest:
+            sync_calendar_events(service, self.calendar)
+
+        requests = service.requests
+        self.assertEqual(requests[0]['syncToken'], 'expired-sync-token')
+        self.assertEqual(requests[1]['fields'], 'nextPageToken,nextSyncToken')
+        # upcoming events first, then back in time
+        self.assertIsNone(requests[2]['timeMax'])
+        self.assertEqual(requests[3]['timeMax'], requests[2]['timeMin'])
+        self.assertIsNone(requests[-1]['timeMin'])
+
+        self.assertEqual(set(self.calendar.event_set.values_list('id', flat=True)),
+                         set(record['id'] for record in self.records))
+        self.assertFalse(Event.objects.filter(id__in=['deleted', 'deleted-ancient']).exists())
+        # still linked to Calendar of other User
+        self.assertEqual(Event.objects.get(id='shared-deleted').calendar.count(), 1)
+        # spanning event is returned by two windows but written once
+        self.assertEqual(sum(len(call[0][1]) for call in ingest.call_args_list), len(self.records))
+
+        self.calendar.refresh_from_db()
+        self.assertEqual(self.calendar.events_sync_token, 'fresh-sync-token')
+        self.assertIsNone(self.calendar.resync_started_at)
+
+    def test_interrupted_resync_resumes_at_its_window(self):
+        service = FakeWindowedService(self.records, fail_on_request=6)
+        with self.assertRaises(RuntimeError):
+            sync_calendar_events(service, self.calendar)
+
+        self.calendar.refresh_from_db()
+        self.assertEqual(self.calendar.events_sync_token, 'fresh-sync-token')
+        self.assertEqual(self.calendar.resync_window, 2)
+        failed_request = service.requests[-1]
+
+        service = FakeWindowedService(self.records)
+        result = sync_calendar_events(service, self.calendar)
+        self.assertTrue(result.resumed)
+        self.assertEqual(service.requests[0]['timeMin'], failed_request['timeMin'])
+        self.assertEqual(self.calendar.event_set.count(), len(self.records))
+        self.assertIsNone(self.calendar.resync_started_at)
+
+    def test_resync_interrupted_mid_window_restarts_the_window(self):
+        records = self.records + [make_timed_record('recent3', -8)]
+        # second page of the first past window fails
+        service = FakeWindowedService(records, fail_on_request=5)
+        with self.assertRaises(RuntimeError):
+            sync_calendar_events(service, self.calendar)
+
+        self.calendar.refresh_from_db()
+        self.assertEqual((self.calendar.resync_window, self.calendar.events_page_token), (1, 'page1'))
+
+        service = FakeWindowedService(records)
+        sync_calendar_events(service, self.calendar)
+        self.assertIsNone(service.requests[0]['pageToken'])
+        self.assertEqual(set(self.calendar.event_set.values_list('id', flat=True)),
+                         set(record['id'] for record in records))
+
+
+class TestSyncUser(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        shared = make_event_records(4, prefix='shared')
+        self.service = FakeCalendarsService({
+            'admin@admin.com': [make_event_records(5, prefix='own'), shared],
+            'team@group.calendar.google.com': [shared],
+            'holidays@group.v.calendar.google.com': [make_event_records(2, prefix='holiday')],
+        })
+
+    def test_sync_user_syncs_every_calendar(self):
+        result = sync_user(self.user, threads=1, service_factory=lambda user: self.service)
+
+        self.assertEqual((result.pages, result.events), (4, 15))
+        self.assertEqual(Calendar.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(Calendar.get_primary(self.user).cal_id, 'admin@admin.com')
+        self.assertEqual(Event.objects.count(), 11)
+        team = Calendar.objects.get(cal_id='team@group.calendar.google.com')
+        self.assertEqual(team.event_set.count(), 4)
+        self.assertEqual(team.events_sync_token, 'next-sync-token')
+
+    @mock.patch('apps.calendar.sync.sync_calendar_events')
+    def test_sync_user_fetches_calendars_concurrently(self, sync_calendar_events):
+        def slow_sync(service, calendar, **kwargs):
+            time.sleep(0.3)
+            return SyncResult()
+        sync_calendar_events.side_effect = slow_sync
+
+        started = time.time()
+        sync_user(self.user, threads=3, service_factory=lambda user: self.service)
+        self.assertLess(time.time() - started, 0.6)
+        self.assertEqual(sync_calendar_events.call_count, 3)
+
+
+class TestSyncJobs(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.other_user = User.objects.create(username='other', email='other@admin.com')
+
+    def test_enqueue_keeps_one_pending_job_per_user(self):
+        job = enqueue_sync(self.user)
+        self.assertEqual(enqueue_sync(self.user), job)
+        self.assertEqual(SyncJob.objects.count(), 1)
+
+    def test_sync_views_require_login(self):
+        self.assertEqual(self.client.get('/fetch-events/').status_code, 403)
+        self.assertEqual(self.client.get('/sync-status/').status_code, 403)
+        self.assertFalse(SyncJob.objects.exists())
+
+        self.client.force_login(self.user)
+        response = self.client.get('/fetch-events/')
+        self.assertEqual((response.status_code, response['Location']), (302, '/analytics/'))
+        self.assertEqual(self.client.get('/sync-status/').data['status'], PENDING)
+
+    def test_claim_skips_users_with_running_job(self):
+        enqueue_sync(self.user)
+        first = claim_next_job('worker-1')
+        self.assertEqual((first.status, first.worker, first.attempts), (RUNNING, 'worker-1', 1))
+
+        enqueue_sync(self.user)
+        enqueue_sync(self.other_user)
+        second = claim_next_job('worker-2')
+        self.assertEqual(second.user, self.other_user)
+        self.assertIsNone(claim_next_job('worker-3'))
+
+    def test_claim_user_job_takes_over_pending_job(self):
+        pending = enqueue_sync(self.user)
+        job = claim_user_job(self.user, 'sweep-1')
+        self.assertEqual((job.pk, job.status, job.worker, job.attempts), (pending.pk, RUNNING, 'sweep-1', 1))
+        self.assertIsNone(claim_user_job(self.user, 'sweep-2'))
+        self.assertIsNone(claim_next_job('worker-1'))
+
+        job = claim_user_job(self.other_user, 'sweep-1')
+        self.assertEqual((job.status, job.attempts), (RUNNING, 1))
+        self.assertEqual(SyncJob.objects.count(), 2)
+
+    def test_run_job_records_progress(self):
+        enqueue_sync(self.user)
+        job = claim_next_job('worker-1')
+
+        def sync(user, on_page):
+            result = SyncResult()
+            result.pages, result.events = 2, 400
+            on_page(result)
+            return result
+
+        job = run_job(job, sync=sync)
+        self.assertEqual((job.status, job.pages_synced, job.events_synced), (SUCCEEDED, 2, 400))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        SyncJob.objects.create(user=self.user, max_attempts=2)
+        sync = mock.Mock(side_effect=ValueError('quota exceeded'))
+
+        job = run_job(claim_next_job('worker-1'), sync=sync)
+        self.assertEqual(job.status, PENDING)
+        self.assertIn('quota exceeded', job.last_error)
+        # not runnable before backoff is over
+        self.assertIsNone(claim_next_job('worker-1'))
+
+        SyncJob.objects.update(run_after=job.created_at)
+        job = run_job(claim_next_job('worker-1'), sync=sync)
+        self.assertEqual((job.status, job.attempts), (FAILED, 2))
+
+    def test_only_jobs_without_heartbeat_are_requeued(self):
+        enqueue_sync(self.user)
+        job = claim_next_job('worker-1')
+        later = job.started_at + STALE_JOB_TIMEOUT + timedelta(minutes=5)
+
+        def long_sync(user, on_page):
+            # sync running longer than the timeout still beats on every page
+            with mock.patch('apps.calendar.jobs.timezone.now', return_value=later):
+                on_page(SyncResult())
+            self.assertEqual(requeue_stale_jobs(now=later + timedelta(minutes=1)), 0)
+            self.assertIsNone(claim_next_job('worker-2'))
+            return SyncResult()
+
+        self.assertEqual(run_job(job, sync=long_sync).status, SUCCEEDED)
+
+        enqueue_sync(self.user)
+        job = claim_next_job('worker-1')
+        self.assertEqual(requeue_stale_jobs(now=job.heartbeat_at + STALE_JOB_TIMEOUT + timedelta(seconds=1)), 1)
+        self.assertEqual(SyncJob.objects.get(pk=job.pk).status, PENDING)
+
+
+class TestReplayEvents(TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.ndjson')
+        with os.fdopen(handle, 'w') as dump:
+            for record in make_event_records(5):
+                dump.write(json.dumps(record) + '\n')
+            # captured events().list response
+            dump.write(json.dumps({'items': make_event_records(3, prefix='page')}) + '\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_replay_for_many_users(self):
+        out = six.StringIO()
+        call_command('replay_events', self.path, users=2, distinct=True, page_size=4, stdout=out)
+
+        self.assertEqual(Calendar.objects.filter(user__username__startswith='replay-').count(), 2)
+        self.assertEqual(Event.objects.count(), 16)
+        self.assertEqual(Event.objects.filter(calendar__cal_id='replay-1@replay.local').count(), 8)
+        self.assertIn('Replayed 16 events for 2 users', out.getvalue())
+        self.assertIn('events/s', out.getvalue())
+        self.assertIn('Peak RSS', out.getvalue())
+
+    def test_repeated_replay_leaves_events_unchanged(self):
+        out = six.StringIO()
+        call_command('replay_events', self.path, repeat=2, stdout=out)
+        self.assertEqual(Event.objects.count(), 8)
+        self.assertIn('created 8', out.getvalue())
+        self.assertIn('unchanged 8', out.getvalue())
+
+
+class TestAccountResolver(TestCase):
+
+    def test_resolve_loads_batch_once(self):
+        user = User.objects.create(username='admin', email='admin@admin.com')
+        Account.objects.create(email='user1@admin.com')
+        resolver = AccountResolver()
+
+        # select accounts, select users, savepoint, insert, release, select created accounts
+        with self.assertNumQueries(6):
+            accounts = resolver.resolve(['admin@admin.com', 'user1@admin.com', 'user2@admin.com'])
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.get('admin@admin.com'), accounts['admin@admin.com'])
+
+        self.assertEqual(accounts['admin@admin.com'].user, user)
+        self.assertEqual(Account.objects.count(), 3)
+        self.assertEqual(resolver.stats(), {'hits': 1, 'misses': 3, 'size': 3, 'hit_ratio': 0.25})
+
+    def test_resolver_shared_by_pages(self):
+        calendar = Calendar.objects.create(user=User.objects.create(username='admin'),
+                                           cal_id='admin@admin.com', title='admin',
+                                           timezone='Asia/Kolkata')
+        resolver = AccountResolver()
+        get_or_create_events(calendar, make_event_records(10, prefix='one'), resolver=resolver)
+        get_or_create_events(calendar, make_event_records(10, prefix='two'), resolver=resolver)
+
+        self.assertEqual(resolver.misses, len(resolver))
+        self.assertEqual(resolver.hits, len(resolver))
+
+    def test_retried_page_does_not_reuse_rolled_back_accounts(self):
+        calendar = Calendar.objects.create(user=User.objects.create(username='admin'),
+                                           cal_id='admin@admin.com', title='admin',
+                                           timezone='Asia/Kolkata')
+        resolver = AccountResolver()
+        link_calendar = EventIngestor._link_calendar
+        attempts = []
+
+        def conflicting_link(ingestor, events):
+            # first attempt fails after its Accounts are created, as an Event inserted concurrently would
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise IntegrityError('duplicate key')
+            return link_calendar(ingestor, events)
+
+        with mock.patch.object(EventIngestor, '_link_calendar', conflicting_link):
+            ingest_page(EventIngestor(calendar, resolver=resolver), make_event_records(5))
+
+        self.assertEqual(len(attempts), 2)
+        accounts = set(Account.objects.values_list('pk', flat=True))
+        # 5 organisers and 7 attendees
+        self.assertEqual(Account.objects.count(), 12)
+        self.assertTrue(set(Attendee.objects.values_list('account_id', flat=True)) <= accounts)
+        self.assertTrue(set(Event.objects.values_list('organiser_id', flat=True)) <= accounts)
+
+
 class TestCalendarAnalytics(TestCase):
     DATA = {'end_time': {0: Timestamp('2019-03-15 13:00:00+0530', tz='Asia/Kolkata'),
                          1: Timestamp('2019-06-21 14:30:00+0530', tz='Asia/Kolkata'),
@@ -206,56 +1159,956 @@ class TestCalendarAnalytics(TestCase):
                                                 timezone='Asia/Kolkata',
                                                 events_sync_token="events_sync_token")
 
-    @mock.patch.object(CalendarAnalytics, "_events_df")
+    def events_frame(self):
+        rows = [(self.DATA['title'][index],
+                 self.DATA['start_time'][index].to_pydatetime(),
+                 self.DATA['end_time'][index].to_pydatetime())
+                for index in sorted(self.DATA['id'])]
+        return build_events_frame(rows)
+
+    @mock.patch.object(CalendarAnalytics, "_events_df", new_callable=mock.PropertyMock)
     def test__search_meetings(self, _events_df):
-        _events_df.return_value = pd.DataFrame(self.DATA)
+        _events_df.return_value = self.events_frame()
         ca = CalendarAnalytics(self.user)
         actual_output = ca._search_meetings(['Standup']).to_dict()
 
-        expected_output = {'end_time': {4: Timestamp('2019-01-11 10:00:00+0530', tz='Asia/Kolkata')},
-                           'id': {4: 'sda3cdcasdvasdvasdvas'},
-                           'start_time': {4: Timestamp('2019-01-11 10:00:00+0530', tz='Asia/Kolkata')},
+        # 2019-01-11 10:00 to 11:00 in Asia/Kolkata as seconds since epoch
+        expected_output = {'end': {4: 1547184600},
+                           'start': {4: 1547181000},
                            'time_spent': {4: 3600},
                            'title': {4: 'Standup catchcup'}}
 
         self.assertDictEqual(actual_output, expected_output)
 
-    @mock.patch.object(CalendarAnalytics, "_events_df")
+    @mock.patch.object(CalendarAnalytics, "_events_df", new_callable=mock.PropertyMock)
     def test_time_spent_on(self, _events_df):
-        _events_df.return_value = pd.DataFrame(self.DATA)
+        _events_df.return_value = self.events_frame()
         ca = CalendarAnalytics(self.user)
-        actual_output = ca.time_spent_on(['Standup']).to_dict()
+        actual_output = ca.time_spent_on(['Standup'])
         expected_output = 3600
         self.assertEqual(actual_output, expected_output)
 
-    @mock.patch.object(CalendarAnalytics, "_events_df")
+    @mock.patch.object(CalendarAnalytics, "_events_df", new_callable=mock.PropertyMock)
     def test_total_time_spent_by_month(self, _events_df):
-        _events_df.return_value = pd.DataFrame(self.DATA)
+        _events_df.return_value = self.events_frame()
         ca = CalendarAnalytics(self.user)
         actual_output = ca.total_time_spent_by_month()
         expected_output = {'February': 3600, 'January': 3600, 'June': 6300, 'March': 3600}
         self.assertEqual(actual_output, expected_output)
 
-    @mock.patch.object(CalendarAnalytics, "_events_df")
+    @mock.patch.object(CalendarAnalytics, "_events_df", new_callable=mock.PropertyMock)
     def test_total_time_spent_by_week(self, _events_df):
-        _events_df.return_value = pd.DataFrame(self.DATA)
+        _events_df.return_value = self.events_frame()
         ca = CalendarAnalytics(self.user)
         actual_output = ca.total_time_spent_by_week()
         expected_output =  {'01': 3600, '08': 3600, '10': 3600, '23': 4500, '24': 1800}
         self.assertEqual(actual_output, expected_output)
 
-    @mock.patch.object(CalendarAnalytics, "_events_df")
+    @mock.patch.object(CalendarAnalytics, "_events_df", new_callable=mock.PropertyMock)
     def test_avg_time_spent_by_week(self, _events_df):
-        _events_df.return_value = pd.DataFrame(self.DATA)
+        _events_df.return_value = self.events_frame()
         ca = CalendarAnalytics(self.user)
         actual_output = ca.avg_time_spent_by_week()
         expected_output = {'01': 3600, '08': 3600, '10': 3600, '23': 4500, '24': 1800}
         self.assertEqual(actual_output, expected_output)
 
-    @mock.patch.object(CalendarAnalytics, "_events_df")
+    @mock.patch.object(CalendarAnalytics, "_events_df", new_callable=mock.PropertyMock)
     def test_avg_meetings_by_week(self, _events_df):
-        _events_df.return_value = pd.DataFrame(self.DATA)
+        _events_df.return_value = self.events_frame()
         ca = CalendarAnalytics(self.user)
         actual_output = ca.avg_meetings_by_week()
         expected_output = {'01': 1, '08': 1, '10': 1, '23': 1, '24': 1}
         self.assertEqual(actual_output, expected_output)
+
+
+class TestEventsFrame(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        Calendar.objects.create(user=self.user, cal_id=self.user.email, title=self.user.email,
+                                timezone='Europe/London', events_sync_token='')
+
+    def test_frame_is_compact(self):
+        rows = [('Standup', parser.parse('2019-01-11T10:00:00+05:30'), parser.parse('2019-01-11T10:30:00+05:30'))] * 3
+        df = build_events_frame(rows)
+        self.assertEqual(list(df.columns), ['title', 'start', 'end', 'time_spent'])
+        self.assertEqual(str(df['title'].dtype), 'category')
+        self.assertEqual([str(df[column].dtype) for column in ('start', 'end', 'time_spent')], ['int64'] * 3)
+        self.assertEqual(list(df['time_spent']), [1800] * 3)
+        self.assertEqual(len(build_events_frame([])), 0)
+
+    def test_bucket_keys_match_strftime(self):
+        ca = CalendarAnalytics(self.user)
+        starts = [parser.parse('2019-01-01T00:30:00Z') + timedelta(hours=17 * index) for index in range(1000)]
+        df = build_events_frame([('Meeting', start, start + timedelta(hours=1)) for start in starts])
+        local = [start.astimezone(ca.timezone) for start in starts]
+        self.assertEqual(list(ca._bucket_keys(df, '%W')), [dt.strftime('%W') for dt in local])
+        self.assertEqual(list(ca._bucket_keys(df, '%B')), [dt.strftime('%B') for dt in local])
+
+
+def make_analytics_records():
+    """
+    Google Event dicts of TestCalendarAnalytics.DATA
+    """
+    data = TestCalendarAnalytics.DATA
+    records = []
+    for index in sorted(data['id']):
+        record = make_event_records(1)[0]
+        record.update({'id': data['id'][index], 'summary': data['title'][index],
+                       'start': {'dateTime': data['start_time'][index].isoformat()},
+                       'end': {'dateTime': data['end_time'][index].isoformat()}})
+        records.append(record)
+    return records
+
+
+class TestSQLCalendarAnalytics(TestCase):
+    FROM_TIME = parser.parse('2018-12-01T00:00:00+05:30')
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='events_sync_token')
+        get_or_create_events(self.calendar, make_analytics_records())
+
+    def analytics(self, backend):
+        return backend(self.user, from_time=self.FROM_TIME)
+
+    def test_matches_pandas_output(self):
+        sql, pandas = self.analytics(SQLCalendarAnalytics), self.analytics(CalendarAnalytics)
+        self.assertEqual(sql.total_time_spent_by_month(),
+                         {'February': 3600, 'January': 3600, 'June': 6300, 'March': 3600})
+        self.assertEqual(sql.total_time_spent_by_week(),
+                         {'01': 3600, '08': 3600, '10': 3600, '23': 4500, '24': 1800})
+        self.assertEqual(sql.avg_time_spent_by_week(),
+                         {'01': 3600, '08': 3600, '10': 3600, '23': 4500, '24': 1800})
+        self.assertEqual(sql.avg_meetings_by_week(), {'01': 1, '08': 1, '10': 1, '23': 1, '24': 1})
+        self.assertEqual(sql.time_spent_on(['Interview', 'CV']), 8100)
+
+        from_time = parser.parse('2019-02-01T00:00:00+05:30')
+        to_time = parser.parse('2019-06-15T00:00:00+05:30')
+        for method in ('total_time_spent_by_month', 'total_time_spent_by_week',
+                       'avg_time_spent_by_week', 'avg_meetings_by_week'):
+            self.assertEqual(getattr(sql, method)(from_time, to_time),
+                             getattr(pandas, method)(from_time, to_time), method)
+        self.assertEqual(sql.time_spent_on(['Review']), pandas.time_spent_on(['Review']))
+
+    def test_buckets_use_calendar_timezone(self):
+        # 1st April in Asia/Kolkata, still March in UTC
+        record = make_event_records(1, prefix='midnight')[0]
+        record.update({'start': {'dateTime': '2019-03-31T20:00:00Z'},
+                       'end': {'dateTime': '2019-03-31T21:00:00Z'}})
+        get_or_create_events(self.calendar, [record])
+
+        sql, pandas = self.analytics(SQLCalendarAnalytics), self.analytics(CalendarAnalytics)
+        self.assertEqual(sql.total_time_spent_by_month()['April'], 3600)
+        self.assertEqual(sql.total_time_spent_by_month(), pandas.total_time_spent_by_month())
+        self.assertEqual(sql.total_time_spent_by_week(), pandas.total_time_spent_by_week())
+
+    def composed_report(self, ca, from_time, recent_from):
+        """
+        Payload as AnalyticsAPIView composed it from separate queries
+        """
+        months = ca.total_time_spent_by_month(from_time=from_time)
+        weeks = ca.total_time_spent_by_week(from_time=from_time)
+        return {
+            "month": {"busy": max(months, key=months.get), "relax": min(months, key=months.get),
+                      "last_3_months": ca.total_time_spent_by_month(from_time=recent_from)},
+            "week": {"busy": max(weeks, key=weeks.get), "relax": min(weeks, key=weeks.get),
+                     "avg_time": ca.avg_time_spent_by_week(from_time=from_time),
+                     "meetings_cnt": ca.avg_meetings_by_week(from_time=from_time)},
+            'top_attendee': ca.max_meetings_with()[:3],
+            "time_spent": dict((topic.name, ca.time_spent_on(topic.get_terms())) for topic in Topic.objects.all()),
+        }
+
+    def test_report_matches_composed_payload(self):
+        call_command('rebuild_rollups', stdout=six.StringIO())
+        recent_from = parser.parse('2019-03-01T00:00:00+05:30')
+        for backend in (CalendarAnalytics, SQLCalendarAnalytics, RollupCalendarAnalytics):
+            ca = self.analytics(backend)
+            report = ca.report(from_time=self.FROM_TIME, recent_from=recent_from)
+            self.assertEqual(report, self.composed_report(ca, self.FROM_TIME, recent_from), backend)
+            self.assertEqual(report['month']['last_3_months'], {'June': 6300, 'March': 3600})
+            self.assertEqual(report['time_spent']['recruit'], 4500)
+
+    def test_report_counts_overlapping_meetings_once(self):
+        records = make_analytics_records()
+        interview = [record for record in records if record['start']['dateTime'].startswith('2019-06-12')][0]
+        start = parse_datetime(interview['start']['dateTime']) + timedelta(minutes=15)
+        overlapping = make_event_records(1, prefix='overlap')[0]
+        overlapping.update({'start': {'dateTime': start.isoformat()},
+                            'end': {'dateTime': (start + timedelta(minutes=30)).isoformat()}})
+        get_or_create_events(self.calendar, [overlapping])
+
+        recent_from = parser.parse('2019-03-01T00:00:00+05:30')
+        week = start.strftime('%W')
+        for backend in (CalendarAnalytics, SQLCalendarAnalytics, RollupCalendarAnalytics):
+            ca = self.analytics(backend)
+            report = ca.report(from_time=self.FROM_TIME, recent_from=recent_from)
+            self.assertEqual(report['month']['last_3_months'], {'June': 6300, 'March': 3600}, backend)
+            self.assertEqual(ca.total_time_spent_by_month(from_time=recent_from)['June'], 6300 + 1800, backend)
+            self.assertEqual(report['week']['avg_time'][week], (4500 + 1800) / 2.0, backend)
+
+    def test_report_buckets_query_count(self):
+        ca = self.analytics(SQLCalendarAnalytics)
+        # day sums and start and end of events for busy time
+        with self.assertNumQueries(2):
+            ca._report_buckets(self.FROM_TIME, parser.parse('2019-03-01T00:00:00+05:30'))
+        # Topics and the sums of their tags
+        with self.assertNumQueries(2):
+            ca.time_spent_by_topic()
+
+    @override_settings(CALENDAR_ANALYTICS_BACKEND='pandas')
+    def test_backend_is_chosen_by_setting(self):
+        self.assertIs(type(get_calendar_analytics(self.user)), CalendarAnalytics)
+        with override_settings(CALENDAR_ANALYTICS_BACKEND='sql'):
+            self.assertIs(type(get_calendar_analytics(self.user)), SQLCalendarAnalytics)
+
+
+class TestSnapshotCalendarAnalytics(TestCase):
+    FROM_TIME = parser.parse('2018-12-01T00:00:00+05:30')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        snapshot_dir = override_settings(CALENDAR_SNAPSHOT_DIR=directory)
+        snapshot_dir.enable()
+        self.addCleanup(snapshot_dir.disable)
+
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='events_sync_token')
+        self.records = make_analytics_records()
+        for index, record in enumerate(self.records):
+            record['attendees'] = [{'email': 'user%s@admin.com' % ((index + offset) % 4),
+                                    'responseStatus': 'accepted'} for offset in range(index % 3 + 1)]
+        self.records[0]['attendees'].append({'email': self.user.email, 'responseStatus': 'accepted'})
+        get_or_create_events(self.calendar, self.records)
+        self.calendar.refresh_from_db()
+
+    def analytics(self, backend):
+        return backend(self.user, from_time=self.FROM_TIME)
+
+    def assertSnapshotEqual(self, first, second):
+        self.assertEqual(first.data_version, second.data_version)
+        self.assertEqual(first.titles, second.titles)
+        for name in SNAPSHOT_COLUMNS:
+            first_column, second_column = first.columns[name], second.columns[name]
+            if isinstance(first_column, tuple):
+                self.assertEqual([list(array) for array in first_column],
+                                 [list(array) for array in second_column], name)
+            else:
+                self.assertEqual(list(first_column), list(second_column), name)
+
+    def test_matches_database_backends(self):
+        snapshot, sql, pandas = (self.analytics(SnapshotCalendarAnalytics), self.analytics(SQLCalendarAnalytics),
+                                 self.analytics(CalendarAnalytics))
+        recent_from = parser.parse('2019-03-01T00:00:00+05:30')
+        self.assertEqual(snapshot.report(self.FROM_TIME, recent_from), sql.report(self.FROM_TIME, recent_from))
+        self.assertEqual(snapshot.series('week'), pandas.series('week'))
+        self.assertEqual(snapshot.time_spent_on(['Interview', 'CV']), 8100)
+        self.assertNotIn(self.user.email, [attendee['email'] for attendee in snapshot.max_meetings_with()])
+
+        from_time = parser.parse('2019-02-01T00:00:00+05:30')
+        to_time = parser.parse('2019-06-15T00:00:00+05:30')
+        self.assertEqual(snapshot.max_meetings_with(limit=2, from_time=from_time, to_time=to_time),
+                         sql.max_meetings_with(limit=2, from_time=from_time, to_time=to_time))
+        ranged = SnapshotCalendarAnalytics(self.user, from_time=from_time, to_time=to_time)
+        self.assertEqual(ranged.series('month'),
+                         SQLCalendarAnalytics(self.user, from_time=from_time, to_time=to_time).series('month'))
+
+    def test_loads_without_querying_events(self):
+        ca = self.analytics(SnapshotCalendarAnalytics)
+        self.assertIsNone(read_meta(self.calendar.pk))
+        # first load builds the snapshot
+        self.assertEqual(len(ca._events_df), len(self.records))
+        self.assertEqual(read_meta(self.calendar.pk)['data_version'], self.calendar.data_version)
+
+        ca = self.analytics(SnapshotCalendarAnalytics)
+        with self.assertNumQueries(0):
+            df = ca._events_df
+        # snapshot rows are sorted by start
+        expected = self.analytics(CalendarAnalytics)._events_df.sort_values('start')
+        self.assertEqual(list(df['time_spent']), list(expected['time_spent']))
+        self.assertEqual(list(df['title']), list(expected['title']))
+        self.assertEqual(list(read_snapshot(self.calendar.pk, ('start',)).columns), ['start'])
+
+    def test_ingestion_patches_snapshot(self):
+        load_snapshot(self.calendar)
+        moved = dict(self.records[1], updated='2019-07-01T00:00:00.000Z', summary='Moved standup',
+                     start={'dateTime': '2019-06-20T10:00:00+05:30'}, end={'dateTime': '2019-06-20T10:45:00+05:30'},
+                     attendees=[{'email': 'new@admin.com', 'responseStatus': 'accepted'}])
+        added = dict(make_event_records(1, prefix='added')[0], start={'dateTime': '2019-01-02T09:00:00+05:30'},
+                     end={'dateTime': '2019-01-02T09:30:00+05:30'})
+        with mock.patch('apps.calendar.snapshots.transaction.on_commit') as on_commit:
+            get_or_create_events(self.calendar, [moved, added, dict(self.records[2], status='cancelled')])
+        # files are written once the page is committed
+        self.assertEqual(read_meta(self.calendar.pk)['data_version'], self.calendar.data_version)
+        for call in on_commit.call_args_list:
+            call[0][0]()
+
+        self.calendar.refresh_from_db()
+        stored = read_snapshot(self.calendar.pk)
+        self.assertEqual(stored.data_version, self.calendar.data_version)
+        self.assertSnapshotEqual(stored, build_snapshot(self.calendar))
+        self.assertIn('Moved standup', stored.titles)
+
+    def test_stale_snapshot_is_rebuilt(self):
+        load_snapshot(self.calendar)
+        Calendar.bump_data_version([self.calendar.pk])
+        Event.objects.filter(pk=self.records[0]['id']).update(title='Renamed')
+        self.calendar.refresh_from_db()
+
+        snapshot = load_snapshot(self.calendar)
+        self.assertIn('Renamed', snapshot.titles)
+        self.assertSnapshotEqual(read_snapshot(self.calendar.pk), build_snapshot(self.calendar))
+
+    def test_write_keeps_files_of_concurrent_writes(self):
+        snapshot = load_snapshot(self.calendar)
+        directory = get_snapshot_dir(self.calendar.pk)
+        replaced = read_meta(self.calendar.pk)['token']
+        in_flight = ['start.inflight.npy', 'meta.json.inflight']
+        orphan = 'start.orphan.npy'
+        for name in in_flight + [orphan]:
+            open(os.path.join(directory, name), 'w').close()
+        old = time.time() - ORPHAN_AGE - 1
+        os.utime(os.path.join(directory, orphan), (old, old))
+
+        write_snapshot(self.calendar.pk, snapshot)
+
+        names = os.listdir(directory)
+        self.assertFalse([name for name in names if replaced in name])
+        self.assertNotIn(orphan, names)
+        for name in in_flight:
+            self.assertIn(name, names)
+        self.assertSnapshotEqual(read_snapshot(self.calendar.pk), snapshot)
+
+
+class FixedDatetime(datetime):
+    """
+    datetime whose now() is within a year of TestCalendarAnalytics.DATA
+    """
+
+    @classmethod
+    def now(cls, tz=None):
+        return parser.parse('2019-07-01T12:00:00+05:30').astimezone(tz)
+
+
+class TestAnalyticsCache(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='events_sync_token')
+        self.records = make_analytics_records()
+        get_or_create_events(self.calendar, self.records)
+
+    def test_locmem_evicts_least_recently_used(self):
+        cache = LocMemAnalyticsCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual([cache.get(key) for key in 'abc'], [1, None, 3])
+
+    def test_file_cache_is_bounded(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = FileAnalyticsCache(max_entries=2, location=directory)
+        for index, key in enumerate('abc'):
+            cache.set(key, {'value': index})
+            # mtime resolution of some filesystems is a second
+            os.utime(cache._path(key), (index, index))
+        cache._cull()
+        self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), {'value': 2})
+
+    def test_ingestion_invalidates_cached_report(self):
+        cache = LocMemAnalyticsCache()
+        self.client.force_login(self.user)
+        with mock.patch('apps.calendar.api.get_analytics_cache', return_value=cache), \
+                mock.patch('apps.calendar.api.datetime', FixedDatetime):
+            first = self.client.get('/analytics/')
+            second = self.client.get('/analytics/')
+            get_or_create_events(self.calendar, [dict(self.records[0], updated='2019-07-01T00:00:00.000Z',
+                                                      summary='Interview')])
+            third = self.client.get('/analytics/')
+
+        self.assertEqual([response['X-Analytics-Cache'] for response in (first, second, third)],
+                         ['miss', 'hit', 'miss'])
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3.0})
+
+    def test_topic_changes_invalidate_cached_report(self):
+        versions = [Calendar.objects.get(pk=self.calendar.pk).data_version]
+        topic = Topic.objects.create(name='lunch', terms='["Lunch"]')
+        versions.append(Calendar.objects.get(pk=self.calendar.pk).data_version)
+        topic.delete()
+        versions.append(Calendar.objects.get(pk=self.calendar.pk).data_version)
+        self.assertEqual(versions, [versions[0], versions[0] + 1, versions[0] + 2])
+
+    def test_misses_log_stats(self):
+        cache = LocMemAnalyticsCache()
+        with mock.patch('apps.calendar.cache.logger') as logger:
+            cache.get_or_compute('a', lambda: 1)
+            cache.get_or_compute('a', lambda: 1)
+        logger.info.assert_called_once_with("Analytics cache miss %s, stats %s", 'a',
+                                            {'hits': 0, 'misses': 1, 'hit_rate': 0.0})
+
+    def test_rebuild_rollups_invalidates_cached_report(self):
+        version = Calendar.objects.get(pk=self.calendar.pk).data_version
+        call_command('rebuild_rollups', stdout=six.StringIO())
+        self.assertGreater(Calendar.objects.get(pk=self.calendar.pk).data_version, version)
+
+
+class TestCoAttendance(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='events_sync_token')
+        self.records = make_event_records(40, attendees=4)
+        for index, record in enumerate(self.records):
+            month = index % 4 + 1
+            record['start'] = {'dateTime': '2019-%02d-%02dT10:00:00+05:30' % (month, index % 7 + 1)}
+            record['end'] = {'dateTime': '2019-%02d-%02dT11:00:00+05:30' % (month, index % 7 + 1)}
+            if index % 3 == 0:
+                record['attendees'].append({'email': self.user.email, 'responseStatus': 'accepted'})
+        get_or_create_events(self.calendar, self.records)
+
+    def counters(self):
+        return dict(((counter.month.isoformat(), counter.account.email), counter.meetings)
+                    for counter in CoAttendance.objects.filter(calendar=self.calendar).select_related('account'))
+
+    def analytics(self, backend):
+        return backend(self.user, from_time=parser.parse('2018-12-01T00:00:00+05:30'))
+
+    def test_top_attendees_match_attendee_aggregation(self):
+        rollup, sql = self.analytics(RollupCalendarAnalytics), self.analytics(SQLCalendarAnalytics)
+        self.assertEqual(rollup.max_meetings_with(), sql.max_meetings_with())
+        self.assertNotIn(self.user.email, [attendee['email'] for attendee in rollup.max_meetings_with()])
+
+        from_time = parser.parse('2019-02-01T00:00:00+05:30')
+        to_time = parser.parse('2019-03-31T23:00:00+05:30')
+        self.assertEqual(rollup.max_meetings_with(limit=3, from_time=from_time, to_time=to_time),
+                         sql.max_meetings_with(limit=3, from_time=from_time, to_time=to_time))
+        self.assertEqual(len(rollup.max_meetings_with(limit=3)), 3)
+
+        with self.assertNumQueries(1):
+            rollup.max_meetings_with(limit=3)
+
+    def test_attendee_changes_update_counters(self):
+        self.assertEqual(self.counters()[('2019-01-01', 'user0@admin.com')], 2)
+        record = dict(self.records[0], updated='2019-07-01T00:00:00.000Z',
+                      attendees=[{'email': 'new@admin.com', 'responseStatus': 'accepted'}])
+        get_or_create_events(self.calendar, [record, dict(self.records[4], status='cancelled')])
+
+        counters = self.counters()
+        self.assertEqual(counters[('2019-01-01', 'new@admin.com')], 1)
+        self.assertEqual(counters[('2019-01-01', 'user0@admin.com')], 1)
+        self.assertEqual(self.analytics(RollupCalendarAnalytics).max_meetings_with(),
+                         self.analytics(SQLCalendarAnalytics).max_meetings_with())
+
+    def test_rebuild_matches_incremental_counters(self):
+        expected = self.counters()
+        CoAttendance.objects.all().delete()
+        call_command('rebuild_rollups', stdout=six.StringIO())
+        self.assertEqual(self.counters(), expected)
+
+
+class TestTopics(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='events_sync_token')
+        self.records = make_analytics_records()
+        get_or_create_events(self.calendar, self.records)
+
+    def tags(self):
+        return set(EventTopic.objects.values_list('event__title', 'topic__name'))
+
+    def test_matcher_finds_overlapping_terms_ignoring_case(self):
+        matcher = TopicMatcher(OrderedDict([('he', ['he']), ('she', ['SHE']), ('hers', ['hers']),
+                                            ('cpp', ['c++']), ('none', [])]))
+        self.assertEqual(matcher.match('uSHErs'), ['he', 'she', 'hers'])
+        self.assertEqual(matcher.match('C++ sync'), ['cpp'])
+        self.assertEqual(matcher.match('c sync'), [])
+        self.assertEqual(matcher.match(None), [])
+
+    def test_ingest_tags_events(self):
+        self.assertEqual(self.tags(), {('Interview (Lead Mobile Developer)', 'recruit'),
+                                       ('Standup catchcup', 'standup')})
+
+        record = dict(self.records[0], updated='2019-07-01T00:00:00.000Z', summary='Zoom call with ops')
+        get_or_create_events(self.calendar, [record])
+        self.assertIn((u'Zoom call with ops', u'zoom'), self.tags())
+        self.assertEqual(EventTopic.objects.filter(event_id=record['id']).count(), 1)
+
+    def test_reclassify_applies_changed_topics(self):
+        Topic.objects.create(name='review', terms=json.dumps(['review']))
+        Topic.objects.filter(name='standup').delete()
+        call_command('reclassify_topics', stdout=six.StringIO())
+
+        self.assertEqual(set(name for _, name in self.tags()), {'recruit', 'review'})
+        ca = RollupCalendarAnalytics(self.user, from_time=parser.parse('2018-12-01T00:00:00+05:30'))
+        self.assertEqual(ca.time_spent_by_topic(),
+                         SQLCalendarAnalytics(self.user, from_time=ca.from_time).time_spent_by_topic())
+        self.assertEqual(set(ca.time_spent_by_topic()), {'recruit', 'zoom', 'operation', 'review'})
+        self.assertEqual(reclassify_events(chunk_size=2), (5, 3))
+
+
+class TestAnalyticsRange(TestCase):
+    BACKENDS = (CalendarAnalytics, SQLCalendarAnalytics, RollupCalendarAnalytics)
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='events_sync_token')
+        # 1st April in Asia/Kolkata, still March in UTC
+        record = make_event_records(1, prefix='midnight')[0]
+        record.update({'start': {'dateTime': '2019-03-31T20:00:00Z'},
+                       'end': {'dateTime': '2019-03-31T21:00:00Z'}})
+        get_or_create_events(self.calendar, make_analytics_records() + [record])
+
+    def series(self, backend, from_day, to_day, granularity, metrics=SERIES_METRICS):
+        ca = backend(self.user, from_time=datetime.combine(from_day, datetime.min.time()),
+                     to_time=datetime.combine(to_day, datetime.min.time()))
+        return ca.series(granularity, metrics)
+
+    def test_series_in_calendar_timezone(self):
+        from_day, to_day = parser.parse('2019-01-01').date(), parser.parse('2019-07-01').date()
+        expected = [('2019-01-01', 3600, 1), ('2019-02-01', 3600, 1), ('2019-03-01', 3600, 1),
+                    ('2019-04-01', 3600, 1), ('2019-05-01', 0, 0), ('2019-06-01', 6300, 2)]
+        for backend in self.BACKENDS:
+            series = self.series(backend, from_day, to_day, 'month')
+            self.assertEqual([(bucket['start'], bucket['time_spent'], bucket['meetings'])
+                              for bucket in series], expected, backend)
+            self.assertEqual(series[-1]['avg_time'], 3150.0)
+            for granularity in GRANULARITIES:
+                self.assertEqual(self.series(backend, from_day, to_day, granularity),
+                                 self.series(CalendarAnalytics, from_day, to_day, granularity),
+                                 (backend, granularity))
+
+        quarters = self.series(SQLCalendarAnalytics, from_day, to_day, 'quarter', ['meetings'])
+        self.assertEqual(quarters, [{'start': '2019-01-01', 'meetings': 3}, {'start': '2019-04-01', 'meetings': 3}])
+        weeks = self.series(RollupCalendarAnalytics, from_day, to_day, 'week')
+        self.assertEqual(weeks[0]['start'], '2018-12-31')
+        self.assertEqual(len(self.series(CalendarAnalytics, from_day, to_day, 'day')), 181)
+
+    def test_only_requested_range_is_loaded(self):
+        ca = SQLCalendarAnalytics(self.user, from_time=datetime(2019, 2, 1), to_time=datetime(2019, 4, 1))
+        self.assertEqual(ca.events.count(), 2)
+        self.assertEqual([bucket['meetings'] for bucket in ca.series('month')], [1, 1])
+
+    def test_range_endpoint(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/analytics/range/', {'from': '2019-03-01', 'to': '2019-04-08',
+                                                         'granularity': 'week', 'metrics': 'meetings'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['timezone'], 'Asia/Kolkata')
+        self.assertEqual(sum(bucket['meetings'] for bucket in response.data['buckets']), 2)
+        self.assertEqual(response.data['buckets'][-1], {'start': '2019-04-01', 'meetings': 1})
+
+        for params in ({'to': '2019-04-01'}, {'from': '2019-04-01', 'to': '2019-03-01'},
+                       {'from': '2019-02-30', 'to': '2019-04-01'},
+                       {'from': '2019-03-01', 'to': '2019-04-01', 'granularity': 'year'},
+                       {'from': '2019-03-01', 'to': '2019-04-01', 'metrics': 'time_spent,busy'},
+                       {'from': '2019-01-01', 'to': '9999-12-31'},
+                       {'from': '2019-01-01', 'to': '9999-12-31', 'granularity': 'quarter'},
+                       {'from': '9999-10-01', 'to': '9999-12-31', 'granularity': 'quarter'}):
+            self.assertEqual(self.client.get('/analytics/range/', params).status_code, 400, params)
+
+        response = self.client.get('/analytics/range/', {'from': '2016-04-06', 'to': '2019-01-01'})
+        self.assertEqual(len(response.data['buckets']), AnalyticsRangeAPIView.MAX_BUCKETS)
+        response = self.client.get('/analytics/range/', {'from': '9999-12-01', 'to': '9999-12-31',
+                                                         'metrics': 'busy_time'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['buckets']), 30)
+
+        self.client.logout()
+        params = {'from': '2019-03-01', 'to': '2019-04-08'}
+        self.assertEqual(self.client.get('/analytics/range/', params).status_code, 403)
+
+
+class TestBusyTime(TestCase):
+
+    def test_busy_time_by_bucket(self):
+        # nested, touching and overlapping meetings, the last one spans both buckets
+        starts = np.array([0, 10, 30, 40, 45, 90], dtype=np.int64)
+        ends = np.array([30, 20, 40, 50, 60, 120], dtype=np.int64)
+        busy, overlap, conflict = busy_time_by_bucket(starts, ends, [0, 100, 200])
+        self.assertEqual(busy.tolist(), [70, 20])
+        self.assertEqual(overlap.tolist(), [15, 0])
+        self.assertEqual(conflict.tolist(), [15, 0])
+
+        busy, overlap, conflict = busy_time_by_bucket(starts[:0], ends[:0], [0, 100])
+        self.assertEqual((busy.tolist(), overlap.tolist(), conflict.tolist()), ([0], [0], [0]))
+
+    def test_double_booked_meetings_are_counted_once(self):
+        user = User.objects.create(username='admin', email='admin@admin.com')
+        calendar = Calendar.objects.create(user=user, cal_id=user.email, title=user.email,
+                                           timezone='Asia/Kolkata', events_sync_token='events_sync_token')
+        records = make_event_records(3)
+        for record, (start, end) in zip(records, [('10:00', '11:00'), ('10:30', '11:30'), ('23:30', '00:30')]):
+            record['start'] = {'dateTime': '2019-06-24T%s:00+05:30' % start}
+            record['end'] = {'dateTime': '2019-06-2%sT%s:00+05:30' % (5 if end == '00:30' else 4, end)}
+        get_or_create_events(calendar, records)
+
+        for backend in (CalendarAnalytics, SQLCalendarAnalytics, RollupCalendarAnalytics):
+            ca = backend(user, from_time=datetime(2019, 6, 24), to_time=datetime(2019, 6, 26))
+            series = ca.series('day', ['time_spent', 'busy_time', 'overlap_time', 'conflict_time'])
+            self.assertEqual(series, [
+                {'start': '2019-06-24', 'time_spent': 3 * 3600,
+                 'busy_time': 5400 + 1800, 'overlap_time': 1800, 'conflict_time': 1800},
+                {'start': '2019-06-25', 'time_spent': 0,
+                 'busy_time': 1800, 'overlap_time': 0, 'conflict_time': 0},
+            ], backend)
+
+
+class TestAvailability(TestCase):
+    DAY = '2019-06-24T%s:00+05:30'
+
+    def make_calendar(self, email, cal_id=None):
+        user = User.objects.filter(email=email).first() or User.objects.create(username=email, email=email)
+        return Calendar.objects.create(user=user, cal_id=cal_id or email, title=email, timezone='Asia/Kolkata',
+                                       events_sync_token='events_sync_token', is_primary=cal_id is None)
+
+    def make_records(self, prefix, spans, attendees=()):
+        records = make_event_records(len(spans), prefix=prefix)
+        for record, (start, end) in zip(records, spans):
+            record.update({'start': {'dateTime': self.DAY % start}, 'end': {'dateTime': self.DAY % end},
+                           'attendees': [{'email': email, 'responseStatus': rsvp} for email, rsvp in attendees]})
+        return records
+
+    def test_common_free_slots(self):
+        get_or_create_events(self.make_calendar('a@a.com'), self.make_records('a', [('10:00', '11:00'),
+                                                                                     ('10:30', '12:00')]))
+        get_or_create_events(self.make_calendar('b@b.com'), self.make_records('b', [('13:00', '14:00')]))
+        # c@c.com has no Calendar, events attended and not declined make it busy
+        other = self.make_calendar('other@other.com')
+        get_or_create_events(other, self.make_records('c', [('15:00', '15:20')], [('c@c.com', 'accepted')]))
+        get_or_create_events(other, self.make_records('d', [('16:00', '17:00')], [('c@c.com', 'declined')]))
+
+        self.client.force_login(User.objects.get(email='a@a.com'))
+        response = self.client.get('/availability/', {
+            'emails': 'a@a.com,b@b.com,c@c.com,nobody@x.com', 'minutes': 30,
+            'from': self.DAY % '09:00', 'to': self.DAY % '18:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unknown'], ['nobody@x.com'])
+        # in UTC
+        self.assertEqual([(slot['start'][11:16], slot['end'][11:16], slot['minutes'])
+                          for slot in response.data['slots']],
+                         [('03:30', '04:30', 60), ('06:30', '07:30', 60), ('08:30', '09:30', 60),
+                          ('09:50', '12:30', 160)])
+
+        for params in ({'emails': 'a@a.com', 'from': self.DAY % '09:00'},
+                       {'emails': '', 'from': self.DAY % '09:00', 'to': self.DAY % '18:00'},
+                       {'emails': 'a@a.com', 'from': '2019-06-24T09:00:00', 'to': self.DAY % '18:00'},
+                       {'emails': 'a@a.com', 'from': self.DAY % '09:00', 'to': self.DAY % '18:00', 'minutes': 'x'}):
+            self.assertEqual(self.client.get('/availability/', params).status_code, 400, params)
+
+    def test_other_calendars_of_user_are_not_busy_time(self):
+        self.make_calendar('a@a.com')
+        team = self.make_calendar('a@a.com', cal_id='team@group.calendar.google.com')
+        get_or_create_events(team, self.make_records('team', [('10:00', '17:00')]))
+
+        index, unknown = load_busy_index(['a@a.com'], parse_datetime(self.DAY % '09:00'),
+                                         parse_datetime(self.DAY % '18:00'))
+        self.assertEqual((index, unknown), ({}, set()))
+
+    def test_requires_authentication(self):
+        params = {'emails': 'a@a.com', 'from': self.DAY % '09:00', 'to': self.DAY % '18:00'}
+        self.assertEqual(self.client.get('/availability/', params).status_code, 403)
+
+    def test_dense_calendars_of_large_group(self):
+        rnd = random.Random(7)
+        busy = {}
+        for number in range(60):
+            email = 'user%02d@team.com' % number
+            spans = []
+            for _ in range(12):
+                start = rnd.randint(9 * 60, 17 * 60)
+                spans.append((start, start + rnd.choice([15, 30, 60, 90])))
+            busy[email] = spans
+            get_or_create_events(self.make_calendar(email), self.make_records(
+                'u%02d' % number, [('%02d:%02d' % divmod(span_start, 60), '%02d:%02d' % divmod(span_end, 60))
+                                   for span_start, span_end in spans]))
+
+        window_start, window_end = parse_datetime(self.DAY % '08:00'), parse_datetime(self.DAY % '20:00')
+        with self.assertNumQueries(4):
+            slots, unknown = find_common_free_slots(list(busy), window_start, window_end, timedelta(minutes=20))
+        self.assertEqual(unknown, set())
+
+        # minute by minute reference
+        taken = set(minute for spans in busy.values() for span_start, span_end in spans
+                    for minute in range(span_start, span_end))
+        expected, run = [], []
+        for minute in range(8 * 60, 20 * 60 + 1):
+            if minute < 20 * 60 and minute not in taken:
+                run.append(minute)
+            else:
+                if len(run) >= 20:
+                    expected.append((run[0], run[-1] + 1))
+                run = []
+        to_minutes = lambda dt: (dt.hour * 60 + dt.minute + 330) % (24 * 60)
+        self.assertEqual([(to_minutes(slot_start), to_minutes(slot_end)) for slot_start, slot_end in slots], expected)
+
+
+class TestTeamAnalytics(TestCase):
+
+    def setUp(self):
+        self.users = []
+        for number in range(5):
+            email = 'member%s@team.com' % number
+            user = User.objects.create(username=email, email=email)
+            calendar = Calendar.objects.create(user=user, cal_id=email, title=email, timezone='Asia/Kolkata',
+                                               events_sync_token='events_sync_token')
+            records = make_event_records(12 + number, prefix='m%s' % number, attendees=3)
+            for index, record in enumerate(records):
+                day = '2019-%02d-%02d' % (index % 5 + 1, index % 20 + 1)
+                record['start'] = {'dateTime': day + 'T10:00:00+05:30'}
+                record['end'] = {'dateTime': day + 'T%s:30:00+05:30' % (10 + index % 3)}
+                # members attend each other's meetings
+                record['attendees'].append({'email': 'member%s@team.com' % ((number + 1) % 5),
+                                            'responseStatus': 'accepted'})
+            get_or_create_events(calendar, records)
+            self.users.append(user)
+
+    def expected(self):
+        time_spent = busy_time = meetings = 0
+        collaborators = {}
+        epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        for user in self.users:
+            ca = SQLCalendarAnalytics(user, from_time=parser.parse('2019-01-01T00:00:00+05:30'),
+                                      to_time=parser.parse('2019-04-01T00:00:00+05:30'))
+            taken = set()
+            for start_time, end_time in ca.events.values_list('start_time', 'end_time'):
+                time_spent += int((end_time - start_time).total_seconds())
+                meetings += 1
+                first = int((start_time - epoch).total_seconds()) // 60
+                taken.update(range(first, first + int((end_time - start_time).total_seconds()) // 60))
+            busy_time += len(taken) * 60
+            for attendee in ca.max_meetings_with():
+                collaborators[attendee['email']] = collaborators.get(attendee['email'], 0) + attendee['count']
+        return time_spent, busy_time, meetings, collaborators
+
+    def check(self, data, members=5):
+        time_spent, busy_time, meetings, collaborators = self.expected()
+        self.assertEqual(data['members'], members)
+        self.assertEqual(data['time_spent'], time_spent)
+        self.assertEqual(data['busy_time'], busy_time)
+        self.assertEqual(data['meetings'], meetings)
+        self.assertEqual(sorted(data['months']), ['2019-01', '2019-02', '2019-03'])
+        self.assertEqual(sum(data['months'].values()), busy_time)
+        self.assertEqual(sum(data['weeks'].values()), busy_time)
+        self.assertTrue(all(parser.parse(week).weekday() == 0 for week in data['weeks']))
+        self.assertEqual(data['top_collaborators'],
+                         [{'email': email, 'count': count} for email, count
+                          in sorted(collaborators.items(), key=lambda item: (-item[1], item[0]))[:10]])
+        self.assertEqual([member['busy_time'] for member in data['busiest_members']],
+                         sorted([member['busy_time'] for member in data['busiest_members']], reverse=True))
+
+    def test_overlapping_meetings_are_busy_once(self):
+        records = make_event_records(1, prefix='overlap')
+        records[0]['start'] = {'dateTime': '2019-01-01T10:00:00+05:30'}
+        records[0]['end'] = {'dateTime': '2019-01-01T11:00:00+05:30'}
+        get_or_create_events(Calendar.objects.get(user=self.users[0]), records)
+
+        data = compute_team_analytics([user.pk for user in self.users], parser.parse('2019-01-01').date(),
+                                      parser.parse('2019-04-01').date())
+        self.check(data)
+        self.assertEqual(data['time_spent'] - data['busy_time'], 30 * 60)
+        member = [entry for entry in data['busiest_members'] if entry['email'] == 'member0@team.com'][0]
+        self.assertEqual(member['time_spent'] - member['busy_time'], 30 * 60)
+
+    def test_members_without_meetings_in_range_are_counted(self):
+        idle = User.objects.create(username='idle@team.com', email='idle@team.com')
+        Calendar.objects.create(user=idle, cal_id=idle.email, title=idle.email, timezone='UTC',
+                                events_sync_token='events_sync_token')
+        data = compute_team_analytics([user.pk for user in self.users] + [idle.pk],
+                                      parser.parse('2019-01-01').date(), parser.parse('2019-04-01').date(),
+                                      chunk_size=4)
+        self.check(data, members=6)
+        self.assertNotIn('idle@team.com', [member['email'] for member in data['busiest_members']])
+
+    def test_chunks_merge_into_team_totals(self):
+        data = compute_team_analytics([user.pk for user in self.users], parser.parse('2019-01-01').date(),
+                                      parser.parse('2019-04-01').date(), chunk_size=2)
+        self.check(data)
+        self.assertEqual(data, compute_team_analytics([user.pk for user in self.users],
+                                                      parser.parse('2019-01-01').date(),
+                                                      parser.parse('2019-04-01').date()))
+
+    def test_process_pool(self):
+        from multiprocessing.dummy import Pool as ThreadPool
+        # in-memory test database is shared with threads standing in for processes
+        shared = connections['default']
+        shared.allow_thread_sharing = True
+
+        def share_connection():
+            connections['default'] = shared
+
+        with mock.patch('apps.calendar.team.Pool', lambda processes: ThreadPool(processes, share_connection)):
+            data = compute_team_analytics([user.pk for user in self.users], parser.parse('2019-01-01').date(),
+                                          parser.parse('2019-04-01').date(), processes=3, chunk_size=1)
+        shared.allow_thread_sharing = False
+        self.check(data)
+
+    def test_api_is_for_admins(self):
+        params = {'from': '2019-01-01', 'to': '2019-04-01'}
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get('/analytics/team/', params).status_code, 403)
+
+        User.objects.filter(pk=self.users[0].pk).update(is_staff=True)
+        response = self.client.get('/analytics/team/', params)
+        self.assertEqual(response.status_code, 200)
+        self.check(response.data)
+        response = self.client.get('/analytics/team/', dict(params, emails='member1@team.com'))
+        self.assertEqual(response.data['members'], 1)
+        self.assertEqual(response.data['busiest_members'][0]['email'], 'member1@team.com')
+        self.assertEqual(self.client.get('/analytics/team/', {'from': '2019-04-01', 'to': '2019-01-01'})
+                         .status_code, 400)
+
+
+class TestExportEvents(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email, title=self.user.email,
+                                                timezone='Asia/Kolkata', events_sync_token='events_sync_token')
+        self.records = make_event_records(7, attendees=2)
+        self.records[0]['summary'] = u'Daily standup \u2615'
+        get_or_create_events(self.calendar, self.records)
+        other = User.objects.create(username='other', email='other@other.com')
+        get_or_create_events(Calendar.objects.create(user=other, cal_id=other.email, title=other.email,
+                                                     timezone='UTC', events_sync_token='events_sync_token'),
+                             make_event_records(3, prefix='other'))
+
+    def export(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_streams_ndjson_and_csv(self):
+        self.client.force_login(self.user)
+        lines = self.export('/export/events.ndjson').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(sorted(record['id'] for record in records), sorted(record['id'] for record in self.records))
+        first = [record for record in records if record['id'] == self.records[0]['id']][0]
+        self.assertEqual(first['title'], u'Daily standup \u2615')
+        self.assertEqual(first['topics'], ['standup'])
+        self.assertEqual(first['attendees'], [{'email': 'user0@admin.com', 'rsvp': 'accepted'},
+                                              {'email': 'user1@admin.com', 'rsvp': 'accepted'}])
+
+        rows = list(csv.DictReader(six.BytesIO(self.export('/export/events.csv')) if six.PY2
+                                   else six.StringIO(self.export('/export/events.csv').decode('utf-8'))))
+        self.assertEqual([row['id'] for row in rows], [record['id'] for record in records])
+        self.assertEqual(rows[records.index(first)]['attendees'], 'user0@admin.com:accepted;user1@admin.com:accepted')
+
+    def test_scope_and_parameters(self):
+        self.assertEqual(self.client.get('/export/events.csv').status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.export('/export/events.ndjson', all='1').splitlines()), 7)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(len(self.export('/export/events.ndjson', all='1').splitlines()), 10)
+        self.assertEqual(self.export('/export/events.ndjson', **{'from': '2019-06-25T00:00:00Z'}), b'')
+        self.assertEqual(self.client.get('/export/events.csv', {'to': '2019-06-25'}).status_code, 400)
+
+    def test_attendees_are_fetched_per_chunk(self):
+        # events, then Attendees and Topics of each of 3 chunks
+        with self.assertNumQueries(7):
+            records = list(iter_event_records(Event.objects.filter(calendar=self.calendar), chunk_size=3))
+        self.assertEqual(len(records), 7)
+
+    def test_command_writes_file(self):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('export_events', '--format', 'csv', '--output', path, '--calendar', str(self.calendar.pk),
+                     '--chunk-size', '2')
+        with open(path) as export:
+            self.assertEqual(len(list(csv.reader(export))), 8)
+
+        stdout = six.StringIO()
+        call_command('export_events', '--to', '2019-06-25T00:00:00+05:30', stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 10)
+
+
+class TestDailyRollup(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='admin', email='admin@admin.com')
+        self.calendar = Calendar.objects.create(user=self.user, cal_id=self.user.email,
+                                                title=self.user.email, timezone='Asia/Kolkata',
+                                                events_sync_token='events_sync_token')
+        self.records = make_analytics_records()
+        get_or_create_events(self.calendar, self.records)
+
+    def rollups(self, calendar=None):
+        return dict((rollup.day.isoformat(), (rollup.time_spent_seconds, rollup.busy_seconds, rollup.meetings,
+                                              rollup.get_topic_seconds()))
+                    for rollup in DailyRollup.objects.filter(calendar=calendar or self.calendar))
+
+    def test_ingest_maintains_rollups(self):
+        rollups = self.rollups()
+        self.assertEqual(len(rollups), 5)
+        self.assertEqual(rollups['2019-06-12'], (4500, 4500, 1, {'recruit': 4500}))
+        # topic terms are matched ignoring case
+        self.assertEqual(rollups['2019-01-11'], (3600, 3600, 1, {'standup': 3600}))
+
+    def test_changed_event_moves_to_its_new_day(self):
+        record = dict(self.records[0], updated='2019-07-01T00:00:00.000Z',
+                      start={'dateTime': '2019-06-12T20:00:00+05:30'},
+                      end={'dateTime': '2019-06-12T20:30:00+05:30'})
+        old_day = parse_datetime(self.records[0]['start']['dateTime']).date().isoformat()
+        get_or_create_events(self.calendar, [record])
+
+        rollups = self.rollups()
+        self.assertNotIn(old_day, rollups)
+        self.assertEqual(rollups['2019-06-12'][:3], (4500 + 1800, 4500 + 1800, 2))
+
+    def test_cancelled_event_is_removed_from_rollups(self):
+        get_or_create_events(self.calendar, [dict(self.records[0], status='cancelled')])
+        self.assertEqual(len(self.rollups()), 4)
+
+    def test_change_synced_by_one_calendar_updates_all_linking_it(self):
+        other = Calendar.objects.create(user=User.objects.create(username='other'), cal_id='other',
+                                        title='other', timezone='Europe/London')
+        get_or_create_events(other, self.records[:1])
+        record = dict(self.records[0], updated='2019-07-01T00:00:00.000Z',
+                      end={'dateTime': parse_datetime(self.records[0]['end']['dateTime'])
+                           .replace(hour=23).isoformat()})
+        get_or_create_events(self.calendar, [record])
+
+        duration = int((parse_datetime(record['end']['dateTime']) -
+                        parse_datetime(record['start']['dateTime'])).total_seconds())
+        self.assertEqual(list(self.rollups(other).values())[0][0], duration)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        expected = self.rollups()
+        DailyRollup.objects.all().delete()
+        DailyRollup.objects.create(calendar=self.calendar, day=parser.parse('2000-01-01').date(),
+                                   busy_seconds=10, meetings=1)
+
+        call_command('rebuild_rollups', stdout=six.StringIO())
+        self.assertEqual(self.rollups(), expected)
+
+    def test_rollup_backend_matches_sql_backend(self):
+        from_time = parser.parse('2018-12-01T00:00:00+05:30')
+        rollup = RollupCalendarAnalytics(self.user, from_time=from_time)
+        sql = SQLCalendarAnalytics(self.user, from_time=from_time)
+        for method in ('total_time_spent_by_month', 'total_time_spent_by_week',
+                       'avg_time_spent_by_week', 'avg_meetings_by_week'):
+            self.assertEqual(getattr(rollup, method)(), getattr(sql, method)(), method)
+        self.assertEqual(rollup.time_spent_by_topic(), sql.time_spent_by_topic())
+
+        with self.assertNumQueries(1):
+            rollup.total_time_spent_by_week()
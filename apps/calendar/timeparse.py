@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+
+from datetime import datetime
+
+import pytz
+from dateutil import parser
+
+# Google sends RFC3339 'dateTime' i.e. 2015-06-19T16:20:45.000Z or
+# 2015-08-03T10:15:00+05:30 and 'date' i.e. 2015-08-03 for all day events.
+# These fixed formats are parsed by slicing, anything else falls back to dateutil.
+
+_TIMEZONES = {}
+_OFFSETS = {'Z': pytz.utc, 'z': pytz.utc, '+00:00': pytz.utc, '-00:00': pytz.utc}
+_DATES = {}
+# all day dates repeat a lot, cache is cleared once it grows beyond this
+_DATES_CACHE_SIZE = 10000
+
+
+def get_timezone(time_zone):
+    """
+    Cached pytz.timezone
+    :param time_zone: 'Asia/Kolkata'
+    :return: <tzinfo obj>
+    """
+    try:
+        return _TIMEZONES[time_zone]
+    except KeyError:
+        tz = _TIMEZONES[time_zone] = pytz.timezone(time_zone)
+        return tz
+
+
+def _get_offset(designator):
+    """
+    Returns tzinfo of RFC3339 offset i.e. 'Z' or '+05:30'
+    """
+    try:
+        return _OFFSETS[designator]
+    except KeyError:
+        if len(designator) != 6 or designator[0] not in '+-' or designator[3] != ':':
+            raise ValueError("Invalid offset %r" % designator)
+        minutes = int(designator[1:3]) * 60 + int(designator[4:6])
+        tz = _OFFSETS[designator] = pytz.FixedOffset(-minutes if designator[0] == '-' else minutes)
+        return tz
+
+
+def parse_datetime(value):
+    """
+    Parses RFC3339 timestamp
+    :param value: '2015-08-03T10:15:00+05:30'
+    :return: aware datetime in offset of value
+    """
+    try:
+        if value[4] != '-' or value[7] != '-' or value[10] not in 'Tt ' \
+                or value[13] != ':' or value[16] != ':':
+            raise ValueError(value)
+        microsecond = 0
+        end = 19
+        if value[19] == '.':
+            end = 20
+            while value[end].isdigit():
+                end += 1
+            microsecond = int((value[20:end] + '000000')[:6])
+        return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                        microsecond, _get_offset(value[end:]))
+    except (ValueError, IndexError, TypeError):
+        return parser.parse(value)
+
+
+def parse_date(value, time_zone):
+    """
+    Parses all day date as midnight of Calendar's timezone
+    :param value: '2015-08-03'
+    :param time_zone: 'Asia/Kolkata'
+    :return: aware datetime
+    """
+    key = (value, time_zone)
+    try:
+        return _DATES[key]
+    except KeyError:
+        pass
+    try:
+        if len(value) != 10 or value[4] != '-' or value[7] != '-':
+            raise ValueError(value)
+        naive = datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+    except ValueError:
+        naive = parser.parse(value)
+    if len(_DATES) >= _DATES_CACHE_SIZE:
+        _DATES.clear()
+    dt = _DATES[key] = get_timezone(time_zone).localize(naive)
+    return dt
+
+
+def parse_timestamp(value, time_zone):
+    """
+    Parses either 'date' or 'dateTime' value
+    :param value: '2015-08-03' or '2015-08-03T10:15:00+05:30'
+    :param time_zone: Calendar's timezone, used for dates only
+    :return: aware datetime
+    """
+    if len(value) == 10:
+        return parse_date(value, time_zone)
+    return parse_datetime(value)
+
+
+def parse_timestamps(values, time_zone):
+    """
+    Batch mode, parses a page of 'date' and 'dateTime' values at once,
+    repeated values of the page are parsed once
+    :param values: ['2015-08-03', '2015-08-03T10:15:00+05:30']
+    :param time_zone: Calendar's timezone, used for dates only
+    :return: [aware datetime] in order of values
+    """
+    parsed = {}
+    result = []
+    for value in values:
+        try:
+            result.append(parsed[value])
+        except KeyError:
+            dt = parsed[value] = parse_timestamp(value, time_zone)
+            result.append(dt)
+    return result
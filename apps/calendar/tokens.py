@@ -0,0 +1,145 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.db import transaction
+from django.utils import timezone
+from google.auth import exceptions
+from google.oauth2.credentials import Credentials
+
+from apps.authenticate.models import UserOauthToken
+from apps.calendar.google_api import get_credentials
+from apps.calendar.utils import request_access_token
+
+logger = logging.getLogger(__name__)
+
+# Refresh is attempted these many times before giving up
+MAX_REFRESH_ATTEMPTS = 3
+# Delay before second attempt, doubled for every next attempt
+REFRESH_RETRY_DELAY = 0.5
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class TokenRefreshError(Exception):
+    """
+    Access Token could not be refreshed i.e. User revoked the access
+    """
+
+
+def _get_lock(user_id):
+    """
+    Returns lock used by threads of this process refreshing token of User
+    """
+    with _locks_lock:
+        if user_id not in _locks:
+            _locks[user_id] = threading.Lock()
+        return _locks[user_id]
+
+
+def _request_with_retries(refresh_token):
+    """
+    Requests new Access Token, network errors and 5xx are retried
+    MAX_REFRESH_ATTEMPTS times, rejected refresh token is not retried
+    :return: {'access_token': 'token', 'expires_in': 3600}
+    """
+    delay = REFRESH_RETRY_DELAY
+    for attempt in range(1, MAX_REFRESH_ATTEMPTS + 1):
+        try:
+            return request_access_token(refresh_token)
+        except requests.HTTPError as error:
+            if error.response is not None and error.response.status_code < 500:
+                raise TokenRefreshError("Refresh token rejected: %s" % error.response.text)
+            if attempt == MAX_REFRESH_ATTEMPTS:
+                raise TokenRefreshError("Token refresh failed: %s" % error)
+        except requests.RequestException as error:
+            if attempt == MAX_REFRESH_ATTEMPTS:
+                raise TokenRefreshError("Token refresh failed: %s" % error)
+        logger.warning("Token refresh attempt %s failed, retrying in %ss", attempt, delay)
+        time.sleep(delay)
+        delay *= 2
+
+
+def get_access_token(user, rejected_token=None):
+    """
+    Returns valid Access Token of User, token is refreshed proactively
+    when it is about to expire or when 'rejected_token' is still the stored one
+
+    Concurrent refreshes of a User are coalesced into one request: threads
+    of a process wait on a per User lock and processes wait on the row lock
+    of UserOauthToken (SELECT ... FOR UPDATE). Whoever gets the lock second
+    finds the fresh token and does not refresh again.
+    :param user: <User> instance
+    :param rejected_token: Access Token which Google rejected
+    :return: 'access_token'
+    """
+    def needs_refresh(user_oauth):
+        if rejected_token is not None:
+            return user_oauth.access_token == rejected_token
+        return user_oauth.is_token_expired()
+
+    user_oauth = UserOauthToken.objects.get(user=user)
+    if not needs_refresh(user_oauth):
+        return user_oauth.access_token
+
+    with _get_lock(user.pk):
+        with transaction.atomic():
+            user_oauth = UserOauthToken.objects.select_for_update().get(user=user)
+            if not needs_refresh(user_oauth):
+                return user_oauth.access_token
+
+            response = _request_with_retries(user_oauth.refresh_token)
+            user_oauth.access_token = response['access_token']
+            user_oauth.token_expiry = timezone.now() + timedelta(seconds=int(response.get('expires_in', 3600)))
+            # Google may rotate the refresh token
+            user_oauth.refresh_token = response.get('refresh_token', user_oauth.refresh_token)
+            user_oauth.save(update_fields=['access_token', 'token_expiry', 'refresh_token'])
+            logger.info("Refreshed access token of user %s", user.pk)
+            return user_oauth.access_token
+
+
+class ManagedCredentials(Credentials):
+    """
+    google.auth Credentials whose refresh goes through 'get_access_token',
+    so refreshes triggered by a 401 from Google are coalesced and stored too
+    """
+
+    def __init__(self, user, user_oauth):
+        base = get_credentials(user_oauth.access_token, user_oauth.refresh_token)
+        super(ManagedCredentials, self).__init__(
+            token=base.token,
+            refresh_token=base.refresh_token,
+            token_uri=base.token_uri,
+            client_id=base.client_id,
+            client_secret=base.client_secret,
+            scopes=base.scopes,
+        )
+        self.user = user
+        self.expiry = self._naive_utc(user_oauth.token_expiry)
+
+    @staticmethod
+    def _naive_utc(value):
+        # google.auth compares expiry with naive utcnow()
+        return timezone.make_naive(value, timezone.utc) if timezone.is_aware(value) else value
+
+    def refresh(self, request):
+        try:
+            self.token = get_access_token(self.user, rejected_token=self.token)
+        except TokenRefreshError as error:
+            raise exceptions.RefreshError(str(error))
+        self.expiry = self._naive_utc(UserOauthToken.objects.get(user=self.user).token_expiry)
+
+
+def get_user_credentials(user):
+    """
+    Credentials of User with a valid Access Token
+    :param user: <User> instance
+    :return: <ManagedCredentials>
+    """
+    get_access_token(user)
+    return ManagedCredentials(user, UserOauthToken.objects.get(user=user))
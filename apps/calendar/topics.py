@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict, deque
+
+from django.db import transaction
+
+from apps.calendar.models import Event, EventTopic, Topic
+from apps.calendar.utils import chunks
+
+# Events retagged in one transaction by reclassify_events
+RECLASSIFY_CHUNK_SIZE = 1000
+
+
+class TopicMatcher(object):
+    """
+    Aho-Corasick automaton over terms of all Topics, a title is matched
+    against every term in one pass over its characters.
+    Terms are literal and matched ignoring case.
+    """
+
+    def __init__(self, taxonomy, topic_ids=None):
+        """
+        :param taxonomy: OrderedDict {'standup': ['standup', 'Stand up']}
+        :param topic_ids: {'standup': topic_pk} of stored Topics
+        """
+        self.topics = list(taxonomy)
+        self.topic_ids = topic_ids or {}
+        # state 0 is the root, output of a state are indexes of topics ending at it
+        self._goto, self._output = [{}], [set()]
+        for index, terms in enumerate(taxonomy.values()):
+            for term in terms:
+                if term:
+                    self._output[self._add_term(term.lower())].add(index)
+        self._fail = [0] * len(self._goto)
+        self._link_failures()
+
+    def _add_term(self, term):
+        state = 0
+        for char in term:
+            if char not in self._goto[state]:
+                self._goto[state][char] = len(self._goto)
+                self._goto.append({})
+                self._output.append(set())
+            state = self._goto[state][char]
+        return state
+
+    def _link_failures(self):
+        # breadth first, failure of a state is the longest suffix which is a prefix of a term
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if state else 0
+                self._output[child] |= self._output[self._fail[child]]
+
+    def match(self, title):
+        """
+        Topics of a meeting
+        :param title: 'Interview (Lead Mobile Developer)'
+        :return: ['recruit'] in order of taxonomy
+        """
+        found = set()
+        state = 0
+        for char in (title or '').lower():
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                found |= self._output[state]
+        return [self.topics[index] for index in sorted(found)]
+
+
+def load_matcher():
+    """
+    TopicMatcher of stored Topics
+    """
+    topics = list(Topic.objects.order_by('pk'))
+    return TopicMatcher(OrderedDict((topic.name, topic.get_terms()) for topic in topics),
+                        topic_ids=dict((topic.name, topic.pk) for topic in topics))
+
+
+def build_event_topics(matcher, events):
+    """
+    Topic tags of events
+    :param events: [(event_id, title)]
+    :return: [<EventTopic> instance] unsaved
+    """
+    return [EventTopic(event_id=event_id, topic_id=matcher.topic_ids[topic])
+            for event_id, title in events for topic in matcher.match(title)]
+
+
+def reclassify_events(matcher=None, chunk_size=RECLASSIFY_CHUNK_SIZE):
+    """
+    Rebuilds Topic tags of all stored Events, i.e. after Topics changed
+    :return: (number of Events, number of tags)
+    """
+    matcher = matcher or load_matcher()
+    events = tags = 0
+    for chunk in chunks(Event.objects.order_by('pk').values_list('id', 'title').iterator(), chunk_size):
+        event_topics = build_event_topics(matcher, chunk)
+        with transaction.atomic():
+            EventTopic.objects.filter(event_id__in=[event_id for event_id, _ in chunk]).delete()
+            EventTopic.objects.bulk_create(event_topics)
+        events += len(chunk)
+        tags += len(event_topics)
+    return events, tags
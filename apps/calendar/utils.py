@@ -1,56 +1,80 @@
-import json
-from urllib import urlencode
-from urllib2 import Request, urlopen
+from __future__ import absolute_import
 
 from django.apps import apps
 from django.conf import settings
-from oauth2client import client
+
+from apps.calendar.google_api import get_session, HTTP_TIMEOUT
 
 UserOauthToken = apps.get_model('authenticate', 'UserOauthToken')
 Calendar = apps.get_model('calendar', 'Calendar')
 
+# Rows written per INSERT and ids sent per IN (...) lookup. Kept below
+# SQLite's limit of 999 bound variables per statement.
+BULK_CHUNK_SIZE = 500
+
+
+def chunks(items, size=BULK_CHUNK_SIZE):
+    """
+    Splits iterable into lists of 'size' items, items are consumed lazily
+    :param items: [1, 2, 3]
+    :param size: 2
+    :return: [[1, 2], [3]]
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 
 def get_calendar_list(user, service):
     """
     Get All Calendars of User including secondary
+    Expired Access Token is refreshed by service's credentials,
+    see apps.calendar.tokens.ManagedCredentials
     :param user: <User> Instance
-    :param service: GoogleCredentials Service
+    :param service: Google Calendar API service
     :return: [<List of Calendars>]
     """
-    try:
-        calendars = []
-        page_token = None
-        while True:
-            calendar_list = service.calendarList().list(pageToken=page_token).execute()
-            calendars.extend(calendar_list['items'])
-            page_token = calendar_list.get('nextPageToken')
-            if not page_token:
-                break
-        return calendars
-    except (client.AccessTokenRefreshError, client.FlowExchangeError, client.AccessTokenCredentialsError, ValueError):
-        # The credentials have been revoked or expired, please re-run the application to re-authorize.
-        user.useroauthtoken.access_token  = get_new_access_token(user.useroauthtoken)
-        user.useroauthtoken.save()
-        return get_calendar_list(user, service)
+    calendars = []
+    page_token = None
+    while True:
+        calendar_list = service.calendarList().list(pageToken=page_token).execute()
+        calendars.extend(calendar_list['items'])
+        page_token = calendar_list.get('nextPageToken')
+        if not page_token:
+            break
+    return calendars
+
+
+def request_access_token(refresh_token):
+    """
+    Exchanges Refresh Token for a new Access Token
+    :param refresh_token: Refresh Token of User
+    :return: {'access_token': 'token', 'expires_in': 3600, ...}
+    """
+    response = get_session().post(settings.GOOGLE_TOKEN_URI,
+                                  data={
+                                      'grant_type': 'refresh_token',
+                                      'client_id': settings.CALENDAR_CLIENT_ID,
+                                      'client_secret': settings.CALENDAR_CLIENT_SECRET,
+                                      'refresh_token': refresh_token
+                                  },
+                                  headers={
+                                      'Accept': 'application/json'
+                                  },
+                                  timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
 
 
 def get_new_access_token(refresh_token):
     """
     gets new Access Token when existing Access Token expires
-    :param useroauthtoken: <USerOauthToken Instance
+    :param refresh_token: Refresh Token of User
     :return: New access_token
     """
-    request = Request('https://accounts.google.com/o/oauth2/token',
-                      data=urlencode({
-                          'grant_type': 'refresh_token',
-                          'client_id': settings.CALENDAR_CLIENT_ID,
-                          'client_secret': settings.CALENDAR_CLIENT_SECRET,
-                          'refresh_token': refresh_token
-                      }),
-                      headers={
-                          'Content-Type': 'application/x-www-form-urlencoded',
-                          'Accept': 'application/json'
-                      }
-                      )
-    response = json.load(urlopen(request))
-    return response['access_token']
+    return request_access_token(refresh_token)['access_token']
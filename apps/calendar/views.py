@@ -1,159 +1,174 @@
 from __future__ import absolute_import
 
-import pytz
-from dateutil import parser
-from django.conf import settings
-from django.contrib.auth.models import User
-from django.db import transaction
-from django.http import HttpResponseRedirect
-from django.urls import reverse
-from django.views.generic.base import View
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-
-from apps.authenticate.models import UserOauthToken
-from apps.calendar.models import Event, Attendee, Account, Calendar
-from apps.calendar.utils import get_new_access_token
-
+from datetime import timedelta
 
-class FetchEventView(View):
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from apps.calendar.availability import find_common_free_slots
+from apps.calendar.export import EXPORT_CONTENT_TYPES, iter_event_records, iter_export
+from apps.calendar.identity import AccountResolver
+from apps.calendar.ingest import EventIngestor, get_organiser_email
+from apps.calendar.jobs import enqueue_sync
+from apps.calendar.models import Attendee, Event, SyncJob
+from apps.calendar.timeparse import parse_datetime
+
+
+class FetchEventView(APIView):
     """
     Redirected when user gives consent to access the calendar data and
     system gets AccessToken and RefreshToken
 
     With help of these AccessToken and RefreshToken we can do further
-    queries to Google Calendar
+    queries to Google Calendar, queries are done by 'sync_worker'
+    command so this view only enqueues a SyncJob for User
     """
+    permission_classes = (IsAuthenticated,)
 
     def get(self, request):
-        user_oauth = UserOauthToken.objects.get(user=request.user)
-
-        if user_oauth.is_token_expired():
-            user_oauth.access_token = get_new_access_token(user_oauth.refresh_token)
-            user_oauth.save()
-
-        credentials = Credentials(
-            token=user_oauth.access_token,
-            refresh_token=user_oauth.refresh_token,
-            client_id=settings.CALENDAR_CLIENT_ID,
-            token_uri=settings.CALENDAR_OAUTH_REDIRECT_URI,
-            client_secret=settings.CALENDAR_CLIENT_SECRET,
-            scopes=settings.CALENDAR_SCOPE
-        )
-        service = build("calendar", "v3", credentials=credentials)
-        calendar_record = service.calendars().get(calendarId='primary').execute()
-
-        calendar = get_or_create_calendar(user_oauth.user, calendar_record)
-        # sync_token will make sure we are not fetching same events again and again
-        sync_token = calendar.events_sync_token or None
-        events = []
-        page_token = None
-        while True:
-            response = service.events().list(calendarId='primary',
-                                             pageToken=page_token,
-                                             syncToken=sync_token).execute()
-            events.extend(response['items'])
-            page_token = response.get('nextPageToken')
-            if not page_token:
-                # store the nextSyncToken in calendar as it belongs to calendar only
-                calendar.events_sync_token = response.get("nextSyncToken")
-                calendar.save()
-                break
-
-        get_or_create_events(calendar, events)
-
+        enqueue_sync(request.user)
         return HttpResponseRedirect(reverse('analytics'))
 
 
-def get_or_create_events(calendar, events):
+class SyncJobStatusAPIView(APIView):
+    """
+    Status and progress of User's latest sync job
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        job = SyncJob.objects.filter(user=request.user).order_by('-created_at', '-pk').first()
+        if job is None:
+            return Response({'status': None})
+        return Response({
+            'status': job.status,
+            'attempts': job.attempts,
+            'pages_synced': job.pages_synced,
+            'events_synced': job.events_synced,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+            'last_error': job.last_error,
+        })
+
+
+class AvailabilityAPIView(APIView):
+    """
+    Slots in which all given people are free:
+    GET /availability/?emails=a@a.com,b@b.com&from=2019-06-24T09:00:00+05:30&to=2019-06-29T18:00:00+05:30&minutes=30
+
+    People are Users whose Calendars are synced or Accounts attending synced
+    events, 'unknown' lists emails which are neither
+    """
+    permission_classes = (IsAuthenticated,)
+    MAX_PARTICIPANTS = 200
+    MAX_WINDOW = timedelta(days=62)
+
+    def get(self, request):
+        params = request.query_params
+        emails = [email.strip() for email in params.get('emails', '').split(',') if email.strip()]
+        if not emails or len(emails) > self.MAX_PARTICIPANTS:
+            raise ValidationError({'emails': "Comma separated list of 1 to %s emails" % self.MAX_PARTICIPANTS})
+        window_start, window_end = parse_timestamp_param(params, 'from'), parse_timestamp_param(params, 'to')
+        if not timedelta(0) < window_end - window_start <= self.MAX_WINDOW:
+            raise ValidationError({'to': "Must be after 'from' and within %s days" % self.MAX_WINDOW.days})
+        try:
+            minutes = int(params.get('minutes', 30))
+        except ValueError:
+            minutes = 0
+        if minutes <= 0:
+            raise ValidationError({'minutes': "Positive number of minutes is required"})
+
+        slots, unknown = find_common_free_slots(emails, window_start, window_end, timedelta(minutes=minutes))
+        return Response({
+            'from': window_start.isoformat(),
+            'to': window_end.isoformat(),
+            'minutes': minutes,
+            'unknown': sorted(unknown),
+            'slots': [{'start': start.isoformat(), 'end': end.isoformat(),
+                       'minutes': int((end - start).total_seconds()) // 60}
+                      for start, end in slots],
+        })
+
+
+class ExportEventsAPIView(APIView):
+    """
+    Streams events of User's Calendars with their attendees as CSV or NDJSON:
+    GET /export/events.csv?from=2019-01-01T00:00:00+05:30&to=2019-07-01T00:00:00+05:30
+    GET /export/events.ndjson?all=1
+
+    'from' and 'to' are optional, admins get events of all Calendars with 'all=1'.
+    Bytes are sent as events are read so exports of any size run in constant memory
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, output):
+        params = request.query_params
+        events = Event.objects.all()
+        if not (request.user.is_staff and params.get('all') == '1'):
+            events = events.filter(calendar__user=request.user)
+        if 'from' in params:
+            events = events.filter(start_time__gte=parse_timestamp_param(params, 'from'))
+        if 'to' in params:
+            events = events.filter(start_time__lt=parse_timestamp_param(params, 'to'))
+
+        response = StreamingHttpResponse(iter_export(iter_event_records(events), output),
+                                         content_type=EXPORT_CONTENT_TYPES[output])
+        response['Content-Disposition'] = 'attachment; filename="events.%s"' % output
+        return response
+
+
+def parse_timestamp_param(params, name):
+    """
+    Required RFC3339 timestamp query parameter
+    :return: aware datetime
+    """
+    try:
+        value = parse_datetime(params[name])
+    except (KeyError, ValueError, OverflowError):
+        value = None
+    if value is None or timezone.is_naive(value):
+        raise ValidationError({name: "Timestamp with offset i.e. 2019-06-24T09:00:00+05:30 is required"})
+    return value
+
+
+def get_or_create_events(calendar, events, resolver=None):
     """
     Crates a unique event from Google Event ID
     This event then linked to calendar
     :param calendar: <Calendar> instance
     :param events: List of Event dicts from Google API
+    :param resolver: <AccountResolver> shared by all pages of a sync
     :return:[<Event instance>]
     """
-    data = []
-    with transaction.atomic():
-        for record in events:
-            if record['status'] == 'cancelled':
-                return
-            try:
-                event = Event.objects.get(id=record['id'])
-            except Event.DoesNotExist:
-
-                organiser = get_organiser(record)
-
-                event = Event(id=record['id'])
-                event.location = record.get('location', '')
-                event.event_link = record['htmlLink']
-                event.title = record.get('summary', '')
-                event.description = record.get('description', '')
-                event.organiser = organiser
-
-                start = record.get('start')
-                if start.get("dateTime"):
-                    start_time = get_utc_time(record['start']['dateTime'], calendar.timezone)
-                else:
-                    start_time = get_utc_time(record['start']['date'], calendar.timezone, is_date=True)
-
-                end = record.get('end')
-                if end.get("dateTime"):
-                    end_time = get_utc_time(record['end']["dateTime"], calendar.timezone)
-                else:
-                    end_time = get_utc_time(record['end']["date"], calendar.timezone, is_date=True)
-
-                event.start_time = start_time
-                event.end_time = end_time
-
-                event.created_at = get_utc_time(record["created"], calendar.timezone)
-                event.updated_at = get_utc_time(record["updated"], calendar.timezone)
-                event.save()
-                if record.get('attendees'):
-                    create_attendees(event, record['attendees'])
-            data.append(event)
-            event.calendar.add(calendar)
-    return data
-
-
-def create_attendees(event, attendees_records):
+    return EventIngestor(calendar, resolver=resolver).ingest(events)
+
+
+def create_attendees(event, attendees_records, resolver=None):
     """
     Creates Attendee for a single Event
     :param event: <Event> Instance
     :param attendees_dict: [{'email': 'email', 'responseStatus': 'status'}]
+    :param resolver: <AccountResolver> instance
     :return:
     """
+    resolver = resolver or AccountResolver()
+    accounts = resolver.resolve(record.get('email') for record in attendees_records)
     attendees = []
     for record in attendees_records:
-        email = record.get('email')
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
-            user = None
-
-        account, _ = Account.objects.get_or_create(email=email, user=user)
-        attendee, _ = Attendee.objects.update_or_create(account=account,
+        attendee, _ = Attendee.objects.update_or_create(account=accounts[record.get('email')],
                                                         event=event,
-                                                        rsvp=record['responseStatus'])
+                                                        defaults={'rsvp': record['responseStatus']})
         attendees.append(attendee)
     return attendees
 
 
-def get_utc_time(timezone_aware_ts, time_zone, is_date=False):
-    """
-    Converts datetime str to UTC datetime obj
-    :param timezone_aware_ts: String rep of datetime
-    :param time_zone: Calander time_zone
-    :param is_date: is timezone_aware_ts date ?
-    :return: utc aware datetime
-    """
-    tz = pytz.timezone(time_zone)
-    if is_date:
-        return tz.localize(parser.parse(timezone_aware_ts))
-    return parser.parse(timezone_aware_ts)
-
-
-def get_organiser(record):
+def get_organiser(record, resolver=None):
     """
     Returns if organiser is present in data
     else retruen creator
@@ -163,39 +178,9 @@ def get_organiser(record):
                                'email': 'creator@gmail.com',
                                'self': True}
                     }
+    :param resolver: <AccountResolver> instance
     :return:
     """
-    if record.get("organizer"):
-        email = record['organizer']['email']
-        if email == "unknownorganizer@calendar.google.com":
-            email = record['creator']['email']
-    else:
-        email = record['creator']['email']
-    try:
-        user = User.objects.get(email=email)
-    except User.DoesNotExist:
-        user = None
-    organiser, _ = Account.objects.get_or_create(email=email, user=user)
-    return organiser
-
-
-def get_or_create_calendar(user, calendar_record):
-    """
-    Look if calendar  already exists for user
-    If exists then update title and timezone which are dynamic
-    If not then creat new one
-    :param calendar_record:{'id': 'sarukumesh@gmail.com',
-                             'summary': 'sarukumesh@gmail.com',
-                             'timeZone': 'Asia/Calcutta'}
-    :param request:
-    :return:
-    """
-    # from apps.calendar.models import Calendar
-    calendar, _ = Calendar.objects.update_or_create(user=user,
-                                                    cal_id=calendar_record["id"],
-                                                    defaults={
-                                                        'title': calendar_record["summary"],
-                                                        'timezone': calendar_record["timeZone"],
-                                                    })
+    resolver = resolver or AccountResolver()
+    return resolver.get(get_organiser_email(record))
 
-    return calendar
@@ -144,4 +144,30 @@ CALENDAR_CLIENT_ID = os.environ.get('CALENDAR_CLIENT_ID')
 CALENDAR_CLIENT_SECRET = os.environ.get('CALENDAR_CLIENT_SECRET')
 CALENDAR_OAUTH_REDIRECT_URI = os.environ.get('CALENDAR_OAUTH_REDIRECT_URI')
 CALENDAR_SCOPE = os.environ.get('CALENDAR_SCOPE')
-GOOGLE_TOKEN_URI = os.environ.get('GOOGLE_TOKEN_URI')
+GOOGLE_TOKEN_URI = os.environ.get('GOOGLE_TOKEN_URI', 'https://accounts.google.com/o/oauth2/token')
+# Calendar API discovery document is read from here, fetched once if missing
+CALENDAR_DISCOVERY_CACHE = os.environ.get('CALENDAR_DISCOVERY_CACHE',
+                                          os.path.join(BASE_DIR, '.cache', 'calendar.v3.json'))
+# Overrides rootUrl of Calendar API i.e. to point it to a local stand-in server
+CALENDAR_API_ROOT_URL = os.environ.get('CALENDAR_API_ROOT_URL')
+
+SYNC_CALENDAR_THREADS = int(os.environ.get('SYNC_CALENDAR_THREADS', 8))
+
+# Computes analytics from daily 'rollup' rows, with 'sql' aggregation queries,
+# in 'pandas' from all events or from columnar 'snapshot' files of events.
+# Rollups of existing events are backfilled by migrations, 'rebuild_rollups' recomputes them
+CALENDAR_ANALYTICS_BACKEND = os.environ.get('CALENDAR_ANALYTICS_BACKEND', 'rollup')
+
+# Analytics results are cached across requests until Calendar's events change,
+# BACKEND is 'locmem', 'file', 'django' (LOCATION is then an alias of CACHES) or '' to disable
+CALENDAR_ANALYTICS_CACHE = {
+    'BACKEND': os.environ.get('CALENDAR_ANALYTICS_CACHE', 'locmem'),
+    'LOCATION': os.environ.get('CALENDAR_ANALYTICS_CACHE_LOCATION'),
+    'MAX_ENTRIES': int(os.environ.get('CALENDAR_ANALYTICS_CACHE_MAX_ENTRIES', 1000)),
+}
+
+# Columnar snapshots of Calendars' events read by the 'snapshot' analytics backend
+CALENDAR_SNAPSHOT_DIR = os.environ.get('CALENDAR_SNAPSHOT_DIR', os.path.join(BASE_DIR, '.cache', 'snapshots'))
+
+# Processes computing team analytics, 1 computes them in the web process
+TEAM_ANALYTICS_PROCESSES = int(os.environ.get('TEAM_ANALYTICS_PROCESSES', 1))
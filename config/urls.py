@@ -5,8 +5,8 @@ from django.contrib import admin
 from django.views.decorators.csrf import csrf_exempt
 
 from apps.authenticate.views import OAuth, OAuth2CallBack
-from apps.calendar.api import AnalyticsAPIView
-from apps.calendar.views import FetchEventView
+from apps.calendar.api import AnalyticsAPIView, AnalyticsRangeAPIView, TeamAnalyticsAPIView
+from apps.calendar.views import AvailabilityAPIView, ExportEventsAPIView, FetchEventView, SyncJobStatusAPIView
 from apps.views import index
 
 urlpatterns = [
@@ -15,7 +15,12 @@ urlpatterns = [
     url(r'^oauth-login/$', csrf_exempt(OAuth.as_view()), name='oauth'),
     url(r'^oauth-callback/$', OAuth2CallBack.as_view(), name='oauth2_callback'),
     url(r'^fetch-events/$', FetchEventView.as_view(), name='fetch_events'),
+    url(r'^sync-status/$', SyncJobStatusAPIView.as_view(), name='sync_status'),
     url(r'^analytics/$', AnalyticsAPIView.as_view(), name='analytics'),
+    url(r'^analytics/range/$', AnalyticsRangeAPIView.as_view(), name='analytics_range'),
+    url(r'^analytics/team/$', TeamAnalyticsAPIView.as_view(), name='analytics_team'),
+    url(r'^availability/$', AvailabilityAPIView.as_view(), name='availability'),
+    url(r'^export/events\.(?P<output>csv|ndjson)$', ExportEventsAPIView.as_view(), name='export_events'),
 ]
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)